@@ -1,14 +1,64 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, make_response
+import time
+_STARTUP_STARTED = time.perf_counter()  # 啟動耗時報告的起點，需在其他 import 之前
+
+from flask import (Flask, render_template, request, jsonify, session, redirect, url_for, flash, make_response, send_file,
+                   abort, g, Response, stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import case, delete, event, func, insert, or_, select, tuple_, update
+from sqlalchemy.orm import load_only
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
 from werkzeug.utils import secure_filename
-from datetime import datetime
+from datetime import date as date_type, datetime, timedelta
 import os
 import secrets
 import logging
 import traceback
 import base64
+import binascii
+import hashlib
+import json
+import zipfile
+import io
+import csv
+import itertools
+import contextlib
+import functools
+import threading
+from collections import Counter
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 fcntl，只能靠程序內的鎖
+    fcntl = None
+import click
 from dotenv import load_dotenv
+from photo_store import (InvalidPhotoError, create_photo_store, decode_data_url, digest_from_reference,
+                         is_data_url, is_valid_digest, photo_url, sniff_mimetype)
+from thumbnails import DERIVATIVE_SIZES, ThumbnailGenerator
+import migrations
+import search
+from response_cache import create_response_cache
+from serialization import FastJSONProvider, dumps as json_dumps, iter_json_array
+from geo import encode_geohash, has_location, parse_bbox, precision_for_zoom
+from gazetteer import Gazetteer, DEFAULT_PATH as DEFAULT_GAZETTEER_PATH
+from password_hashing import HashingBusyError, PasswordHasher
+from user_cache import CachedUser, UserCache
+from uploads import PhotoUploadRequest
+from jobs import JobScheduler
+from compression import ResponseCompressor
+from travel_stats import TravelPoints, TravelStatsCache, available as travel_stats_available
+from db_routing import RoutingSession, current_replica, replica_binds, replica_engines, use_primary, use_replica
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, COUNT_BUCKETS, Registry, SQLInstrumentation, TimedQueuePool
+
+# 啟動耗時 (毫秒)：imports / config / routes 在載入模組時記錄，database 在各 worker 第一次請求時記錄
+STARTUP_TIMINGS = {}
+_startup_clock = [_STARTUP_STARTED]
+
+def _mark_startup(stage):
+    now = time.perf_counter()
+    STARTUP_TIMINGS[stage] = round((now - _startup_clock[0]) * 1000, 1)
+    _startup_clock[0] = now
+
+_mark_startup('imports')
 
 # 載入環境變數
 load_dotenv()
@@ -18,6 +68,7 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', secrets.token_hex(16))
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 限制上傳檔案大小為 16MB
 
@@ -26,6 +77,55 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# 照片儲存設定 (以內容雜湊為鍵，Journal.photo 只存 /photos/<hash> 參照)
+app.config['PHOTO_STORAGE_BACKEND'] = os.environ.get('PHOTO_STORAGE_BACKEND', 'local')
+app.config['PHOTO_STORAGE_DIR'] = os.environ.get('PHOTO_STORAGE_DIR', os.path.join(app.instance_path, 'photos'))
+PHOTO_CACHE_MAX_AGE = 365 * 24 * 60 * 60  # 照片內容不可變，快取一年
+
+photo_store = create_photo_store(app.config['PHOTO_STORAGE_BACKEND'], root=app.config['PHOTO_STORAGE_DIR'])
+
+# 照片上傳 (/api/photos) 以 multipart 串流接收：邊寫入暫存檔邊計算雜湊，超過上限或不是圖片時立即中止
+app.config['MAX_PHOTO_BYTES'] = int(os.environ.get('MAX_PHOTO_BYTES', 10 * 1024 * 1024))
+
+class TravelJournalRequest(PhotoUploadRequest):
+    photo_upload_endpoints = frozenset({'upload_photo'})
+    max_photo_bytes = app.config['MAX_PHOTO_BYTES']
+
+app.request_class = TravelJournalRequest
+
+# 縮圖 (卡片 / 彈窗 / 全尺寸) 在背景執行緒產生，快取於磁碟
+app.config['PHOTO_DERIVATIVE_DIR'] = os.environ.get('PHOTO_DERIVATIVE_DIR', os.path.join(app.instance_path, 'photo-derivatives'))
+thumbnails = ThumbnailGenerator(photo_store, app.config['PHOTO_DERIVATIVE_DIR'],
+                                max_workers=int(os.environ.get('THUMBNAIL_WORKERS', 2)))
+
+# 密碼雜湊在有上限的執行緒池計算，尖峰時不會拖垮同一個 worker 的其他請求。
+# 每個請求執行緒同時只會等一個雜湊，排隊上限預設等於 gunicorn 的執行緒數 (GUNICORN_THREADS)：
+# 同一個 worker 內的並行登入只會排隊、不會回應 503；雜湊佔用的記憶體只取決於 PASSWORD_HASH_WORKERS
+password_hasher = PasswordHasher(
+    max_workers=int(os.environ.get('PASSWORD_HASH_WORKERS', 1)),
+    max_pending=int(os.environ.get('PASSWORD_HASH_MAX_PENDING', os.environ.get('GUNICORN_THREADS', 4))))
+
+# 登入用戶快取 (每個程序一份)，免去每個請求查詢 users 表
+user_cache = UserCache(max_entries=int(os.environ.get('USER_CACHE_SIZE', 1024)),
+                       ttl=int(os.environ.get('USER_CACHE_TTL', 60)))
+
+# 離線地名資料 (地名自動完成、座標反查國家)，第一次查詢時才載入
+app.config['GAZETTEER_PATH'] = os.environ.get('GAZETTEER_PATH', DEFAULT_GAZETTEER_PATH)
+gazetteer = Gazetteer(app.config['GAZETTEER_PATH'])
+
+# 讀取 API 的回應快取：memory (每個 worker 各自一份) 或 redis (多個 worker 共用)
+app.config['RESPONSE_CACHE_BACKEND'] = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')
+if app.config['RESPONSE_CACHE_BACKEND'] == 'redis':
+    response_cache = create_response_cache('redis', url=os.environ.get('REDIS_URL', 'redis://localhost:6379/0'),
+                                           ttl=int(os.environ.get('RESPONSE_CACHE_TTL', 3600)))
+else:
+    response_cache = create_response_cache(app.config['RESPONSE_CACHE_BACKEND'],
+                                           max_bytes=int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024)))
+# 串流輸出的回應超過此大小就不寫入快取，避免為了快取把大型列表留在記憶體
+RESPONSE_CACHE_MAX_ENTRY = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRY', 1024 * 1024))
+# 回應格式改變時遞增，讓瀏覽器手上的舊 ETag 失效
+RESPONSE_FORMAT_VERSION = 1
+
 # 資料庫配置函數
 def get_database_url():
     """取得並驗證資料庫 URL"""
@@ -56,35 +156,135 @@ def get_database_url():
 database_url = get_database_url()
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-    'pool_pre_ping': True,
-    'pool_recycle': 300,
-    'pool_size': 5,
-    'max_overflow': 10,
-    'connect_args': {
-        'connect_timeout': 10,
-        'options': '-c statement_timeout=30000'
-    } if 'postgresql' in database_url else {}
+
+def engine_options(url, pool_size, max_overflow):
+    options = {
+        'pool_pre_ping': True,
+        'pool_recycle': 300,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'connect_args': {
+            'connect_timeout': 10,
+            'options': '-c statement_timeout=30000'
+        } if 'postgresql' in url else {}
+    }
+    if ':memory:' not in url and url != 'sqlite://':
+        # 與預設的 QueuePool 相同，另外量測取得連線的等待時間
+        options['poolclass'] = TimedQueuePool
+    return options
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+    database_url, int(os.environ.get('DB_POOL_SIZE', 5)), int(os.environ.get('DB_MAX_OVERFLOW', 10)))
+
+# 讀取複本：DATABASE_REPLICA_URLS 以逗號分隔，唯讀請求 (GET/HEAD) 的查詢改走複本，寫入仍走主資料庫；
+# 用戶寫入後 DB_STICKY_SECONDS 秒內的請求都讀主資料庫，避免複本延遲造成讀不到自己剛寫的資料
+replica_urls = [url.strip().replace('postgres://', 'postgresql://', 1)
+                for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+app.config['SQLALCHEMY_BINDS'] = {
+    key: dict(engine_options(options['url'], int(os.environ.get('DB_REPLICA_POOL_SIZE', 5)),
+                             int(os.environ.get('DB_REPLICA_MAX_OVERFLOW', 10))), url=options['url'])
+    for key, options in replica_binds(replica_urls).items()
 }
+app.config['DB_STICKY_SECONDS'] = float(os.environ.get('DB_STICKY_SECONDS', 10))
+if replica_urls:
+    logger.info(f"啟用 {len(replica_urls)} 個讀取複本")
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+# 回應壓縮：文字類回應超過 COMPRESS_MIN_BYTES 時依 Accept-Encoding 以 br / gzip 壓縮
+# after_request 依註冊的相反順序執行，最先註冊才能壓縮到其他 hook 處理完的回應
+app.config['COMPRESS_MIN_BYTES'] = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+response_compressor = ResponseCompressor(min_size=app.config['COMPRESS_MIN_BYTES'])
+
+@app.after_request
+def _compress_response(response):
+    return response_compressor.compress(request, response)
 
-db = SQLAlchemy(app)
+# 指標：每個路由的延遲、每個請求的 SQL 次數與耗時、連線池狀態，由 /metrics 輸出
+app.config['SLOW_QUERY_MS'] = int(os.environ.get('SLOW_QUERY_MS', 500))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+metrics_registry = Registry()
+sql_metrics = SQLInstrumentation(metrics_registry, slow_query_seconds=app.config['SLOW_QUERY_MS'] / 1000)
+with app.app_context():
+    sql_metrics.attach(db.engine)
+    for replica_engine in replica_engines(db).values():
+        sql_metrics.attach(replica_engine, primary=False)
+
+REQUEST_LABELS = ('method', 'endpoint', 'status')
+request_seconds = metrics_registry.histogram('http_request_duration_seconds', '請求處理時間 (串流回應只計到開始輸出)',
+                                             REQUEST_LABELS)
+request_queries = metrics_registry.histogram('http_request_db_queries', '每個請求執行的 SQL 次數',
+                                             REQUEST_LABELS, buckets=COUNT_BUCKETS)
+request_query_seconds = metrics_registry.histogram('http_request_db_seconds', '每個請求花在 SQL 的時間',
+                                                   REQUEST_LABELS)
+
+@app.before_request
+def _start_request_metrics():
+    g.request_started = time.perf_counter()
+    sql_metrics.begin_request()
+
+_READ_ONLY_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+@app.before_request
+def _route_reads_to_replica():
+    if (request.method in _READ_ONLY_METHODS and app.config['SQLALCHEMY_BINDS']
+            and session.get('primary_until', 0) < time.time()):
+        use_replica(db)
+
+@app.after_request
+def _stick_to_primary_after_write(response):
+    # 寫入成功後的一小段時間，這個瀏覽器的讀取都走主資料庫 (存在 session cookie，跨 worker 有效)
+    if (app.config['SQLALCHEMY_BINDS'] and request.method not in _READ_ONLY_METHODS
+            and response.status_code < 400):
+        session['primary_until'] = time.time() + app.config['DB_STICKY_SECONDS']
+    return response
+
+@app.after_request
+def _record_request_metrics(response):
+    started = g.pop('request_started', None)
+    stats = sql_metrics.end_request()
+    if started is None:
+        return response
+    labels = {'method': request.method, 'endpoint': request.endpoint or 'unmatched',
+              'status': str(response.status_code)}
+    request_seconds.observe(time.perf_counter() - started, **labels)
+    if stats is not None:
+        request_queries.observe(stats.count, **labels)
+        request_query_seconds.observe(stats.seconds, **labels)
+    return response
+
+# 結構遷移應在部署時執行 (flask --app app db upgrade)；本機 SQLite 預設在第一次請求時自動套用
+app.config['AUTO_MIGRATE'] = os.environ.get(
+    'AUTO_MIGRATE', '1' if database_url.startswith('sqlite') else '0').strip().lower() in ('1', 'true', 'yes', 'on')
 
 # 資料模型
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_guest_created', 'is_google', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(200), nullable=False)
     is_google = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
     journals = db.relationship('Journal', backref='author', lazy=True, cascade='all, delete-orphan')
+    stats = db.relationship('UserStats', uselist=False, lazy=True, cascade='all, delete-orphan')
+    country_stats = db.relationship('UserCountryStats', lazy=True, cascade='all, delete-orphan')
 
 class Journal(db.Model):
     __tablename__ = 'journals'
+    __table_args__ = (
+        db.Index('ix_journals_user_date', 'user_id', 'date', 'created_at', 'id'),
+        db.Index('ix_journals_user_country', 'user_id', 'country'),
+        db.Index('ix_journals_user_geohash', 'user_id', 'geohash'),
+        db.Index('ix_journals_user_updated', 'user_id', 'updated_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    date = db.Column(db.String(20), nullable=False)
+    date = db.Column(db.Date, nullable=False)
     location = db.Column(db.String(200), nullable=False)
     country = db.Column(db.String(100), nullable=False)
     content = db.Column(db.Text, nullable=False)
@@ -92,19 +292,128 @@ class Journal(db.Model):
     lng = db.Column(db.Float, default=0.0)
     photo = db.Column(db.Text, nullable=True)
     journal_type = db.Column(db.String(20), default='text')
+    geohash = db.Column(db.String(12), nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-# 初始化資料庫
+class UserStats(db.Model):
+    """每位用戶的統計數字，隨日誌新增/修改/刪除在同一個交易內更新"""
+    __tablename__ = 'user_stats'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    journal_count = db.Column(db.Integer, nullable=False, default=0)
+    photo_count = db.Column(db.Integer, nullable=False, default=0)
+    country_count = db.Column(db.Integer, nullable=False, default=0)
+    data_version = db.Column(db.Integer, nullable=False, default=0)  # 每次寫入日誌都會遞增，作為回應快取的版本
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class UserCountryStats(db.Model):
+    """每位用戶在各國家的日誌數"""
+    __tablename__ = 'user_country_stats'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    country = db.Column(db.String(100), primary_key=True)
+    journal_count = db.Column(db.Integer, nullable=False, default=0)
+
+class JournalTombstone(db.Model):
+    """已刪除日誌的紀錄，讓增量同步 (/api/journals/changes) 能回報刪除"""
+    __tablename__ = 'journal_tombstones'
+    __table_args__ = (
+        db.Index('ix_journal_tombstones_user_deleted', 'user_id', 'deleted_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    journal_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_cached_user(mapper, connection, target):
+    user_cache.invalidate(target.id)
+
+_mark_startup('config')
+
+# 資料庫就緒檢查：載入模組時不連線，各 worker 第一次處理請求時才檢查，
+# 結果依 pid 快取，因此 gunicorn --preload 與 fork 出來的 worker 都適用
+READINESS_RETRY_SECONDS = 5
+_readiness = {'pid': None, 'ready': False, 'error': None, 'checked_at': 0.0}
+_readiness_lock = threading.Lock()
+
+@contextlib.contextmanager
+def _migration_file_lock():
+    """同一台機器上的多個 worker 以檔案鎖排隊自動升級，避免同時執行同一個遷移"""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(app.instance_path, exist_ok=True)
+    with open(os.path.join(app.instance_path, 'migrate.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def ensure_database_ready():
+    """資料庫可用且結構為最新時回傳 None，否則回傳錯誤訊息；失敗後隔幾秒才重試"""
+    state = _readiness
+    if state['ready'] and state['pid'] == os.getpid():
+        return None
+    with _readiness_lock:
+        if state['pid'] == os.getpid():
+            if state['ready']:
+                return None
+            if time.monotonic() - state['checked_at'] < READINESS_RETRY_SECONDS:
+                return state['error']
+
+        started = time.perf_counter()
+        try:
+            pending = migrations.pending_migrations(db.engine)
+            if pending and app.config['AUTO_MIGRATE']:
+                # 正常情況已由 gunicorn master 在 fork 前升級 (gunicorn.conf.py 的 on_starting)；
+                # 這裡是退路，拿到鎖後重新確認，先拿到鎖的 worker 升級完其他 worker 就不必再做
+                with _migration_file_lock():
+                    if migrations.pending_migrations(db.engine):
+                        migrations.upgrade(db)
+                pending = []
+            error = (f'資料庫結構尚未更新 (待套用 {len(pending)} 個遷移)，請執行 flask --app app db upgrade'
+                     if pending else None)
+        except Exception as e:
+            logger.error(f"❌ 資料庫就緒檢查失敗: {e}")
+            error = '資料庫連線失敗'
+        state.update(pid=os.getpid(), ready=error is None, error=error, checked_at=time.monotonic())
+
+        if error is None:
+            STARTUP_TIMINGS['database'] = round((time.perf_counter() - started) * 1000, 1)
+            logger.info(f"✅ worker {os.getpid()} 資料庫就緒，啟動耗時 (ms): {STARTUP_TIMINGS}")
+        else:
+            logger.error(f"❌ {error}")
+        return error
+
+@app.before_request
+def _require_database_ready():
+    if request.endpoint in ('health_check', 'metrics', 'static'):
+        return None
+    error = ensure_database_ready()
+    if error is None:
+        if app.config['JOB_SCHEDULER'] == 'thread':
+            job_scheduler.ensure_started()
+        return None
+    headers = {'Retry-After': str(READINESS_RETRY_SECONDS)}
+    if request.path.startswith('/api/'):
+        return jsonify({'success': False, 'message': '服務啟動中，請稍後再試'}), 503, headers
+    return '服務啟動中，請稍後再試', 503, headers
+
+# 初始化資料庫 (直接執行 app.py 時使用)
 def init_db():
     """初始化資料庫"""
     try:
         with app.app_context():
             db.engine.connect()
             logger.info("✅ 資料庫連線成功")
-            db.create_all()
-            logger.info("✅ 資料表建立/檢查完成")
+            applied = migrations.upgrade(db)
+            logger.info(f"✅ 資料庫結構已是最新版本 (本次套用 {len(applied)} 個遷移)")
             return True
     except Exception as e:
         logger.error(f"❌ 資料庫初始化失敗: {e}\n{traceback.format_exc()}")
@@ -120,18 +429,393 @@ def _get_request_data():
             return {}
     return request.form.to_dict()
 
+def current_user():
+    """目前登入的用戶 (CachedUser)；未登入或用戶已不存在時回傳 None"""
+    if 'current_user' in g:
+        return g.current_user
+    user = None
+    user_id = session.get('user_id')
+    if user_id is not None:
+        user = user_cache.get(user_id)
+        if user is None:
+            row = db.session.get(User, user_id)
+            if row is not None:
+                user = CachedUser(row.id, row.name, row.email, bool(row.is_google))
+                user_cache.set(user)
+        if user is None:
+            session.clear()
+    g.current_user = user
+    return user
+
+def login_required(view=None, *, redirect_message=None):
+    """未登入時 API 回傳 401；頁面 (有 redirect_message) 則導向登入頁"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if current_user() is None:
+                if redirect_message:
+                    flash(redirect_message)
+                    return redirect(url_for('login'))
+                return jsonify({'success': False, 'message': '未登入'}), 401
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator(view) if view else decorator
+
+class JournalDataError(ValueError):
+    """日誌資料驗證失敗"""
+
+def _parse_date(value):
+    """解析 YYYY-MM-DD 日期字串，格式錯誤時丟出 JournalDataError"""
+    parsed = migrations.parse_journal_date(value)
+    if parsed is None:
+        raise JournalDataError('日期格式錯誤，請使用 YYYY-MM-DD')
+    return parsed
+
+def _format_date(value):
+    return value.isoformat() if value else None
+
+def _country_for(lat, lng):
+    try:
+        return gazetteer.country_for(lat, lng)
+    except (OSError, ValueError) as e:
+        logger.error(f"座標反查國家失敗: {e}")
+        return None
+
+def _journal_geohash(lat, lng):
+    return encode_geohash(lat, lng) if has_location(lat, lng) else None
+
+def _store_photo(value, written=None):
+    """將上傳的照片存入 photo store，回傳要寫入 Journal.photo 的參照
+
+    written 為 set 時加入這次新寫入 (原本不存在) 的雜湊，交易失敗時可交給 _release_photos 清除。
+    """
+    if not value:
+        return None
+    if is_data_url(value):
+        data = decode_data_url(value)
+        digest = hashlib.sha256(data).hexdigest()
+        if written is not None and not photo_store.exists(digest):
+            written.add(digest)
+        return photo_url(photo_store.put(data))
+    digest = digest_from_reference(value)
+    if digest and photo_store.exists(digest):
+        return photo_url(digest)
+    raise InvalidPhotoError('照片參照無效')
+
+def _release_photos(digests):
+    """刪除已沒有任何日誌參照的照片與衍生圖，回傳刪除的張數；須在相關交易提交或還原之後呼叫"""
+    digests = {digest for digest in digests if digest}
+    if not digests:
+        return 0
+    # 參照檢查一律在主資料庫，複本落後時可能誤判為沒有參照
+    in_use = set(db.session.execute(
+        select(Journal.photo).where(Journal.photo.in_([photo_url(digest) for digest in digests])).distinct(),
+        bind_arguments={'bind': db.engine}).scalars())
+    released = 0
+    for digest in digests:
+        if photo_url(digest) in in_use:
+            continue
+        try:
+            photo_store.delete(digest)
+            thumbnails.delete(digest)
+        except OSError as e:
+            # 資料已提交，刪檔失敗只留下沒有參照的檔案，不影響請求結果
+            logger.error(f"刪除照片 {digest} 失敗: {e}")
+            continue
+        released += 1
+    return released
+
+def _schedule_thumbnails(reference):
+    digest = digest_from_reference(reference)
+    if digest:
+        thumbnails.schedule(digest)
+
+@app.template_global()
+def photo_variant(reference, size):
+    """取得指定尺寸的照片網址；舊的 data URL 直接回傳原值"""
+    digest = digest_from_reference(reference)
+    if not digest:
+        return reference
+    return f'{photo_url(digest)}/{size}'
+
+def _photo_variants(reference):
+    if not reference:
+        return None
+    return {size: photo_variant(reference, size) for size in DERIVATIVE_SIZES}
+
+# 用戶統計
+def _stats_key(journal):
+    """統計只關心國家與是否有照片"""
+    return (journal.country, bool(journal.photo))
+
+def _has_photo_clause():
+    return (Journal.photo.isnot(None)) & (Journal.photo != '')
+
+def rebuild_user_stats(user_id):
+    """從 journals 重新計算單一用戶的統計 (不 commit)；結果與現有統計相同時不寫入"""
+    rows = db.session.execute(
+        select(Journal.country,
+               func.count(Journal.id),
+               func.sum(case((_has_photo_clause(), 1), else_=0)))
+        .where(Journal.user_id == user_id)
+        .group_by(Journal.country)
+    ).all()
+    journal_count = sum(count for _, count, _ in rows)
+    photo_count = sum(int(photos or 0) for _, _, photos in rows)
+
+    stats = db.session.get(UserStats, user_id)
+    if stats is not None and (stats.journal_count, stats.photo_count, stats.country_count) == \
+            (journal_count, photo_count, len(rows)):
+        countries = dict(db.session.execute(
+            select(UserCountryStats.country, UserCountryStats.journal_count)
+            .where(UserCountryStats.user_id == user_id)
+        ).all())
+        if countries == {country: count for country, count, _ in rows}:
+            # 已經一致：不遞增資料版本，回應快取維持有效
+            return stats
+
+    db.session.execute(delete(UserCountryStats).where(UserCountryStats.user_id == user_id))
+    db.session.add_all([UserCountryStats(user_id=user_id, country=country, journal_count=count)
+                        for country, count, _ in rows])
+    stats = stats or UserStats(user_id=user_id)
+    stats.journal_count = journal_count
+    stats.photo_count = photo_count
+    stats.country_count = len(rows)
+    stats.data_version = (stats.data_version or 0) + 1
+    db.session.add(stats)
+    db.session.flush()
+    return stats
+
+def _bump_country_count(user_id, country, delta):
+    updated = db.session.execute(
+        update(UserCountryStats)
+        .where(UserCountryStats.user_id == user_id, UserCountryStats.country == country)
+        .values(journal_count=UserCountryStats.journal_count + delta)
+    ).rowcount
+    if not updated and delta > 0:
+        db.session.add(UserCountryStats(user_id=user_id, country=country, journal_count=delta))
+        db.session.flush()
+
+def _apply_journal_stats(user_id, before, after):
+    """依日誌變更前後的 _stats_key 增量更新統計"""
+    _apply_journal_stats_batch(user_id, [(before, after)])
+
+def _apply_journal_stats_batch(user_id, changes):
+    """合併多筆 (before, after) 變更後一次更新統計；尚無統計時直接重算"""
+    if not changes:
+        return
+    # 查詢會先 autoflush 目前的變更，所以重算的結果已包含這次寫入
+    if db.session.get(UserStats, user_id) is None:
+        rebuild_user_stats(user_id)
+        return
+
+    journal_delta = 0
+    photo_delta = 0
+    country_deltas = Counter()
+    for before, after in changes:
+        before_country, before_photo = before if before else (None, False)
+        after_country, after_photo = after if after else (None, False)
+        journal_delta += (after is not None) - (before is not None)
+        photo_delta += int(after_photo) - int(before_photo)
+        if before_country is not None:
+            country_deltas[before_country] -= 1
+        if after_country is not None:
+            country_deltas[after_country] += 1
+
+    country_deltas = {country: delta for country, delta in country_deltas.items() if delta}
+    if country_deltas:
+        for country, delta in country_deltas.items():
+            _bump_country_count(user_id, country, delta)
+        db.session.execute(delete(UserCountryStats).where(UserCountryStats.user_id == user_id,
+                                                          UserCountryStats.journal_count <= 0))
+
+    country_count = (select(func.count())
+                     .select_from(UserCountryStats)
+                     .where(UserCountryStats.user_id == user_id)
+                     .scalar_subquery())
+    db.session.execute(
+        update(UserStats)
+        .where(UserStats.user_id == user_id)
+        .values(journal_count=UserStats.journal_count + journal_delta,
+                photo_count=UserStats.photo_count + photo_delta,
+                country_count=country_count,
+                data_version=UserStats.data_version + 1,
+                updated_at=datetime.utcnow())
+    )
+
+def _get_user_stats(user_id):
+    stats = db.session.get(UserStats, user_id)
+    if stats is None and current_replica() is not None:
+        # 複本可能還沒複製到，重算前先確認主資料庫
+        use_primary()
+        stats = db.session.get(UserStats, user_id)
+    if stats is None:
+        stats = rebuild_user_stats(user_id)
+        db.session.commit()
+    return stats
+
+# 回應快取：鍵為 (用戶, 資料版本, 請求網址)，寫入日誌時版本遞增，舊快取自然失效
+def _get_data_version(user_id):
+    version = db.session.execute(select(UserStats.data_version).where(UserStats.user_id == user_id)).scalar()
+    if version is None:
+        version = _get_user_stats(user_id).data_version
+    return version
+
+def _cached_user_response(user_id, build):
+    """回傳快取的序列化回應，並以 ETag 處理 If-None-Match
+
+    ETag 不是回應內容的雜湊，而是 (格式版本, 用戶, 資料版本, 網址) 的雜湊：同一組鍵的回應內容固定，
+    ETag 可在查詢前算出，304 不需要碰快取或資料庫，串流回應也能在送出標頭時就帶上 ETag。
+    未壓縮時為強 ETag，壓縮中介層改寫本體後會換成弱 ETag。
+    """
+    key = f'{user_id}:{_get_data_version(user_id)}:{request.full_path}'
+    etag = hashlib.sha256(f'{RESPONSE_FORMAT_VERSION}:{key}'.encode()).hexdigest()[:32]
+    # 壓縮過的回應帶弱 ETag，If-None-Match 依規範以弱比較判斷
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        body = response_cache.get(key)
+        if body is not None:
+            response = app.response_class(body, mimetype='application/json')
+        else:
+            response = make_response(build())
+            if response.status_code != 200:
+                return response
+            if response.is_streamed:
+                response.response = _tee_to_cache(key, response.response)
+            else:
+                response_cache.set(key, response.get_data())
+    response.set_etag(etag)
+    # 回應依登入身分而不同，只允許瀏覽器快取且每次都要驗證
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+def _tee_to_cache(key, chunks):
+    """邊串流邊收集回應本體，完整送出且不超過上限時才寫入快取"""
+    collected = []
+    size = 0
+    for chunk in chunks:
+        if collected is not None:
+            size += len(chunk)
+            if size <= RESPONSE_CACHE_MAX_ENTRY:
+                collected.append(chunk)
+            else:
+                collected = None
+        yield chunk
+    if collected is not None:
+        response_cache.set(key, b''.join(collected))
+
+# 列表 API 可用 fields= 只取需要的欄位，未選的欄位以 load_only 延遲載入、不會離開資料庫
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# 主控台每次輸出的卡片數與卡片需要的欄位
+DASHBOARD_PAGE_SIZE = 12
+DASHBOARD_CARD_FIELDS = ('id', 'date', 'location', 'country', 'lat', 'lng', 'photo')
+LIST_STREAM_BATCH_SIZE = 200
+_JOURNAL_PROJECTIONS = {
+    'id': (('id',), lambda j: j.id),
+    'date': (('date',), lambda j: _format_date(j.date)),
+    'location': (('location',), lambda j: j.location),
+    'country': (('country',), lambda j: j.country),
+    'content': (('content',), lambda j: j.content),
+    'lat': (('lat',), lambda j: float(j.lat) if j.lat else 0.0),
+    'lng': (('lng',), lambda j: float(j.lng) if j.lng else 0.0),
+    'photo': (('photo',), lambda j: j.photo),
+    'thumbnails': (('photo',), lambda j: _photo_variants(j.photo)),
+    'journal_type': (('journal_type',), lambda j: j.journal_type or 'text'),
+}
+
+def _serialize_journal(journal, fields=None):
+    """所有日誌回應共用的序列化，fields 為 _JOURNAL_PROJECTIONS 的欄位子集"""
+    return {f: _JOURNAL_PROJECTIONS[f][1](journal) for f in (fields or _JOURNAL_PROJECTIONS)}
+
+def _parse_fields():
+    """解析 ?fields=id,date,location，未指定時回傳全部欄位"""
+    raw = request.args.get('fields')
+    if not raw:
+        return list(_JOURNAL_PROJECTIONS)
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in _JOURNAL_PROJECTIONS]
+    if unknown:
+        raise ValueError(f"未知的欄位: {', '.join(unknown)}")
+    return fields or ['id']
+
+def _encode_cursor(journal):
+    raw = json.dumps([journal.date.isoformat(), journal.created_at.isoformat(), journal.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def _decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        date, created_at, journal_id = json.loads(raw)
+        return date_type.fromisoformat(date), datetime.fromisoformat(created_at), int(journal_id)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise ValueError('cursor 格式錯誤') from e
+
+def _parse_date_range():
+    """解析 ?from=YYYY-MM-DD&to=YYYY-MM-DD (含兩端)，回傳 (from, to)，未指定的一端為 None"""
+    start, end = (_parse_date(request.args[key]) if request.args.get(key) else None for key in ('from', 'to'))
+    if start and end and start > end:
+        raise JournalDataError('from 不可晚於 to')
+    return start, end
+
+def _date_range_conditions(start, end):
+    conditions = []
+    if start:
+        conditions.append(Journal.date >= start)
+    if end:
+        conditions.append(Journal.date <= end)
+    return conditions
+
+def _list_journals(query):
+    """依 (date, created_at, id) 由新到舊列出日誌，帶 limit/cursor 時以 keyset 分頁，from/to 篩選日期範圍"""
+    try:
+        fields = _parse_fields()
+        query = query.filter(*_date_range_conditions(*_parse_date_range()))
+        paginate = 'limit' in request.args or 'cursor' in request.args
+        limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        cursor = _decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    if not paginate:
+        # 未分頁的列表可能很長：以伺服器端游標分批讀取，邊序列化邊輸出
+        journals = _ordered_journals(query, fields).yield_per(LIST_STREAM_BATCH_SIZE)
+        return Response(stream_with_context(iter_json_array(_serialize_journal(j, fields) for j in journals)),
+                        mimetype='application/json')
+
+    journals, next_cursor = _journal_page(query, fields, limit, cursor)
+    return jsonify({
+        'success': True,
+        'journals': [_serialize_journal(j, fields) for j in journals],
+        'next_cursor': next_cursor
+    })
+
+def _ordered_journals(query, fields, cursor=None):
+    """只載入 fields 需要的欄位，依 (date, created_at, id) 由新到舊排序，cursor 之後開始"""
+    columns = {'id', 'date', 'created_at'}
+    for field in fields:
+        columns.update(_JOURNAL_PROJECTIONS[field][0])
+    query = query.options(load_only(*(getattr(Journal, c) for c in columns)))
+    if cursor:
+        query = query.filter(tuple_(Journal.date, Journal.created_at, Journal.id) < cursor)
+    return query.order_by(Journal.date.desc(), Journal.created_at.desc(), Journal.id.desc())
+
+def _journal_page(query, fields, limit, cursor=None):
+    """取一頁日誌，回傳 (日誌, 下一頁 cursor)；沒有下一頁時 cursor 為 None"""
+    journals = _ordered_journals(query, fields, cursor).limit(limit + 1).all()
+    has_more = len(journals) > limit
+    journals = journals[:limit]
+    return journals, _encode_cursor(journals[-1]) if has_more else None
+
 # 路由
 @app.route('/')
 def index():
     """首頁 - 顯示歡迎介面"""
     try:
-        user = None
-        if 'user_id' in session:
-            user = User.query.get(session['user_id'])
-            if not user:
-                session.clear()
-        
-        return render_template('welcome.html', user=user)
+        return render_template('welcome.html', user=current_user())
     except Exception as e:
         logger.error(f"welcome.html 渲染失敗: {e}\n{traceback.format_exc()}")
         return make_response("""
@@ -160,7 +844,9 @@ def login():
 
         try:
             user = User.query.filter_by(email=email).first()
-            if user and check_password_hash(user.password, password):
+            # 驗證密碼時不需要佔用資料庫連線，先還給連線池
+            db.session.close()
+            if user and password_hasher.check(user.password, password):
                 session['user_id'] = user.id
                 session['user_name'] = user.name
                 logger.info(f"用戶登入成功: {email}")
@@ -174,6 +860,11 @@ def login():
                 return jsonify({'success': False, 'message': '帳號或密碼錯誤'}), 401
             flash('帳號或密碼錯誤')
             return redirect(url_for('login'))
+        except HashingBusyError as e:
+            if request.is_json:
+                return jsonify({'success': False, 'message': str(e)}), 503, {'Retry-After': '1'}
+            flash(str(e))
+            return redirect(url_for('login'))
         except Exception as e:
             logger.error(f"登入錯誤: {e}\n{traceback.format_exc()}")
             if request.is_json:
@@ -208,7 +899,8 @@ def register():
                 flash('此帳號已存在')
                 return redirect(url_for('register'))
 
-            hashed_password = generate_password_hash(password)
+            db.session.close()
+            hashed_password = password_hasher.generate(password)
             new_user = User(name=name, email=email, password=hashed_password)
             
             db.session.add(new_user)
@@ -222,6 +914,11 @@ def register():
                 return jsonify({'success': True})
             flash('註冊成功')
             return redirect(url_for('dashboard'))
+        except HashingBusyError as e:
+            if request.is_json:
+                return jsonify({'success': False, 'message': str(e)}), 503, {'Retry-After': '1'}
+            flash(str(e))
+            return redirect(url_for('register'))
         except Exception as e:
             db.session.rollback()
             logger.error(f"註冊失敗: {e}\n{traceback.format_exc()}")
@@ -238,10 +935,14 @@ def register():
 
 @app.route('/google-login', methods=['POST'])
 def google_login():
+    # 已經是訪客時沿用同一個帳號，不要每次點擊都建立新用戶
+    user = current_user()
+    if user is not None and user.is_google:
+        return jsonify({'success': True})
     try:
         user_name = f'訪客使用者_{datetime.now().strftime("%Y%m%d%H%M%S")}'
         email = f'google_{datetime.now().timestamp()}@gmail.com'
-        password = generate_password_hash(secrets.token_hex(16))
+        password = password_hasher.generate(secrets.token_hex(16))
 
         new_user = User(name=user_name, email=email, password=password, is_google=True)
         
@@ -252,6 +953,8 @@ def google_login():
         session['user_id'] = new_user.id
         session['user_name'] = new_user.name
         return jsonify({'success': True})
+    except HashingBusyError as e:
+        return jsonify({'success': False, 'message': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         db.session.rollback()
         logger.error(f"Google 登入失敗: {e}\n{traceback.format_exc()}")
@@ -264,56 +967,50 @@ def logout():
     return redirect(url_for('index'))
 
 @app.route('/dashboard')
+@login_required(redirect_message='請先登入才能查看日誌')
 def dashboard():
-    """主控台 - 需要登入才能訪問"""
-    if 'user_id' not in session:
-        flash('請先登入才能查看日誌')
-        return redirect(url_for('login'))
-
+    """主控台 - 需要登入才能訪問；只輸出第一頁卡片與統計，其餘卡片捲動時載入，地圖標記依範圍查詢"""
     try:
-        user = User.query.get(session['user_id'])
-        if not user:
-            session.clear()
-            flash('用戶不存在，請重新登入')
-            return redirect(url_for('login'))
-
-        journals = Journal.query.filter_by(user_id=user.id).order_by(Journal.date.desc(), Journal.created_at.desc()).all()
-        
-        journals_data = []
-        for j in journals:
-            journals_data.append({
-                'id': j.id,
-                'date': j.date,
-                'location': j.location,
-                'country': j.country,
-                'content': j.content,
-                'lat': float(j.lat) if j.lat else 0.0,
-                'lng': float(j.lng) if j.lng else 0.0,
-                'photo': j.photo,
-                'journal_type': j.journal_type or 'text'
-            })
+        user = current_user()
+        journals, next_cursor = _journal_page(Journal.query.filter_by(user_id=user.id),
+                                              DASHBOARD_CARD_FIELDS, DASHBOARD_PAGE_SIZE)
+        stats = _get_user_stats(user.id)
         
-        countries = list({j.country for j in journals})
-        
-        logger.info(f"用戶 {user.name} 查看 dashboard，共有 {len(journals)} 篇日誌")
+        logger.info(f"用戶 {user.name} 查看 dashboard，共有 {stats.journal_count} 篇日誌")
         
         return render_template('dashboard.html',
                                user=user,
-                               journals=journals_data,
-                               countries=countries,
-                               journal_count=len(journals),
-                               country_count=len(countries))
+                               journals=[_serialize_journal(j, DASHBOARD_CARD_FIELDS) for j in journals],
+                               next_cursor=next_cursor,
+                               journal_count=stats.journal_count,
+                               country_count=stats.country_count,
+                               photo_count=stats.photo_count)
     except Exception as e:
         logger.error(f"Dashboard 錯誤: {e}\n{traceback.format_exc()}")
         flash('載入日誌失敗，請稍後再試')
         return redirect(url_for('index'))
 
+@app.route('/dashboard/journals')
+@login_required
+def dashboard_journal_cards():
+    """主控台下一頁的日誌卡片 (HTML 片段)，下一頁的 cursor 放在 X-Next-Cursor 標頭"""
+    try:
+        cursor = _decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    journals, next_cursor = _journal_page(Journal.query.filter_by(user_id=current_user().id),
+                                          DASHBOARD_CARD_FIELDS, DASHBOARD_PAGE_SIZE, cursor)
+    response = make_response(render_template('_journal_cards.html',
+                                              journals=[_serialize_journal(j, DASHBOARD_CARD_FIELDS) for j in journals]))
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
 @app.route('/add_journal', methods=['GET', 'POST'])
+@login_required(redirect_message='請先登入')
 def add_journal():
-    if 'user_id' not in session:
-        flash('請先登入')
-        return redirect(url_for('login'))
-
     if request.method == 'POST':
         data = _get_request_data()
         resp, status = _create_journal_from_data(data)
@@ -335,15 +1032,12 @@ def add_journal():
         return "<h2>Add Journal</h2><p>Template error</p>", 200
 
 @app.route('/edit_journal/<int:journal_id>', methods=['GET'])
+@login_required(redirect_message='請先登入')
 def edit_journal(journal_id):
     """編輯日誌頁面"""
-    if 'user_id' not in session:
-        flash('請先登入')
-        return redirect(url_for('login'))
-
     try:
         journal = Journal.query.get_or_404(journal_id)
-        if journal.user_id != session['user_id']:
+        if journal.user_id != current_user().id:
             flash('無權限編輯此日誌')
             return redirect(url_for('dashboard'))
 
@@ -353,239 +1047,1007 @@ def edit_journal(journal_id):
         flash('頁面載入失敗')
         return redirect(url_for('dashboard'))
 
-def _create_journal_from_data(data):
-    """從資料建立日誌"""
-    if 'user_id' not in session:
-        return ({'success': False, 'message': '未登入'}, 401)
+def _validate_new_journal(data, written_photos=None):
+    """驗證新增日誌的資料並回傳 Journal 欄位；照片會先存入 photo store (written_photos 見 _store_photo)"""
+    date = str(data.get('date') or '').strip()
+    location = str(data.get('location') or '').strip()
+    country = str(data.get('country') or '').strip()
+    content = str(data.get('content') or '').strip()
+    photo = data.get('photo')
+
+    # 自動判斷日誌類型
+    journal_type = 'photo' if photo else 'text'
 
+    lat = 0.0
+    lng = 0.0
     try:
-        date = (data.get('date') or '').strip()
-        location = (data.get('location') or '').strip()
-        country = (data.get('country') or '').strip()
-        content = (data.get('content') or '').strip()
-        photo = data.get('photo')
+        if 'lat' in data and data.get('lat') not in (None, '', 'null', 'undefined'):
+            lat = float(data.get('lat'))
+        if 'lng' in data and data.get('lng') not in (None, '', 'null', 'undefined'):
+            lng = float(data.get('lng'))
+    except (ValueError, TypeError) as e:
+        logger.error(f"座標轉換錯誤: {e}")
+        lat = 0.0
+        lng = 0.0
 
-        # 自動判斷日誌類型
-        journal_type = 'photo' if photo else 'text'
+    # 未填國家但有座標時，以離線地名資料推測
+    if not country and has_location(lat, lng):
+        country = _country_for(lat, lng) or ''
 
-        logger.info(f"嘗試建立日誌: date={date}, location={location}, country={country}, type={journal_type}")
+    if not location or not country or not content:
+        raise JournalDataError('location, country, content 為必填')
 
-        if not location or not country or not content:
-            return ({'success': False, 'message': 'location, country, content 為必填'}, 400)
+    date = _parse_date(date) if date else datetime.utcnow().date()
 
-        if not date:
-            date = datetime.utcnow().strftime('%Y-%m-%d')
+    try:
+        photo = _store_photo(photo, written_photos)
+    except InvalidPhotoError as e:
+        raise JournalDataError(str(e)) from e
 
-        lat = 0.0
-        lng = 0.0
+    return {
+        'date': date,
+        'location': location,
+        'country': country,
+        'content': content,
+        'lat': lat,
+        'lng': lng,
+        'photo': photo,
+        'journal_type': journal_type,
+        'geohash': _journal_geohash(lat, lng)
+    }
+
+def _apply_journal_update(journal, data, written_photos=None):
+    """依資料更新日誌，只更動有提供的欄位；驗證失敗時不會修改日誌"""
+    date = _parse_date(data['date']) if data.get('date') else journal.date
+    photo = journal.photo
+    if 'photo' in data:
+        try:
+            photo = _store_photo(data.get('photo'), written_photos)
+        except InvalidPhotoError as e:
+            raise JournalDataError(str(e)) from e
+
+    journal.date = date
+    journal.location = data.get('location', journal.location)
+    journal.country = data.get('country', journal.country)
+    journal.content = data.get('content', journal.content)
+    
+    # 處理照片更新
+    if 'photo' in data:
+        journal.photo = photo
+        # 自動更新 journal_type
+        journal.journal_type = 'photo' if journal.photo else 'text'
+    
+    if 'lat' in data:
         try:
-            if 'lat' in data and data.get('lat') not in (None, '', 'null', 'undefined'):
-                lat = float(data.get('lat'))
-            if 'lng' in data and data.get('lng') not in (None, '', 'null', 'undefined'):
-                lng = float(data.get('lng'))
-        except (ValueError, TypeError) as e:
-            logger.error(f"座標轉換錯誤: {e}")
-            lat = 0.0
-            lng = 0.0
-
-        logger.info(f"座標值: lat={lat}, lng={lng}")
-
-        new_journal = Journal(
-            date=date,
-            location=location,
-            country=country,
-            content=content,
-            lat=lat,
-            lng=lng,
-            photo=photo,
-            journal_type=journal_type,
-            user_id=session['user_id']
-        )
+            journal.lat = float(data.get('lat', 0))
+        except (ValueError, TypeError):
+            journal.lat = 0.0
+    if 'lng' in data:
+        try:
+            journal.lng = float(data.get('lng', 0))
+        except (ValueError, TypeError):
+            journal.lng = 0.0
+    
+    journal.geohash = _journal_geohash(journal.lat, journal.lng)
+    journal.updated_at = datetime.utcnow()
+
+def _create_journal_from_data(data):
+    """從資料建立日誌"""
+    user = current_user()
+    if user is None:
+        return ({'success': False, 'message': '未登入'}, 401)
+
+    try:
+        try:
+            fields = _validate_new_journal(data)
+        except JournalDataError as e:
+            return ({'success': False, 'message': str(e)}, 400)
+
+        logger.info(f"嘗試建立日誌: date={fields['date']}, location={fields['location']}, "
+                    f"country={fields['country']}, type={fields['journal_type']}")
+        logger.info(f"座標值: lat={fields['lat']}, lng={fields['lng']}")
+
+        new_journal = Journal(user_id=user.id, **fields)
         
         db.session.add(new_journal)
+        db.session.flush()
+        search.index_journal(db.session, db.engine.dialect.name, new_journal)
+        _apply_journal_stats(user.id, None, _stats_key(new_journal))
         db.session.commit()
+        _schedule_thumbnails(new_journal.photo)
         
-        logger.info(f"✅ 日誌建立成功: ID={new_journal.id}, User={session['user_id']}, Location={location}, Type={journal_type}")
+        logger.info(f"✅ 日誌建立成功: ID={new_journal.id}, User={user.id}, Location={new_journal.location}, Type={new_journal.journal_type}")
         
-        return ({'success': True, 'id': new_journal.id, 'journal': {
-            'id': new_journal.id,
-            'date': new_journal.date,
-            'location': new_journal.location,
-            'country': new_journal.country,
-            'content': new_journal.content,
-            'lat': new_journal.lat,
-            'lng': new_journal.lng,
-            'photo': new_journal.photo,
-            'journal_type': new_journal.journal_type
-        }}, 201)
+        return ({'success': True, 'id': new_journal.id, 'journal': _serialize_journal(new_journal)}, 201)
     except Exception as e:
         db.session.rollback()
         logger.error(f"❌ 建立日誌失敗: {e}\n{traceback.format_exc()}")
         return ({'success': False, 'message': f'資料庫錯誤: {str(e)}'}, 500)
 
 @app.route('/api/journals', methods=['GET', 'POST'])
+@login_required
 def journals_api():
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': '未登入'}), 401
-
     if request.method == 'POST':
         data = _get_request_data()
         resp, status = _create_journal_from_data(data)
         return jsonify(resp), status
 
     try:
-        journals = Journal.query.filter_by(user_id=session['user_id']).order_by(Journal.date.desc(), Journal.created_at.desc()).all()
-        return jsonify([{
-            'id': j.id,
-            'date': j.date,
-            'location': j.location,
-            'country': j.country,
-            'content': j.content,
-            'lat': float(j.lat) if j.lat else 0.0,
-            'lng': float(j.lng) if j.lng else 0.0,
-            'photo': j.photo,
-            'journal_type': j.journal_type or 'text'
-        } for j in journals])
+        user_id = current_user().id
+        return _cached_user_response(user_id, lambda: _list_journals(Journal.query.filter_by(user_id=user_id)))
     except Exception as e:
         logger.error(f"取得日誌列表失敗: {e}\n{traceback.format_exc()}")
         return jsonify({'success': False, 'message': '取得日誌失敗'}), 500
 
+# 批次寫入：每段操作一個交易，新增以 executemany 一次寫入
+MAX_BATCH_OPERATIONS = 5000
+BATCH_CHUNK_SIZE = 500
+
+def _read_batch_operations():
+    """從 JSON 陣列或上傳的 NDJSON / CSV 檔取得操作清單"""
+    upload = request.files.get('file')
+    if upload:
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig')
+        if (upload.filename or '').lower().endswith('.csv'):
+            # CSV 空欄位視為未提供，避免更新時把欄位清空
+            return [{k: v for k, v in row.items() if k and v not in (None, '')}
+                    for row in itertools.islice(csv.DictReader(stream), MAX_BATCH_OPERATIONS + 1)]
+        operations = []
+        for line_no, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                operations.append(json.loads(line))
+            except json.JSONDecodeError:
+                raise JournalDataError(f'第 {line_no} 行不是合法的 JSON') from None
+            if len(operations) > MAX_BATCH_OPERATIONS:
+                break
+        return operations
+
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get('operations')
+    if not isinstance(payload, list):
+        raise JournalDataError('請提供操作陣列，或上傳 NDJSON / CSV 檔')
+    return payload
+
+def _batch_result(index, op, success, journal_id=None, message=None):
+    result = {'index': index, 'op': op, 'success': success}
+    if journal_id is not None:
+        result['id'] = journal_id
+    if message:
+        result['message'] = message
+    return result
+
+def _run_batch_chunk(user_id, chunk):
+    """在單一交易中處理一段操作，回傳 {index: 結果}"""
+    results = {}
+    creates, updates, deletes = [], [], []
+    written_photos = set()
+    for index, item in chunk:
+        if not isinstance(item, dict):
+            results[index] = _batch_result(index, None, False, message='每筆操作必須是物件')
+            continue
+        op = str(item.get('op') or 'create').lower()
+        data = item['data'] if isinstance(item.get('data'), dict) else item
+        try:
+            if op == 'create':
+                creates.append((index, _validate_new_journal(data, written_photos)))
+            elif op in ('update', 'delete'):
+                try:
+                    journal_id = int(item.get('id'))
+                except (TypeError, ValueError):
+                    raise JournalDataError('update / delete 必須提供 id') from None
+                (updates if op == 'update' else deletes).append((index, journal_id, data))
+            else:
+                raise JournalDataError(f'未知的操作: {op}')
+        except JournalDataError as e:
+            results[index] = _batch_result(index, op, False, message=str(e))
+
+    dialect = db.engine.dialect.name
+    stats_changes = []
+    # 同一段可能多次更新同一篇日誌，以 id 為鍵只索引一次
+    indexed = {}
+    photos = []
+    # 更新換掉或刪除的日誌原本的照片，提交後沒有其他日誌參照時刪除
+    replaced_photos = []
+    try:
+        existing = {}
+        target_ids = {journal_id for _, journal_id, _ in updates + deletes}
+        if target_ids:
+            existing = {j.id: j for j in Journal.query.filter(Journal.user_id == user_id,
+                                                              Journal.id.in_(target_ids))}
+
+        for index, journal_id, data in updates:
+            journal = existing.get(journal_id)
+            if journal is None:
+                results[index] = _batch_result(index, 'update', False, journal_id, '找不到日誌')
+                continue
+            before = _stats_key(journal)
+            previous_photo = journal.photo
+            try:
+                _apply_journal_update(journal, data, written_photos)
+            except JournalDataError as e:
+                results[index] = _batch_result(index, 'update', False, journal_id, str(e))
+                continue
+            stats_changes.append((before, _stats_key(journal)))
+            indexed[journal.id] = journal
+            if 'photo' in data:
+                photos.append(journal.photo)
+                replaced_photos.append(previous_photo)
+            results[index] = _batch_result(index, 'update', True, journal_id)
+
+        delete_ids = []
+        for index, journal_id, _ in deletes:
+            journal = existing.pop(journal_id, None)
+            if journal is None:
+                results[index] = _batch_result(index, 'delete', False, journal_id, '找不到日誌')
+                continue
+            stats_changes.append((_stats_key(journal), None))
+            replaced_photos.append(journal.photo)
+            delete_ids.append(journal_id)
+            results[index] = _batch_result(index, 'delete', True, journal_id)
+        for journal_id in delete_ids:
+            indexed.pop(journal_id, None)
+
+        db.session.flush()
+        if delete_ids:
+            search.remove_journals(db.session, dialect, delete_ids)
+            db.session.execute(delete(Journal).where(Journal.user_id == user_id, Journal.id.in_(delete_ids)))
+            _record_tombstones(user_id, delete_ids)
+
+        if creates:
+            rows = [dict(fields, user_id=user_id) for _, fields in creates]
+            new_ids = db.session.execute(
+                insert(Journal).returning(Journal.id, sort_by_parameter_order=True), rows
+            ).scalars().all()
+            for (index, fields), journal_id in zip(creates, new_ids):
+                indexed[journal_id] = search.SearchDocument(journal_id, user_id, fields['location'],
+                                                            fields['country'], fields['content'])
+                stats_changes.append((None, (fields['country'], bool(fields['photo']))))
+                photos.append(fields['photo'])
+                results[index] = _batch_result(index, 'create', True, journal_id)
+
+        search.index_journals(db.session, dialect, list(indexed.values()))
+        _apply_journal_stats_batch(user_id, stats_changes)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"批次寫入失敗: {e}\n{traceback.format_exc()}")
+        # 這段新寫入的照片沒有日誌參照了 (其他請求同時用到的會保留)
+        try:
+            _release_photos(written_photos)
+        except Exception as cleanup_error:
+            logger.error(f"清除未使用的照片失敗: {cleanup_error}")
+        for index, item in chunk:
+            if results.get(index, {}).get('success', True):
+                op = str(item.get('op') or 'create').lower() if isinstance(item, dict) else None
+                results[index] = _batch_result(index, op, False, message='資料庫錯誤，此段操作未寫入')
+        return results
+
+    _release_photos(digest_from_reference(photo) for photo in replaced_photos)
+    for photo in photos:
+        _schedule_thumbnails(photo)
+    return results
+
+@app.route('/api/journals/batch', methods=['POST'])
+@login_required
+def journals_batch():
+    """批次新增 / 更新 / 刪除日誌，回傳每筆操作的結果"""
+    try:
+        operations = _read_batch_operations()
+    except (JournalDataError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({'success': False, 'message': f'無法讀取批次資料: {e}'}), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({'success': False, 'message': f'單次最多 {MAX_BATCH_OPERATIONS} 筆操作'}), 413
+
+    results = {}
+    indexed_operations = list(enumerate(operations))
+    for start in range(0, len(indexed_operations), BATCH_CHUNK_SIZE):
+        results.update(_run_batch_chunk(current_user().id, indexed_operations[start:start + BATCH_CHUNK_SIZE]))
+
+    ordered = [results[index] for index in sorted(results)]
+    summary = Counter(r['op'] for r in ordered if r['success'])
+    failed = sum(1 for r in ordered if not r['success'])
+    logger.info(f"用戶 {current_user().id} 批次寫入 {len(ordered)} 筆，失敗 {failed} 筆")
+    return jsonify({
+        'success': failed == 0,
+        'results': ordered,
+        'summary': {
+            'created': summary['create'],
+            'updated': summary['update'],
+            'deleted': summary['delete'],
+            'failed': failed
+        }
+    })
+
+def _journal_detail_response(journal_id):
+    journal = Journal.query.get_or_404(journal_id)
+    if journal.user_id != current_user().id:
+        return jsonify({'success': False, 'message': '無權限'}), 403
+    return jsonify(_serialize_journal(journal))
+
 @app.route('/api/journals/<int:journal_id>', methods=['GET', 'PUT', 'DELETE'])
+@login_required
 def journal_detail(journal_id):
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': '未登入'}), 401
-
     try:
+        if request.method == 'GET':
+            return _cached_user_response(current_user().id, lambda: _journal_detail_response(journal_id))
+
         journal = Journal.query.get_or_404(journal_id)
-        if journal.user_id != session['user_id']:
+        if journal.user_id != current_user().id:
             return jsonify({'success': False, 'message': '無權限'}), 403
 
         if request.method == 'DELETE':
+            before = _stats_key(journal)
+            photo = journal.photo
             db.session.delete(journal)
+            search.remove_journal(db.session, db.engine.dialect.name, journal.id)
+            _record_tombstones(journal.user_id, [journal.id])
+            _apply_journal_stats(journal.user_id, before, None)
             db.session.commit()
+            _release_photos([digest_from_reference(photo)])
             logger.info(f"刪除日誌成功: {journal_id}")
             return jsonify({'success': True})
         
         elif request.method == 'PUT':
             data = _get_request_data()
-            journal.date = data.get('date', journal.date)
-            journal.location = data.get('location', journal.location)
-            journal.country = data.get('country', journal.country)
-            journal.content = data.get('content', journal.content)
-            
-            # 處理照片更新
-            if 'photo' in data:
-                journal.photo = data.get('photo')
-                # 自動更新 journal_type
-                journal.journal_type = 'photo' if journal.photo else 'text'
-            
-            if 'lat' in data:
-                try:
-                    journal.lat = float(data.get('lat', 0))
-                except (ValueError, TypeError):
-                    journal.lat = 0.0
-            if 'lng' in data:
-                try:
-                    journal.lng = float(data.get('lng', 0))
-                except (ValueError, TypeError):
-                    journal.lng = 0.0
-            
-            journal.updated_at = datetime.utcnow()
+            before = _stats_key(journal)
+            previous_photo = journal.photo
+            _apply_journal_update(journal, data)
+            search.index_journal(db.session, db.engine.dialect.name, journal)
+            _apply_journal_stats(journal.user_id, before, _stats_key(journal))
             db.session.commit()
+            if journal.photo != previous_photo:
+                _release_photos([digest_from_reference(previous_photo)])
+            if 'photo' in data:
+                _schedule_thumbnails(journal.photo)
             logger.info(f"更新日誌成功: {journal_id}, Type: {journal.journal_type}")
             
-            return jsonify({
-                'success': True,
-                'journal': {
-                    'id': journal.id,
-                    'date': journal.date,
-                    'location': journal.location,
-                    'country': journal.country,
-                    'content': journal.content,
-                    'lat': float(journal.lat) if journal.lat else 0.0,
-                    'lng': float(journal.lng) if journal.lng else 0.0,
-                    'photo': journal.photo,
-                    'journal_type': journal.journal_type or 'text'
-                }
-            })
-        
-        return jsonify({
-            'id': journal.id,
-            'date': journal.date,
-            'location': journal.location,
-            'country': journal.country,
-            'content': journal.content,
-            'lat': float(journal.lat) if journal.lat else 0.0,
-            'lng': float(journal.lng) if journal.lng else 0.0,
-            'photo': journal.photo,
-            'journal_type': journal.journal_type or 'text'
-        })
+            return jsonify({'success': True, 'journal': _serialize_journal(journal)})
+    except JournalDataError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         logger.error(f"日誌操作失敗: {e}\n{traceback.format_exc()}")
         return jsonify({'success': False, 'message': '操作失敗'}), 500
 
 @app.route('/api/journals/country/<country>')
+@login_required
 def journals_by_country(country):
-    if 'user_id' not in session:
-        return jsonify({'success': False, 'message': '未登入'}), 401
-
-    try:
-        journals = Journal.query.filter_by(user_id=session['user_id'], country=country).all()
-        return jsonify([{
-            'id': j.id,
-            'date': j.date,
-            'location': j.location,
-            'country': j.country,
-            'content': j.content,
-            'lat': float(j.lat) if j.lat else 0.0,
-            'lng': float(j.lng) if j.lng else 0.0,
-            'photo': j.photo,
-            'journal_type': j.journal_type or 'text'
-        } for j in journals])
+    try:
+        user_id = current_user().id
+        return _cached_user_response(
+            user_id, lambda: _list_journals(Journal.query.filter_by(user_id=user_id, country=country)))
     except Exception as e:
         logger.error(f"按國家查詢日誌失敗: {e}")
         return jsonify({'success': False, 'message': '查詢失敗'}), 500
 
-@app.route('/admin/migrate-journal-types')
-def migrate_journal_types():
-    """資料庫遷移：為舊日誌補上 journal_type（僅供管理員使用）"""
-    if 'user_id' not in session:
-        return jsonify({'error': 'Unauthorized'}), 401
-    
+@app.route('/api/journals/search')
+@login_required
+def search_journals():
+    """依相關度搜尋日誌內容、地點與國家"""
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'success': False, 'message': '請提供搜尋關鍵字 q'}), 400
     try:
-        journals = Journal.query.filter(Journal.journal_type == None).all()
-        count = 0
-        for j in journals:
-            j.journal_type = 'photo' if j.photo else 'text'
-            count += 1
-        
-        db.session.commit()
-        logger.info(f"✅ 資料庫遷移成功：已更新 {count} 筆日誌的類型")
-        return jsonify({
-            'success': True,
-            'message': f'已更新 {count} 筆日誌的類型'
-        })
+        fields = _parse_fields()
+        limit = min(max(int(request.args.get('limit', 20)), 1), MAX_PAGE_SIZE)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    try:
+        hits = search.search(db.session, db.engine.dialect.name, current_user().id, query,
+                             limit=limit, offset=offset)
+        columns = {'id'} | {c for f in fields for c in _JOURNAL_PROJECTIONS[f][0]}
+        journals = {j.id: j for j in (Journal.query
+                                      .options(load_only(*(getattr(Journal, c) for c in columns)))
+                                      .filter(Journal.user_id == current_user().id,
+                                              Journal.id.in_([journal_id for journal_id, _ in hits])))}
+        results = []
+        for journal_id, score in hits:
+            if journal_id in journals:
+                item = _serialize_journal(journals[journal_id], fields)
+                item['score'] = round(score, 6)
+                results.append(item)
+        return jsonify({'success': True, 'query': query, 'results': results})
     except Exception as e:
-        db.session.rollback()
-        logger.error(f"遷移失敗: {e}")
-        return jsonify({'error': str(e)}), 500
+        logger.error(f"搜尋日誌失敗: {e}\n{traceback.format_exc()}")
+        return jsonify({'success': False, 'message': '搜尋失敗'}), 500
+
+# 地名查詢：使用隨附的離線地名資料，取代前端直接呼叫 Nominatim
+def _place_dict(place, distance=None):
+    result = {
+        'name': place.name_zh or place.name,
+        'name_en': place.name,
+        'country': place.country,
+        'country_code': place.country_code,
+        'lat': place.lat,
+        'lng': place.lng
+    }
+    if distance is not None:
+        result['distance_km'] = round(distance, 2)
+    return result
+
+@app.route('/api/geocode')
+@login_required
+def geocode():
+    """地名自動完成：依前綴查詢地名，回傳座標與國家"""
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'success': False, 'message': '請提供地名 q'}), 400
+    try:
+        limit = int(request.args.get('limit', 5))
+        places = gazetteer.geocode(query, limit=limit)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except OSError as e:
+        logger.error(f"地名資料載入失敗: {e}")
+        return jsonify({'success': False, 'message': '地名服務暫時無法使用'}), 503
+    return jsonify({'success': True, 'query': query, 'results': [_place_dict(p) for p in places]})
+
+@app.route('/api/reverse-geocode')
+@login_required
+def reverse_geocode():
+    """依座標找出最近的地點與國家"""
+    try:
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
+        found = gazetteer.reverse(lat, lng)
+    except (KeyError, ValueError):
+        return jsonify({'success': False, 'message': '請提供有效的 lat 與 lng'}), 400
+    except OSError as e:
+        logger.error(f"地名資料載入失敗: {e}")
+        return jsonify({'success': False, 'message': '地名服務暫時無法使用'}), 503
+    if found is None:
+        return jsonify({'success': False, 'message': '附近沒有已知地點'}), 404
+    return jsonify({'success': True, 'result': _place_dict(*found)})
+
+# 匯出：以伺服器端游標 (yield_per) 逐批讀取，記憶體用量不隨日誌數增加
+EXPORT_BATCH_SIZE = 200
+EXPORT_CHUNK_SIZE = 64 * 1024
+_PHOTO_EXTENSIONS = {'image/jpeg': 'jpg', 'image/png': 'png', 'image/gif': 'gif', 'image/webp': 'webp'}
+
+def _iter_export_rows(user_id, with_photo_only=False):
+    stmt = (select(Journal.id, Journal.date, Journal.location, Journal.country, Journal.content,
+                   Journal.lat, Journal.lng, Journal.photo, Journal.journal_type,
+                   Journal.created_at, Journal.updated_at)
+            .where(Journal.user_id == user_id)
+            .order_by(Journal.date, Journal.id)
+            .execution_options(yield_per=EXPORT_BATCH_SIZE))
+    if with_photo_only:
+        stmt = stmt.where(_has_photo_clause())
+    yield from db.session.execute(stmt)
+
+def _export_record(row, photo=None):
+    return {
+        'id': row.id,
+        'date': _format_date(row.date),
+        'location': row.location,
+        'country': row.country,
+        'content': row.content,
+        'lat': float(row.lat) if row.lat else 0.0,
+        'lng': float(row.lng) if row.lng else 0.0,
+        'photo': photo,
+        'journal_type': row.journal_type or 'text',
+        'created_at': row.created_at.isoformat() if row.created_at else None,
+        'updated_at': row.updated_at.isoformat() if row.updated_at else None
+    }
+
+def _export_photo_entry(row):
+    """回傳 (壓縮檔內路徑, 開啟照片的函式)；照片不存在時回傳 (None, None)"""
+    digest = digest_from_reference(row.photo)
+    if digest:
+        if not photo_store.exists(digest):
+            return None, None
+        with photo_store.open(digest) as f:
+            mimetype = sniff_mimetype(f.read(16))
+        return f'photos/{digest}.{_PHOTO_EXTENSIONS.get(mimetype, "bin")}', lambda: photo_store.open(digest)
+    if is_data_url(row.photo):
+        try:
+            data = decode_data_url(row.photo)
+        except InvalidPhotoError:
+            return None, None
+        extension = _PHOTO_EXTENSIONS.get(sniff_mimetype(data[:16]), 'bin')
+        return f'photos/journal-{row.id}.{extension}', lambda: io.BytesIO(data)
+    return None, None
+
+class _ZipStream:
+    """不可 seek 的輸出緩衝；zipfile 寫入的位元組隨即由 generator 送出"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _generate_ndjson_export(user_id):
+    for row in _iter_export_rows(user_id):
+        yield json_dumps(_export_record(row, row.photo)) + b'\n'
+
+def _generate_zip_export(user_id):
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        # 第一輪：日誌 JSON (每行一篇)
+        with archive.open('journals.ndjson', 'w', force_zip64=True) as dest:
+            for row in _iter_export_rows(user_id):
+                photo_path, _ = _export_photo_entry(row) if row.photo else (None, None)
+                dest.write(json_dumps(_export_record(row, photo_path)) + b'\n')
+                yield stream.drain()
+
+        # 第二輪：照片檔案，相同照片只寫一次
+        written = set()
+        for row in _iter_export_rows(user_id, with_photo_only=True):
+            photo_path, opener = _export_photo_entry(row)
+            if not photo_path or photo_path in written:
+                continue
+            written.add(photo_path)
+            info = zipfile.ZipInfo(photo_path, date_time=(row.created_at or datetime.utcnow()).timetuple()[:6])
+            info.compress_type = zipfile.ZIP_STORED  # 圖片本身已壓縮
+            with opener() as src, archive.open(info, 'w', force_zip64=True) as dest:
+                while True:
+                    chunk = src.read(EXPORT_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    yield stream.drain()
+    yield stream.drain()
+
+@app.route('/api/journals/export')
+@login_required
+def export_journals():
+    """串流匯出用戶的所有日誌：format=ndjson (預設) 或 zip (含照片檔)"""
+    export_format = request.args.get('format', 'ndjson')
+    filename = f"travel-journal-{datetime.utcnow().strftime('%Y%m%d')}"
+    if export_format == 'ndjson':
+        generator, mimetype, filename = _generate_ndjson_export, 'application/x-ndjson', f'{filename}.ndjson'
+    elif export_format == 'zip':
+        generator, mimetype, filename = _generate_zip_export, 'application/zip', f'{filename}.zip'
+    else:
+        return jsonify({'success': False, 'message': 'format 必須是 ndjson 或 zip'}), 400
+
+    logger.info(f"用戶 {current_user().id} 匯出日誌 ({export_format})")
+    return Response(stream_with_context(generator(current_user().id)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+def _build_timeline(user_id, start, end):
+    """在資料庫端依年月與國家分組計數，走 (user_id, date) 索引"""
+    conditions = [Journal.user_id == user_id, *_date_range_conditions(start, end)]
+    year = func.extract('year', Journal.date)
+    month = func.extract('month', Journal.date)
+    month_rows = db.session.execute(
+        select(year, month, func.count(Journal.id))
+        .where(*conditions).group_by(year, month).order_by(year, month)
+    ).all()
+    country_rows = db.session.execute(
+        select(Journal.country, func.count(Journal.id), func.min(Journal.date), func.max(Journal.date))
+        .where(*conditions).group_by(Journal.country).order_by(func.count(Journal.id).desc(), Journal.country)
+    ).all()
+
+    months = [{'year': int(y), 'month': int(m), 'count': count} for y, m, count in month_rows]
+    years = {}
+    for entry in months:
+        years[entry['year']] = years.get(entry['year'], 0) + entry['count']
+    return jsonify({
+        'success': True,
+        'from': _format_date(start),
+        'to': _format_date(end),
+        'total': sum(entry['count'] for entry in months),
+        'first_date': _format_date(min((row[2] for row in country_rows), default=None)),
+        'last_date': _format_date(max((row[3] for row in country_rows), default=None)),
+        'years': [{'year': y, 'count': count} for y, count in years.items()],
+        'months': months,
+        'countries': [{'country': country, 'count': count,
+                       'first_date': _format_date(first), 'last_date': _format_date(last)}
+                      for country, count, first, last in country_rows],
+    })
+
+@app.route('/api/journals/timeline')
+@login_required
+def journal_timeline():
+    """依年/月與國家統計日誌數，可用 from/to 限定期間；結果隨資料版本快取，寫入日誌後自動更新"""
+    try:
+        start, end = _parse_date_range()
+    except JournalDataError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    try:
+        user_id = current_user().id
+        return _cached_user_response(user_id, lambda: _build_timeline(user_id, start, end))
+    except Exception as e:
+        logger.error(f"時間軸統計失敗: {e}\n{traceback.format_exc()}")
+        return jsonify({'success': False, 'message': '查詢失敗'}), 500
+
+# 增量同步：sync_token 記錄已送出的 (updated_at, id) 位置；完整送出後的 token 是查詢當下的時間，
+# 下次查詢往前多看 SYNC_OVERLAP_SECONDS，涵蓋查詢時尚未提交的交易 (重複送出的日誌由用戶端依 id 覆蓋)
+SYNC_OVERLAP_SECONDS = 5
+SYNC_PAGE_SIZE = 500
+MAX_SYNC_PAGE_SIZE = 1000
+app.config['TOMBSTONE_RETENTION_DAYS'] = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', 90))
+
+def _record_tombstones(user_id, journal_ids):
+    """在刪除日誌的同一個交易內留下刪除紀錄"""
+    if journal_ids:
+        now = datetime.utcnow()
+        db.session.execute(insert(JournalTombstone),
+                           [{'journal_id': i, 'user_id': user_id, 'deleted_at': now} for i in journal_ids])
+
+def _encode_sync_token(timestamp, journal_id=0):
+    raw = json.dumps([timestamp.isoformat(), journal_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def _decode_sync_token(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        timestamp, journal_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(journal_id)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise ValueError('since 格式錯誤') from e
+
+def _journal_changes(user_id, since, fields, limit):
+    started = datetime.utcnow()
+    journal_query = Journal.query.filter(Journal.user_id == user_id)
+    tombstone_conditions = [JournalTombstone.user_id == user_id]
+    if since:
+        timestamp, last_id = since
+        if last_id:
+            # 分頁中途：接著上一頁最後一篇之後
+            journal_query = journal_query.filter(tuple_(Journal.updated_at, Journal.id) > (timestamp, last_id))
+            tombstone_conditions.append(JournalTombstone.deleted_at > timestamp)
+        else:
+            overlap = timestamp - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+            journal_query = journal_query.filter(Journal.updated_at > overlap)
+            tombstone_conditions.append(JournalTombstone.deleted_at > overlap)
+
+    columns = {'id', 'updated_at'}
+    for field in fields:
+        columns.update(_JOURNAL_PROJECTIONS[field][0])
+    journals = (journal_query.options(load_only(*(getattr(Journal, c) for c in columns)))
+                .order_by(Journal.updated_at, Journal.id).limit(limit + 1).all())
+    has_more = len(journals) > limit
+    journals = journals[:limit]
+    if has_more:
+        # 這一頁只涵蓋到最後一篇的時間，之後的刪除留給下一頁
+        last = journals[-1]
+        tombstone_conditions.append(JournalTombstone.deleted_at <= last.updated_at)
+        token = _encode_sync_token(last.updated_at, last.id)
+    else:
+        token = _encode_sync_token(max(started, since[0]) if since else started)
+
+    deleted = db.session.execute(
+        select(JournalTombstone.journal_id).where(*tombstone_conditions).distinct()
+    ).scalars().all() if since else []
+    return jsonify({
+        'success': True,
+        'journals': [_serialize_journal(j, fields) for j in journals],
+        'deleted': deleted,
+        'sync_token': token,
+        'has_more': has_more,
+    })
+
+@app.route('/api/journals/changes')
+@login_required
+def journal_changes():
+    """回傳 since 之後新增或修改的日誌與被刪除的日誌 id；未帶 since 時回傳全部日誌 (第一次同步)
+
+    回應的 sync_token 作為下次的 since；has_more 為 true 時立即以新 token 繼續取下一頁。
+    since 早於刪除紀錄的保留期限時回傳 410，用戶端需重新完整同步。
+    """
+    try:
+        fields = _parse_fields()
+        limit = min(max(int(request.args.get('limit', SYNC_PAGE_SIZE)), 1), MAX_SYNC_PAGE_SIZE)
+        since = _decode_sync_token(request.args['since']) if request.args.get('since') else None
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    retention = timedelta(days=app.config['TOMBSTONE_RETENTION_DAYS'])
+    if since and since[0] < datetime.utcnow() - retention:
+        return jsonify({'success': False, 'message': 'since 已過期，請重新完整同步', 'resync': True}), 410
+
+    try:
+        user_id = current_user().id
+        # 資料版本沒變時沿用快取 (含當時的 sync_token)，沒有新變更的輪詢可直接得到 304
+        return _cached_user_response(user_id, lambda: _journal_changes(user_id, since, fields, limit))
+    except Exception as e:
+        logger.error(f"增量同步失敗: {e}\n{traceback.format_exc()}")
+        return jsonify({'success': False, 'message': '查詢失敗'}), 500
+
+# 旅行統計：每個 worker 快取各用戶的座標陣列，資料版本改變時先以增量同步的方式補上新日誌，
+# 只有新日誌排在中間、座標被修改或有日誌被刪除時才整份重新載入
+travel_stats_cache = TravelStatsCache(max_entries=int(os.environ.get('TRAVEL_STATS_CACHE_SIZE', 256)))
+# 變更數超過此值時直接整份重新載入
+TRAVEL_STATS_MAX_DELTA = 1000
+
+_TRAVEL_COLUMNS = (Journal.id, Journal.lat, Journal.lng, Journal.date, Journal.created_at)
+_TRAVEL_ORDER = (Journal.date, Journal.created_at, Journal.id)
+
+def _load_travel_points(user_id, version, synced_at):
+    rows = db.session.execute(select(*_TRAVEL_COLUMNS).where(Journal.user_id == user_id).order_by(*_TRAVEL_ORDER)).all()
+    located = [tuple(row) for row in rows if has_location(row.lat, row.lng)]
+    return TravelPoints.from_rows(located, version, synced_at, max_id=max((row.id for row in rows), default=0))
+
+def _update_travel_points(user_id, points, version, synced_at):
+    """以上次載入後的變更更新快取；變更無法直接接在最後面時回傳 None"""
+    since = points.synced_at - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+    if db.session.execute(select(JournalTombstone.id).where(JournalTombstone.user_id == user_id,
+                                                            JournalTombstone.deleted_at > since).limit(1)).first():
+        return None
+    rows = db.session.execute(
+        select(*_TRAVEL_COLUMNS).where(Journal.user_id == user_id, Journal.updated_at > since)
+        .order_by(*_TRAVEL_ORDER).limit(TRAVEL_STATS_MAX_DELTA + 1)
+    ).all()
+    if len(rows) > TRAVEL_STATS_MAX_DELTA:
+        return None
+
+    appended = []
+    for row in rows:
+        located = has_location(row.lat, row.lng)
+        if row.id <= points.max_id:
+            # 已經看過的日誌：只修改內容時不影響統計，座標或日期變了就要重新載入
+            index = points.position(row.id)
+            if index is None:
+                if located:
+                    return None
+            elif (not located or (float(points.lat[index]), float(points.lng[index])) != (row.lat, row.lng)
+                  or str(points.days[index]) != row.date.isoformat()):
+                return None
+        elif located:
+            appended.append(tuple(row))
+    if appended and points.last_key is not None and (appended[0][3], appended[0][4], appended[0][0]) <= points.last_key:
+        return None
+    updated = points.extended(appended, version, synced_at)
+    updated.max_id = max([updated.max_id] + [row.id for row in rows])
+    return updated
+
+def _travel_points(user_id):
+    version = _get_data_version(user_id)
+    points = travel_stats_cache.get(user_id)
+    if points is not None and points.version == version:
+        return points
+    synced_at = datetime.utcnow()
+    updated = _update_travel_points(user_id, points, version, synced_at) if points is not None else None
+    if updated is None:
+        updated = _load_travel_points(user_id, version, synced_at)
+    travel_stats_cache.set(user_id, updated)
+    return updated
+
+def _parse_home():
+    raw = request.args.get('home')
+    if not raw:
+        return None
+    try:
+        lat, lng = (float(v) for v in raw.split(','))
+    except ValueError:
+        raise ValueError('home 格式應為 lat,lng') from None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError('home 座標超出範圍')
+    return lat, lng
+
+@app.route('/api/stats/travel')
+@login_required
+def travel_statistics():
+    """依日期順序的日誌座標統計總移動距離、最長的幾段路程、各年距離與離家最遠的地點
+
+    home=lat,lng 指定出發地，未指定時以第一篇有座標的日誌為準。
+    """
+    if not travel_stats_available():
+        return jsonify({'success': False, 'message': '伺服器未安裝 numpy，無法計算旅行統計'}), 503
+    try:
+        home = _parse_home()
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    try:
+        user_id = current_user().id
+        return _cached_user_response(
+            user_id, lambda: jsonify(dict(_travel_points(user_id).summary(home), success=True)))
+    except Exception as e:
+        logger.error(f"旅行統計失敗: {e}\n{traceback.format_exc()}")
+        return jsonify({'success': False, 'message': '統計失敗'}), 500
+
+# 地圖聚合：日誌數不超過此值的聚合點會附上全部日誌摘要
+CLUSTER_EXPAND_LIMIT = 5
+_CLUSTER_JOURNAL_FIELDS = ['id', 'date', 'location', 'country', 'content', 'lat', 'lng', 'photo', 'thumbnails', 'journal_type']
+
+def _cluster_journal_summary(journal):
+    summary = _serialize_journal(journal, _CLUSTER_JOURNAL_FIELDS)
+    summary['content'] = (summary['content'] or '')[:150]
+    return summary
+
+@app.route('/api/journals/clusters')
+@login_required
+def journal_clusters():
+    """依 geohash 格子在資料庫端聚合地圖範圍內的日誌"""
+    try:
+        zoom = int(request.args.get('zoom', 2))
+        bbox = parse_bbox(request.args['bbox']) if request.args.get('bbox') else None
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'參數錯誤: {e}'}), 400
+
+    try:
+        precision = precision_for_zoom(zoom)
+        cell = func.substr(Journal.geohash, 1, precision)
+        conditions = [Journal.user_id == current_user().id, Journal.geohash.isnot(None)]
+        if bbox:
+            south, north, lng_ranges = bbox
+            conditions.append(Journal.lat.between(south, north))
+            if lng_ranges:
+                conditions.append(or_(*(Journal.lng.between(west, east) for west, east in lng_ranges)))
+
+        rows = db.session.execute(
+            select(cell.label('cell'),
+                   func.count(Journal.id),
+                   func.avg(Journal.lat), func.avg(Journal.lng),
+                   func.min(Journal.lat), func.min(Journal.lng),
+                   func.max(Journal.lat), func.max(Journal.lng))
+            .where(*conditions)
+            .group_by(cell)
+        ).all()
+
+        # 代表日誌 (每格日期最新的一篇，排序與日誌列表相同) 與小聚合點的全部日誌，一次查回
+        newest_first = (Journal.date.desc(), Journal.created_at.desc(), Journal.id.desc())
+        small_cells = [row[0] for row in rows if row[1] <= CLUSTER_EXPAND_LIMIT]
+        large_cells = [row[0] for row in rows if row[1] > CLUSTER_EXPAND_LIMIT]
+        columns = {c for f in _CLUSTER_JOURNAL_FIELDS for c in _JOURNAL_PROJECTIONS[f][0]} | {'geohash', 'created_at'}
+        journal_query = (Journal.query
+                         .options(load_only(*(getattr(Journal, c) for c in columns)))
+                         .filter(Journal.user_id == current_user().id))
+        by_cell = {}
+        if small_cells:
+            for j in journal_query.filter(*conditions[2:], cell.in_(small_cells)).order_by(*newest_first):
+                by_cell.setdefault(j.geohash[:precision], []).append(_cluster_journal_summary(j))
+        if large_cells:
+            ranked = (select(Journal.id, func.row_number().over(partition_by=cell, order_by=newest_first).label('rank'))
+                      .where(*conditions, cell.in_(large_cells))
+                      .subquery())
+            for j in journal_query.filter(Journal.id.in_(select(ranked.c.id).where(ranked.c.rank == 1))):
+                by_cell[j.geohash[:precision]] = [_cluster_journal_summary(j)]
+
+        clusters = []
+        for key, count, lat, lng, south, west, north, east in rows:
+            journals = by_cell[key]
+            clusters.append({
+                'key': key,
+                'count': count,
+                'lat': float(lat),
+                'lng': float(lng),
+                'bounds': [[float(south), float(west)], [float(north), float(east)]],
+                'journal': journals[0],
+                'journals': journals if count <= CLUSTER_EXPAND_LIMIT else None
+            })
+        return jsonify({'success': True, 'precision': precision, 'clusters': clusters})
+    except Exception as e:
+        logger.error(f"地圖聚合查詢失敗: {e}\n{traceback.format_exc()}")
+        return jsonify({'success': False, 'message': '查詢失敗'}), 500
+
+@app.route('/api/photos', methods=['POST'])
+@login_required
+def upload_photo():
+    """以 multipart/form-data 上傳照片 (欄位 photo)，回傳可填入日誌 photo 欄位的參照"""
+    try:
+        upload = request.files.get('photo')
+    except (RequestEntityTooLarge, UnsupportedMediaType) as e:
+        return jsonify({'success': False, 'message': e.description}), e.code
+    if upload is None or not upload.filename:
+        return jsonify({'success': False, 'message': '請以 multipart/form-data 上傳 photo 欄位'}), 400
+    if not allowed_file(upload.filename):
+        return jsonify({'success': False,
+                        'message': f"僅支援 {', '.join(sorted(ALLOWED_EXTENSIONS))} 格式"}), 415
+
+    received = upload.stream
+    try:
+        received.seek(0)
+        digest = photo_store.put_file(received, received.digest)
+    except UnsupportedMediaType as e:
+        return jsonify({'success': False, 'message': e.description}), e.code
+    except OSError as e:
+        logger.error(f"照片儲存失敗: {e}")
+        return jsonify({'success': False, 'message': '照片儲存失敗'}), 500
+    finally:
+        upload.close()
+
+    reference = photo_url(digest)
+    thumbnails.schedule(digest)
+    logger.info(f"用戶 {current_user().id} 上傳照片 {digest[:12]} ({received.size} bytes)")
+    return jsonify({
+        'success': True,
+        'photo': reference,
+        'thumbnails': _photo_variants(reference),
+        'mimetype': received.mimetype,
+        'size': received.size
+    }), 201
+
+@app.route('/photos/<digest>')
+def serve_photo(digest):
+    """照片內容以雜湊定址且不可變，可用長效快取與 ETag"""
+    if not is_valid_digest(digest):
+        abort(404)
+    if digest in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        try:
+            f = photo_store.open(digest)
+        except FileNotFoundError:
+            abort(404)
+        mimetype = sniff_mimetype(f.read(16)) or 'application/octet-stream'
+        f.seek(0)
+        response = send_file(f, mimetype=mimetype, etag=False, max_age=PHOTO_CACHE_MAX_AGE)
+    response.set_etag(digest)
+    response.cache_control.public = True
+    response.cache_control.max_age = PHOTO_CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/photos/<digest>/<size>')
+def serve_photo_variant(digest, size):
+    """回傳縮圖；快取不存在時即時補建"""
+    if size not in DERIVATIVE_SIZES or not is_valid_digest(digest):
+        abort(404)
+    if not thumbnails.available:
+        return redirect(photo_url(digest))
+    etag = f'{digest}-{size}'
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        try:
+            path = thumbnails.get(digest, size)
+        except FileNotFoundError:
+            abort(404)
+        except Exception as e:
+            logger.error(f"縮圖產生失敗 {digest}/{size}: {e}")
+            return redirect(photo_url(digest))
+        response = send_file(path, mimetype=thumbnails.mimetype, etag=False, max_age=PHOTO_CACHE_MAX_AGE)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = PHOTO_CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+# 最近這段時間內主資料庫有查詢成功時，健康檢查直接沿用結果，不再為每次探測取用連線
+HEALTH_DB_CHECK_SECONDS = int(os.environ.get('HEALTH_DB_CHECK_SECONDS', 30))
 
 @app.route('/health')
 def health_check():
     """健康檢查端點"""
-    try:
-        db.session.execute(db.text('SELECT 1'))
+    readiness_error = ensure_database_ready()
+    last_success = sql_metrics.last_success()
+    if last_success is not None and time.monotonic() - last_success < HEALTH_DB_CHECK_SECONDS:
         db_status = 'healthy'
-    except Exception as e:
-        db_status = f'unhealthy: {str(e)}'
-        logger.error(f"健康檢查失敗: {e}")
+    else:
+        try:
+            # 直接向主資料庫探測，不經過可能改走複本的 session
+            with db.engine.connect() as conn:
+                conn.execute(db.text('SELECT 1'))
+            db_status = 'healthy'
+        except Exception as e:
+            db_status = f'unhealthy: {str(e)}'
+            logger.error(f"健康檢查失敗: {e}")
     
     return jsonify({
-        'status': 'ok' if db_status == 'healthy' else 'degraded',
-        'database': db_status
+        'status': 'ok' if db_status == 'healthy' and readiness_error is None else 'degraded',
+        'database': db_status,
+        'pool': sql_metrics.pool_status(),
+        'replica_pools': {key: sql_metrics.pool_status(engine) for key, engine in replica_engines(db).items()},
+        'schema': readiness_error or 'up to date',
+        'startup_ms': STARTUP_TIMINGS
     })
 
+@app.route('/metrics')
+def metrics():
+    """Prometheus 文字格式的指標 (此 worker 程序的累計值)"""
+    token = app.config['METRICS_TOKEN']
+    if token and not secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({'success': False, 'message': '未授權'}), 401
+    return Response(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
 @app.errorhandler(404)
 def not_found(e):
     try:
@@ -601,8 +2063,261 @@ def server_error(e):
     except:
         return "500 Internal Server Error", 500
 
-if __name__ != '__main__':
-    init_db()
+# 背景維護工作：在各 web worker 的背景執行緒 (JOB_SCHEDULER=thread) 或獨立程序
+# (flask --app app jobs worker) 中排程，以 job_runs 表的租約確保同一時間只有一個程序執行
+app.config['JOB_SCHEDULER'] = os.environ.get('JOB_SCHEDULER', 'thread')
+app.config['GUEST_TTL_DAYS'] = int(os.environ.get('GUEST_TTL_DAYS', 30))
+MAINTENANCE_BATCH_SIZE = 200
+HOUR = 60 * 60
+
+job_runs_total = metrics_registry.counter('job_runs_total', '背景工作執行次數', ('job', 'status'))
+job_seconds = metrics_registry.histogram('job_duration_seconds', '背景工作執行時間', ('job',),
+                                         buckets=(0.1, 1, 10, 60, 300, 1800))
+
+def _record_job_metrics(name, status, seconds):
+    job_runs_total.inc(job=name, status=status)
+    job_seconds.observe(seconds, job=name)
+
+job_scheduler = JobScheduler(app, db, tick=int(os.environ.get('JOB_TICK_SECONDS', 60)), on_finish=_record_job_metrics)
+
+def _user_id_batches(batch_size, *conditions):
+    last_id = 0
+    while True:
+        user_ids = db.session.execute(
+            select(User.id).where(User.id > last_id, *conditions).order_by(User.id).limit(batch_size)
+        ).scalars().all()
+        if not user_ids:
+            return
+        yield user_ids
+        last_id = user_ids[-1]
+
+def _delete_users(user_ids):
+    """刪除用戶及其日誌、統計、搜尋索引與照片；批次刪除不會觸發 ORM 事件，快取需自行清除"""
+    dialect = db.engine.dialect.name
+    photos = db.session.execute(
+        select(Journal.photo).where(Journal.user_id.in_(user_ids), Journal.photo.isnot(None)).distinct()
+    ).scalars().all()
+    for user_id in user_ids:
+        search.remove_user(db.session, dialect, user_id)
+    db.session.execute(delete(Journal).where(Journal.user_id.in_(user_ids)))
+    db.session.execute(delete(JournalTombstone).where(JournalTombstone.user_id.in_(user_ids)))
+    db.session.execute(delete(UserCountryStats).where(UserCountryStats.user_id.in_(user_ids)))
+    db.session.execute(delete(UserStats).where(UserStats.user_id.in_(user_ids)))
+    db.session.execute(delete(User).where(User.id.in_(user_ids)))
+    db.session.commit()
+    for user_id in user_ids:
+        user_cache.invalidate(user_id)
+    # 與刪除單篇日誌相同：其他日誌仍參照的照片保留
+    return _release_photos(digest_from_reference(photo) for photo in photos)
+
+@job_scheduler.job('reap-guests', every=6 * HOUR)
+def reap_stale_guests():
+    """刪除超過保留期限且期間沒有寫入日誌的訪客帳號"""
+    cutoff = datetime.utcnow() - timedelta(days=app.config['GUEST_TTL_DAYS'])
+    recently_active = (select(Journal.id)
+                       .where(Journal.user_id == User.id,
+                              func.coalesce(Journal.updated_at, Journal.created_at) >= cutoff)
+                       .exists())
+    removed = released = 0
+    while True:
+        # 每批刪除後重新查詢，已刪除的帳號不會再出現
+        user_ids = db.session.execute(
+            select(User.id)
+            .where(User.is_google.is_(True), User.created_at < cutoff, ~recently_active)
+            .order_by(User.id).limit(MAINTENANCE_BATCH_SIZE)
+        ).scalars().all()
+        if not user_ids:
+            break
+        released += _delete_users(user_ids)
+        removed += len(user_ids)
+        logger.info(f"已清除 {removed} 個訪客帳號")
+    return f'清除 {removed} 個超過 {app.config["GUEST_TTL_DAYS"]} 天未使用的訪客帳號，刪除 {released} 張照片'
+
+@job_scheduler.job('reconcile-stats', every=24 * HOUR)
+def reconcile_user_stats():
+    """重算所有用戶的統計，修正與日誌不一致的數字"""
+    checked = fixed = 0
+    for user_ids in _user_id_batches(MAINTENANCE_BATCH_SIZE):
+        versions = dict(db.session.execute(
+            select(UserStats.user_id, UserStats.data_version).where(UserStats.user_id.in_(user_ids))).all())
+        for user_id in user_ids:
+            if rebuild_user_stats(user_id).data_version != versions.get(user_id):
+                fixed += 1
+        db.session.commit()
+        db.session.expunge_all()
+        checked += len(user_ids)
+    return f'檢查 {checked} 位用戶，修正 {fixed} 位'
+
+@job_scheduler.job('prune-tombstones', every=24 * HOUR)
+def prune_tombstones():
+    """刪除超過保留期限的日誌刪除紀錄 (更舊的 since 會要求用戶端重新完整同步)"""
+    cutoff = datetime.utcnow() - timedelta(days=app.config['TOMBSTONE_RETENTION_DAYS'])
+    removed = 0
+    while True:
+        ids = db.session.execute(
+            select(JournalTombstone.id).where(JournalTombstone.deleted_at < cutoff)
+            .order_by(JournalTombstone.id).limit(MAINTENANCE_BATCH_SIZE * 5)
+        ).scalars().all()
+        if not ids:
+            break
+        db.session.execute(delete(JournalTombstone).where(JournalTombstone.id.in_(ids)))
+        db.session.commit()
+        removed += len(ids)
+    return f'刪除 {removed} 筆超過 {app.config["TOMBSTONE_RETENTION_DAYS"]} 天的刪除紀錄'
+
+@job_scheduler.job('analyze', every=24 * HOUR)
+def analyze_database():
+    """更新 SQLite 查詢規劃器的統計並整理全文檢索索引 (PostgreSQL 由 autovacuum 處理)"""
+    if db.engine.dialect.name != 'sqlite':
+        return 'PostgreSQL 由 autovacuum 處理，略過'
+    with db.engine.begin() as conn:
+        conn.execute(db.text('ANALYZE'))
+        if search.supported('sqlite'):
+            conn.execute(db.text(f"INSERT INTO {search.SEARCH_TABLE}({search.SEARCH_TABLE}) VALUES ('optimize')"))
+    return '已更新統計資訊'
+
+@job_scheduler.job('vacuum', every=7 * 24 * HOUR, timeout=HOUR)
+def vacuum_database():
+    """重整 SQLite 資料庫檔案，回收刪除資料後的空間"""
+    if db.engine.dialect.name != 'sqlite':
+        return 'PostgreSQL 由 autovacuum 處理，略過'
+    path = db.engine.url.database
+    before = os.path.getsize(path) if path and os.path.exists(path) else 0
+    # VACUUM 不能在交易中執行
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(db.text('VACUUM'))
+    after = os.path.getsize(path) if path and os.path.exists(path) else 0
+    return f'資料庫大小 {before // 1024}KB -> {after // 1024}KB'
+
+@app.cli.group('db')
+def db_cli():
+    """資料庫結構遷移"""
+
+@db_cli.command('upgrade')
+@click.option('--batch-size', default=1000, show_default=True, help='資料回填每批處理的列數')
+def db_upgrade_command(batch_size):
+    """套用所有尚未執行的遷移"""
+    applied = migrations.upgrade(db, progress=click.echo, batch_size=batch_size)
+    click.echo(f"✅ 已套用 {len(applied)} 個遷移" if applied else "資料庫已是最新版本")
+
+@db_cli.command('status')
+def db_status_command():
+    """列出各遷移的套用狀態"""
+    applied = migrations.applied_versions(db.engine)
+    for m in migrations.MIGRATIONS:
+        mark = '✅' if m.version in applied else '⏳'
+        click.echo(f"{mark} {m.version:04d} {m.description}")
+
+@db_cli.command('sync-replicas')
+def db_sync_replicas_command():
+    """將主資料庫複製到各 SQLite 複本 (本機以兩個 SQLite 檔模擬讀寫分離時使用)"""
+    engines = replica_engines(db)
+    if not engines:
+        raise click.ClickException('未設定 DATABASE_REPLICA_URLS')
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException('只支援 SQLite；PostgreSQL 複本請使用資料庫本身的串流複寫')
+    for key, engine in engines.items():
+        if engine.dialect.name != 'sqlite':
+            click.echo(f"略過 {key}：不是 SQLite")
+            continue
+        with db.engine.connect() as source, engine.connect() as target:
+            source.connection.driver_connection.backup(target.connection.driver_connection)
+        click.echo(f"✅ 已同步 {key} ({engine.url.database})")
+
+@app.cli.command('migrate-photos')
+@click.option('--batch-size', default=50, show_default=True, help='每批處理的日誌數')
+def migrate_photos_command(batch_size):
+    """將 Journal.photo 中舊的 base64 照片分批搬到 photo store"""
+    moved = 0
+    failed = 0
+    last_id = 0
+    while True:
+        batch = (Journal.query
+                 .options(load_only(Journal.id, Journal.user_id, Journal.photo))
+                 .filter(Journal.id > last_id, Journal.photo.like('data:%'))
+                 .order_by(Journal.id)
+                 .limit(batch_size)
+                 .all())
+        if not batch:
+            break
+        changed_users = set()
+        for j in batch:
+            last_id = j.id
+            try:
+                j.photo = _store_photo(j.photo)
+                changed_users.add(j.user_id)
+                moved += 1
+            except InvalidPhotoError as e:
+                failed += 1
+                logger.warning(f"日誌 {j.id} 的照片無法搬移: {e}")
+        if changed_users:
+            # 照片網址變了：在同一個交易遞增資料版本，讓快取的日誌回應失效
+            db.session.execute(update(UserStats)
+                               .where(UserStats.user_id.in_(changed_users))
+                               .values(data_version=UserStats.data_version + 1))
+        db.session.commit()
+        db.session.expunge_all()
+        click.echo(f"已搬移 {moved} 張照片 (目前 id={last_id})")
+    click.echo(f"✅ 照片搬移完成：成功 {moved} 張，失敗 {failed} 張")
+
+@app.cli.command('rebuild-stats')
+@click.option('--user-id', type=int, default=None, help='只重算指定用戶')
+@click.option('--batch-size', default=100, show_default=True, help='每次交易處理的用戶數')
+def rebuild_stats_command(user_id, batch_size):
+    """從 journals 重新計算所有用戶的統計"""
+    if user_id is not None:
+        rebuild_user_stats(user_id)
+        db.session.commit()
+        click.echo(f"✅ 已重算用戶 {user_id} 的統計")
+        return
+
+    done = 0
+    for user_ids in _user_id_batches(batch_size):
+        for uid in user_ids:
+            rebuild_user_stats(uid)
+        db.session.commit()
+        db.session.expunge_all()
+        done += len(user_ids)
+        click.echo(f"已重算 {done} 位用戶")
+    click.echo(f"✅ 統計重算完成，共 {done} 位用戶")
+
+@app.cli.group('jobs')
+def jobs_cli():
+    """背景維護工作"""
+    error = ensure_database_ready()
+    if error:
+        raise click.ClickException(error)
+
+@jobs_cli.command('list')
+def jobs_list_command():
+    """列出工作與最近一次執行結果"""
+    status = job_scheduler.status()
+    for name, job in job_scheduler.jobs.items():
+        row = status.get(name, {})
+        last = (f"{row['last_status']} {row['last_duration_ms']}ms @ {row['last_finished_at']:%Y-%m-%d %H:%M}"
+                if row.get('last_finished_at') else '尚未執行')
+        upcoming = f"{row['next_run_at']:%Y-%m-%d %H:%M}" if row.get('next_run_at') else '盡快'
+        click.echo(f"{name:<18} 每 {job.interval // 3600}h  {last}  下次 {upcoming}  {job.description}")
+
+@jobs_cli.command('run')
+@click.argument('name', type=click.Choice(sorted(job_scheduler.jobs)))
+@click.option('--force', is_flag=True, help='忽略下次執行時間立即執行')
+def jobs_run_command(name, force):
+    """執行單一工作 (仍需取得租約，不會與其他程序重複執行)"""
+    result = job_scheduler.run(name, force=force)
+    if result is None:
+        click.echo(f"⏳ {name} 尚未到期或正由其他程序執行，可加上 --force")
+        return
+    click.echo(f"{'✅' if result['status'] == 'ok' else '❌'} {name} ({result['seconds']}s): {result['message']}")
+
+@jobs_cli.command('worker')
+def jobs_worker_command():
+    """在前景持續排程 (搭配 JOB_SCHEDULER=off 以獨立程序執行維護工作)"""
+    click.echo(f"工作排程啟動，每 {job_scheduler.tick}s 檢查一次：{', '.join(job_scheduler.jobs)}")
+    job_scheduler.serve_forever()
+
+_mark_startup('routes')
+logger.info(f"app 載入完成，耗時 (ms): {STARTUP_TIMINGS}")
 
 if __name__ == '__main__':
     init_db()
@@ -0,0 +1,418 @@
+"""負載基準測試：以合成資料量測每個路由的延遲、吞吐量、回應大小與記憶體
+
+    python benchmarks/load.py --users 10 --journals 200 --requests 100 --output before.json
+    python benchmarks/load.py --mode gunicorn --concurrency 8 --output after.json
+    python benchmarks/load.py --compare before.json after.json
+
+先以 seed.py 產生資料，再分別透過 Flask test client (單一程序、依序送出，只含 app 本身的耗時)
+與實際的 gunicorn 程序 (gunicorn.conf.py，多個用戶端並行) 對每個路由送出請求。
+每個路由回報 p50/p95/p99 延遲、每秒請求數、平均回應大小、狀態碼與期間的 RSS 峰值，結果存成 JSON，
+可用 --compare 比較兩次結果。讀取 API 會經過回應快取，與正式環境相同。
+"""
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import platform
+import random
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, deque
+from datetime import datetime
+
+import seed as seeder
+from photo_store import digest_from_reference
+from login_concurrency import rss_kib, wait_ready
+
+ROOT = seeder.ROOT
+
+SEARCH_WORDS = ('咖啡', '博物館', '日出', 'market', '小吃', '書店')
+GEOCODE_PREFIXES = ('tok', '台', 'par', 'new', 'lon', '京', 'ber', 'syd')
+
+
+class TestClientSession:
+    def __init__(self, client):
+        self.client = client
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code, response.get_data()
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpSession:
+    """帶 cookie、不跟隨轉址的 HTTP 用戶端，與 test client 回傳相同格式"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + urllib.parse.quote(path, safe='/?=&,'), data=data, method=method,
+                                     headers={'Content-Type': 'application/json'} if data else {})
+        try:
+            with self.opener.open(req, timeout=60) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class Context:
+    """各用戶的日誌 id、國家與照片，供情境產生請求路徑"""
+
+    def __init__(self, travel_app, users):
+        self.users = users
+        self.journal_ids = []
+        self.countries = []
+        self.coordinates = []
+        self.dashboard_cursors = []
+        self.created = [deque() for _ in range(users)]
+        with travel_app.app.app_context():
+            for index in range(users):
+                user = travel_app.User.query.filter_by(email=seeder.user_email(index)).one()
+                Journal = travel_app.Journal
+                rows = travel_app.db.session.query(Journal.id, Journal.country, Journal.lat, Journal.lng) \
+                    .filter_by(user_id=user.id).all()
+                self.journal_ids.append([r.id for r in rows])
+                self.coordinates.append([(r.lat, r.lng) for r in rows])
+                self.countries.append(sorted({r.country for r in rows}))
+                _, cursor = travel_app._journal_page(Journal.query.filter_by(user_id=user.id),
+                                                     travel_app.DASHBOARD_CARD_FIELDS, travel_app.DASHBOARD_PAGE_SIZE)
+                self.dashboard_cursors.append(cursor)
+            references = travel_app.db.session.query(travel_app.Journal.photo).distinct()
+            self.photo_digests = sorted(filter(None, (digest_from_reference(r.photo) for r in references)))
+
+
+def _new_journal(rng):
+    return {'date': '2024-05-01', 'location': '台北車站', 'country': '台灣', 'content': rng.choice(SEARCH_WORDS) * 20,
+            'lat': 25.0478, 'lng': 121.517}
+
+
+def _record_created(ctx, user, status, body):
+    if status == 201:
+        ctx.created[user].append(json.loads(body)['id'])
+
+
+def _record_batch_created(ctx, user, status, body):
+    if status == 200:
+        ctx.created[user].extend(r['id'] for r in json.loads(body)['results'] if r['success'] and r['op'] == 'create')
+
+
+def _delete_created(ctx, user, rng):
+    try:
+        return 'DELETE', f'/api/journals/{ctx.created[user].popleft()}', None
+    except IndexError:
+        return None
+
+
+# 情境：(名稱, 產生 (method, path, body) 的函式, 收到回應後的處理)；讀取在前，寫入在後
+SCENARIOS = [
+    ('page_index', lambda ctx, u, rng: ('GET', '/', None), None),
+    ('page_login', lambda ctx, u, rng: ('GET', '/login', None), None),
+    ('page_dashboard', lambda ctx, u, rng: ('GET', '/dashboard', None), None),
+    ('dashboard_more', lambda ctx, u, rng: ('GET', f'/dashboard/journals?cursor={ctx.dashboard_cursors[u]}', None)
+     if ctx.dashboard_cursors[u] else None, None),
+    ('page_add_journal', lambda ctx, u, rng: ('GET', '/add_journal', None), None),
+    ('page_edit_journal', lambda ctx, u, rng: ('GET', f'/edit_journal/{rng.choice(ctx.journal_ids[u])}', None), None),
+    ('journals_list', lambda ctx, u, rng: ('GET', '/api/journals', None), None),
+    ('journals_page', lambda ctx, u, rng: ('GET', '/api/journals?limit=20', None), None),
+    ('journals_page_fields', lambda ctx, u, rng: ('GET', '/api/journals?limit=100&fields=id,date,location', None), None),
+    ('journal_detail', lambda ctx, u, rng: ('GET', f'/api/journals/{rng.choice(ctx.journal_ids[u])}', None), None),
+    ('journals_by_country', lambda ctx, u, rng: ('GET', f'/api/journals/country/{rng.choice(ctx.countries[u])}', None),
+     None),
+    ('journals_range', lambda ctx, u, rng: ('GET', f'/api/journals?limit=50&from={rng.randrange(2020, 2026)}-01-01', None),
+     None),
+    ('journals_timeline', lambda ctx, u, rng: ('GET', '/api/journals/timeline', None), None),
+    ('journals_changes', lambda ctx, u, rng: ('GET', '/api/journals/changes?limit=100', None), None),
+    ('stats_travel', lambda ctx, u, rng: ('GET', '/api/stats/travel', None), None),
+    ('journals_search', lambda ctx, u, rng: ('GET', f'/api/journals/search?q={rng.choice(SEARCH_WORDS)}', None), None),
+    ('journals_clusters', lambda ctx, u, rng: ('GET', f'/api/journals/clusters?zoom={rng.choice((2, 4, 6))}', None),
+     None),
+    ('journals_export', lambda ctx, u, rng: ('GET', '/api/journals/export', None), None),
+    ('geocode', lambda ctx, u, rng: ('GET', f'/api/geocode?q={rng.choice(GEOCODE_PREFIXES)}', None), None),
+    ('reverse_geocode', lambda ctx, u, rng: ('GET', '/api/reverse-geocode?lat={:.4f}&lng={:.4f}'.format(
+        *(c + rng.uniform(-0.5, 0.5) for c in rng.choice(ctx.coordinates[u]))), None), None),
+    ('photo', lambda ctx, u, rng: ('GET', f'/photos/{rng.choice(ctx.photo_digests)}', None)
+     if ctx.photo_digests else None, None),
+    ('photo_card', lambda ctx, u, rng: ('GET', f'/photos/{rng.choice(ctx.photo_digests)}/card', None)
+     if ctx.photo_digests else None, None),
+    ('health', lambda ctx, u, rng: ('GET', '/health', None), None),
+    ('metrics', lambda ctx, u, rng: ('GET', '/metrics', None), None),
+    ('journal_create', lambda ctx, u, rng: ('POST', '/api/journals', _new_journal(rng)), _record_created),
+    ('journal_update', lambda ctx, u, rng: ('PUT', f'/api/journals/{rng.choice(ctx.journal_ids[u])}',
+                                            {'content': rng.choice(seeder.PHRASES)}), None),
+    ('journal_delete', _delete_created, None),
+    ('journals_batch', lambda ctx, u, rng: ('POST', '/api/journals/batch',
+                                            [_new_journal(rng) for _ in range(20)]), _record_batch_created),
+    ('login', lambda ctx, u, rng: ('POST', '/login', {'email': seeder.user_email(u), 'password': seeder.PASSWORD}),
+     None),
+]
+# 不需要登入狀態、各自使用新工作階段的情境
+ANONYMOUS_SCENARIOS = [
+    ('register', lambda ctx, u, rng: ('POST', '/register', {'name': 'load', 'email': f'load-{secrets.token_hex(8)}@example.com',
+                                                            'password': seeder.PASSWORD}), None),
+    ('google_login', lambda ctx, u, rng: ('POST', '/google-login', None), None),
+]
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    # nearest-rank
+    index = max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(samples, elapsed, rss_peak_kib):
+    latencies = sorted(s[1] for s in samples)
+    ms = lambda v: round(v * 1000, 2) if v is not None else None  # noqa: E731
+    return {
+        'requests': len(samples),
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1] if latencies else None),
+        'avg_bytes': round(sum(s[2] for s in samples) / len(samples)) if samples else 0,
+        'status': dict(Counter(str(s[0]) for s in samples)),
+        'rss_peak_mib': round(rss_peak_kib / 1024, 1) if rss_peak_kib else None,
+    }
+
+
+def _run_scenario(sessions, ctx, scenario, count, concurrency, seed):
+    """以 concurrency 個執行緒送出 count 個請求，依序輪流使用各用戶的工作階段；
+    回傳 [(狀態碼, 秒數, 位元組)] 與總耗時"""
+    name, build, on_response = scenario
+    samples = []
+    remaining = iter(range(count))
+    lock = threading.Lock()
+
+    def worker(worker_index):
+        rng = random.Random(f'{seed}-{name}-{worker_index}')
+        while True:
+            with lock:
+                index = next(remaining, None)
+            if index is None:
+                return
+            user = index % ctx.users
+            spec = build(ctx, user, rng)
+            if spec is None:
+                continue
+            started = time.perf_counter()
+            status, body = sessions[user].request(*spec)
+            elapsed = time.perf_counter() - started
+            if on_response:
+                on_response(ctx, user, status, body)
+            with lock:
+                samples.append((status, elapsed, len(body)))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, time.perf_counter() - started
+
+
+def _login(session, user):
+    for _ in range(30):
+        status, _ = session.request('POST', '/login', {'email': seeder.user_email(user), 'password': seeder.PASSWORD})
+        if status == 200:
+            return
+        time.sleep(1)  # 密碼雜湊忙碌 (503) 時稍後重試
+    raise RuntimeError(f'用戶 {user} 登入失敗')
+
+
+def _cleanup(sessions, ctx):
+    """刪除量測時新增的日誌，讓下一個模式面對相同的資料量"""
+    for user, session in enumerate(sessions):
+        ids = list(ctx.created[user])
+        ctx.created[user].clear()
+        for start in range(0, len(ids), 500):
+            session.request('POST', '/api/journals/batch', [{'op': 'delete', 'id': i} for i in ids[start:start + 500]])
+
+
+def _run_suite(label, new_session, ctx, options, concurrency, rss_peak, progress):
+    """依序執行所有情境；rss_peak() 回傳上次呼叫以來的 RSS 峰值 (KiB) 並重新開始記錄"""
+    sessions = [new_session() for _ in range(ctx.users)]
+    for user, session in enumerate(sessions):
+        _login(session, user)
+
+    results = {}
+    for scenario in SCENARIOS + ANONYMOUS_SCENARIOS:
+        active = [new_session() for _ in sessions] if scenario in ANONYMOUS_SCENARIOS else sessions
+        _run_scenario(active, ctx, scenario, options.warmup, concurrency, options.seed)
+        rss_peak()
+        samples, elapsed = _run_scenario(active, ctx, scenario, options.requests, concurrency, options.seed)
+        result = results[scenario[0]] = summarize(samples, elapsed, rss_peak())
+        progress(f'  [{label}] {scenario[0]:<22} p50 {result["p50_ms"]}ms  p99 {result["p99_ms"]}ms  '
+                 f'{result["throughput_rps"]} req/s')
+    _cleanup(sessions, ctx)
+    return results
+
+
+def _self_rss_peak():
+    with open('/proc/self/status') as f:
+        peak = next(int(line.split()[1]) for line in f if line.startswith('VmHWM'))
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')  # 重設 VmHWM (Linux)
+    except OSError:
+        pass
+    return peak
+
+
+def run_testclient(travel_app, ctx, options, progress):
+    # 在同一個程序內依序送出：量到的是 app 本身的耗時，並行只會量到 GIL 競爭
+    return _run_suite('testclient', lambda: TestClientSession(travel_app.app.test_client()),
+                      ctx, options, 1, _self_rss_peak, progress)
+
+
+def run_gunicorn(env, ctx, options, progress):
+    port = options.port
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                             '-b', f'127.0.0.1:{port}', 'app:app'],
+                            cwd=ROOT, env=dict(os.environ, **env, PORT=str(port)),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    peak = [0]
+    stop = threading.Event()
+
+    def sample_rss():
+        try:
+            peak[0] = max(peak[0], rss_kib(proc.pid))
+        except (OSError, StopIteration):
+            pass  # worker 剛好重啟
+
+    def sampler():
+        while not stop.wait(0.05):
+            sample_rss()
+
+    def rss_peak():
+        sample_rss()
+        value, peak[0] = peak[0], 0
+        return value
+
+    try:
+        wait_ready(base_url)
+        threading.Thread(target=sampler, daemon=True).start()
+        return _run_suite('gunicorn', lambda: HttpSession(base_url), ctx, options, options.concurrency,
+                          rss_peak, progress)
+    finally:
+        stop.set()
+        proc.terminate()
+        proc.wait()
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline_path, current_path):
+    """逐路由比較兩次結果的 p50/p95/p99 與吞吐量"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+    print(f'baseline {baseline["meta"].get("revision")} -> current {current["meta"].get("revision")}')
+    for mode, scenarios in current['results'].items():
+        before = baseline['results'].get(mode, {})
+        print(f'\n[{mode}]')
+        print(f'{"route":<22}{"p50 ms":>26}{"p95 ms":>26}{"p99 ms":>26}{"req/s":>26}')
+        for name, result in scenarios.items():
+            old = before.get(name)
+            cells = []
+            for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+                new_value, old_value = result.get(key), (old or {}).get(key)
+                if new_value is None or not old_value:
+                    cells.append(f'{new_value!s:>26}')
+                else:
+                    cells.append(f'{f"{old_value} → {new_value} ({(new_value / old_value - 1) * 100:+.0f}%)":>26}')
+            print(f'{name:<22}{"".join(cells)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--journals', type=int, default=200, help='每位用戶的日誌數')
+    parser.add_argument('--photo-ratio', type=float, default=0.3)
+    parser.add_argument('--photo-pool', type=int, default=24)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--data-dir', help='沿用既有的資料目錄 (已有資料時不再產生)')
+    parser.add_argument('--mode', choices=('testclient', 'gunicorn', 'both'), default='both')
+    parser.add_argument('--requests', type=int, default=100, help='每個路由量測的請求數')
+    parser.add_argument('--warmup', type=int, default=5, help='每個路由量測前不計入的請求數')
+    parser.add_argument('--concurrency', type=int, default=8, help='gunicorn 模式的並行用戶端數')
+    parser.add_argument('--port', type=int, default=8790)
+    parser.add_argument('--output', help='結果 JSON 的存放路徑')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='比較兩次結果後結束')
+    options = parser.parse_args()
+
+    if options.compare:
+        compare(*options.compare)
+        return
+
+    data_dir = options.data_dir or tempfile.mkdtemp(prefix='travel-bench-')
+    reuse = os.path.exists(os.path.join(data_dir, 'benchmark.db'))
+    env = seeder.configure(data_dir)
+    import logging
+    logging.disable(logging.WARNING)  # 每個請求的 info 紀錄會拖慢量測
+    import app as travel_app
+
+    progress = lambda message: print(message, file=sys.stderr)  # noqa: E731
+    if reuse:
+        progress(f'沿用 {data_dir} 的資料')
+        seeded = {'reused': True}
+    else:
+        progress(f'產生資料於 {data_dir}')
+        seeded = seeder.seed(travel_app, options.users, options.journals, options.photo_ratio,
+                             options.photo_pool, options.seed, progress=progress)
+    ctx = Context(travel_app, options.users)
+
+    results = {}
+    if options.mode in ('testclient', 'both'):
+        results['testclient'] = run_testclient(travel_app, ctx, options, progress)
+    if options.mode in ('gunicorn', 'both'):
+        results['gunicorn'] = run_gunicorn(env, ctx, options, progress)
+
+    report = {
+        'meta': {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'options': {k: v for k, v in vars(options).items() if k != 'compare'},
+            'seed': seeded,
+        },
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        progress(f'✅ 結果已存到 {options.output}')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""登入尖峰時其他路由的回應時間：比較 gunicorn 預設 sync worker 與 gunicorn.conf.py
+
+    python benchmarks/login_concurrency.py --logins 40 --duration 10
+
+兩種設定使用相同的 worker 數，各自啟動 gunicorn，一邊持續送出登入請求，
+一邊量測 /health 的吞吐量與延遲，並回報每個設定的常駐記憶體 (RSS)。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def request(url, data=None):
+    body = json.dumps(data).encode() if data is not None else None
+    req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'} if body else {})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - started
+
+
+def wait_ready(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if request(base_url + '/health')[0] == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn 未能啟動')
+
+
+def rss_kib(pid):
+    """主程序與所有子程序的 RSS 總和 (Linux)"""
+    total = 0
+    pids = [pid]
+    children = f'/proc/{pid}/task/{pid}/children'
+    if os.path.exists(children):
+        pids += [int(p) for p in open(children).read().split()]
+    for p in pids:
+        with open(f'/proc/{p}/status') as f:
+            total += next(int(line.split()[1]) for line in f if line.startswith('VmRSS'))
+    return total
+
+
+def run(name, args, port, options):
+    env = dict(os.environ, PORT=str(port),
+               DATABASE_URL='sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', *args, 'app:app'], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        wait_ready(base_url)
+        request(base_url + '/register', {'name': 'bench', 'email': 'bench@example.com', 'password': 'secret'})
+
+        stop = threading.Event()
+        logins = []
+        health = []
+
+        def login_loop():
+            while not stop.is_set():
+                logins.append(request(base_url + '/login', {'email': 'bench@example.com', 'password': 'secret'}))
+                if logins[-1][0] == 503:
+                    stop.wait(1)  # 依 Retry-After 稍後重試
+
+        def health_loop():
+            while not stop.is_set():
+                health.append(request(base_url + '/health'))
+
+        threads = [threading.Thread(target=login_loop) for _ in range(options.logins)]
+        threads += [threading.Thread(target=health_loop) for _ in range(options.readers)]
+        for t in threads:
+            t.start()
+        time.sleep(options.duration)
+        memory = rss_kib(proc.pid)
+        stop.set()
+        for t in threads:
+            t.join()
+
+        latencies = sorted(elapsed for status, elapsed in health if status == 200)
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else float('nan')
+        return {
+            'mode': name,
+            'logins_per_s': round(sum(1 for status, _ in logins if status == 200) / options.duration, 1),
+            'login_busy': sum(1 for status, _ in logins if status == 503),
+            'health_per_s': round(len(latencies) / options.duration, 1),
+            'health_p50_ms': round(statistics.median(latencies) * 1000, 1) if latencies else None,
+            'health_p95_ms': round(p95 * 1000, 1),
+            'rss_mib': round(memory / 1024, 1),
+        }
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=20, help='同時登入的用戶端數')
+    parser.add_argument('--readers', type=int, default=4, help='同時讀取 /health 的用戶端數')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=2)
+    options = parser.parse_args()
+
+    modes = [
+        ('sync', ['-w', str(options.workers)]),
+        ('gthread', ['-c', 'gunicorn.conf.py', '-w', str(options.workers)]),
+    ]
+    results = []
+    for port, (name, args) in enumerate(modes, start=8765):
+        results.append(run(name, args + ['-b', f'127.0.0.1:{port}'], port, options))
+        print(json.dumps(results[-1], ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""合成測試資料：N 位用戶 × M 篇日誌，含 base64 照片、座標與國家
+
+    python benchmarks/seed.py --users 20 --journals 200 --data-dir /tmp/travel-bench
+
+地點取自隨附的地名檔並加上數公里內的偏移，國家與座標一致；照片以 Pillow 產生，
+大小分為幾種尺寸，部分日誌共用同一張照片 (與實際重複上傳相同)。
+資料透過 /register 與 /api/journals/batch 寫入，統計、搜尋索引與照片儲存都和正式流程一樣。
+相同的 --seed 會產生相同的資料。
+"""
+import argparse
+import base64
+import io
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from photo_store import decode_data_url  # noqa: E402
+
+PASSWORD = 'benchmark'
+PHOTO_SIZES = ((320, 240), (800, 600), (1280, 960))
+# 單次批次請求的照片資料上限，需低於 app 的 MAX_CONTENT_LENGTH (16MB)
+MAX_BATCH_BYTES = 8 * 1024 * 1024
+
+PHRASES = (
+    '今天天氣很好，沿著河邊散步了一整個下午。', '在巷子裡找到一家很棒的咖啡店。', '晚餐吃了當地有名的小吃，排隊排了半小時。',
+    '搭早班車去看日出，人比想像中少。', '博物館的展覽非常精彩，值得再來一次。', '下雨了，只好躲進書店裡待了一陣子。',
+    'Walked across the old town and got lost twice.', 'The night market was crowded but worth it.',
+)
+
+
+def configure(data_dir):
+    """設定 app 使用的資料庫與照片目錄；必須在匯入 app 之前呼叫，回傳給子程序用的環境變數"""
+    os.makedirs(data_dir, exist_ok=True)
+    env = {
+        'DATABASE_URL': 'sqlite:///' + os.path.join(data_dir, 'benchmark.db'),
+        'PHOTO_STORAGE_DIR': os.path.join(data_dir, 'photos'),
+        'PHOTO_DERIVATIVE_DIR': os.path.join(data_dir, 'photo-derivatives'),
+        'SECRET_KEY': 'benchmark',
+        'AUTO_MIGRATE': '1',
+    }
+    os.environ.update(env)
+    return env
+
+
+def make_photos(rng, count):
+    """產生 count 張 JPEG data URL：漸層加雜訊，壓縮後的大小接近一般照片"""
+    photos = []
+    for i in range(count):
+        size = PHOTO_SIZES[i % len(PHOTO_SIZES)]
+        gradient = Image.linear_gradient('L').rotate(rng.randrange(360)).resize(size)
+        noise = Image.effect_noise(size, rng.uniform(10, 40))
+        tint = Image.new('L', size, rng.randrange(256))
+        image = Image.merge('RGB', (gradient, noise, Image.blend(gradient, tint, 0.5)))
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=85)
+        photos.append('data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode())
+    return photos
+
+
+def make_journal(rng, places, photos, photo_ratio):
+    place = rng.choice(places)
+    journal = {
+        'date': (date.today() - timedelta(days=rng.randrange(3 * 365))).isoformat(),
+        'location': f'{place.name_zh or place.name} {rng.choice(("市區", "車站", "老街", "公園", "港口"))}',
+        'country': place.country,
+        'content': ''.join(rng.choice(PHRASES) for _ in range(rng.randint(1, 12))),
+        'lat': round(place.lat + rng.uniform(-0.05, 0.05), 6),
+        'lng': round(place.lng + rng.uniform(-0.05, 0.05), 6),
+    }
+    if photos and rng.random() < photo_ratio:
+        journal['photo'] = rng.choice(photos)
+    return journal
+
+
+def _chunks(operations):
+    chunk, size = [], 0
+    for op in operations:
+        op_size = len(op.get('photo') or '')
+        if chunk and (size + op_size > MAX_BATCH_BYTES or len(chunk) >= 500):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(op)
+        size += op_size
+    if chunk:
+        yield chunk
+
+
+def user_email(index):
+    return f'bench{index}@example.com'
+
+
+def seed(travel_app, users, journals, photo_ratio=0.3, photo_pool=24, seed=42, progress=print):
+    """建立 users 位用戶，各自寫入 journals 篇日誌；回傳統計資料"""
+    rng = random.Random(seed)
+    travel_app.gazetteer.load()
+    places = travel_app.gazetteer.places
+    photos = make_photos(rng, photo_pool) if photo_ratio > 0 else []
+
+    started = time.perf_counter()
+    created = 0
+    for index in range(users):
+        client = travel_app.app.test_client()
+        response = client.post('/register', json={'name': f'Bench {index}', 'email': user_email(index),
+                                                  'password': PASSWORD})
+        if response.status_code != 200:
+            response = client.post('/login', json={'email': user_email(index), 'password': PASSWORD})
+            if response.status_code != 200:
+                raise RuntimeError(f'無法建立或登入用戶 {user_email(index)}: {response.status_code}')
+        operations = [make_journal(rng, places, photos, photo_ratio) for _ in range(journals)]
+        for chunk in _chunks(operations):
+            response = client.post('/api/journals/batch', json=chunk)
+            if response.status_code != 200 or not response.get_json()['success']:
+                raise RuntimeError(f'批次寫入失敗: {response.get_data(as_text=True)[:200]}')
+            created += len(chunk)
+        progress(f'  用戶 {index + 1}/{users}，日誌 {created}')
+    # 縮圖在背景產生，這裡直接補齊，避免量測時才第一次建立
+    digests = [travel_app.photo_store.put(decode_data_url(photo)) for photo in photos]
+    if travel_app.thumbnails.available:
+        for digest in digests:
+            travel_app.thumbnails.build(digest)
+    return {
+        'users': users,
+        'journals': created,
+        'photos': len(photos),
+        'photo_bytes': sum(len(p) for p in photos),
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--journals', type=int, default=200, help='每位用戶的日誌數')
+    parser.add_argument('--photo-ratio', type=float, default=0.3, help='附照片的日誌比例')
+    parser.add_argument('--photo-pool', type=int, default=24, help='不重複的照片張數')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--data-dir', required=True, help='資料庫與照片的存放目錄')
+    args = parser.parse_args()
+
+    configure(args.data_dir)
+    import app as travel_app
+
+    summary = seed(travel_app, args.users, args.journals, args.photo_ratio, args.photo_pool, args.seed)
+    print(f"✅ {summary['users']} 位用戶、{summary['journals']} 篇日誌，耗時 {summary['seconds']}s")
+
+
+if __name__ == '__main__':
+    main()
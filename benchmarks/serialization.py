@@ -0,0 +1,90 @@
+"""日誌序列化基準測試：比較 jsonify 式的整批編碼與串流編碼
+
+    python benchmarks/serialization.py --count 5000 --repeat 5
+
+輸出每篇日誌的位元組數、平均耗時與峰值記憶體。
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 匯入 app 會連線資料庫，基準測試用暫存的 SQLite 即可
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.db'))
+
+import app as travel_app  # noqa: E402
+import serialization  # noqa: E402
+
+
+def make_journals(count):
+    photo = '/photos/' + 'ab' * 32
+    return [SimpleNamespace(
+        id=i,
+        date=date(2024, 1, 1),
+        location=f'東京都新宿區 {i}',
+        country='日本',
+        content='今天去了新宿御苑，櫻花正盛開。' * 8,
+        lat=35.6852,
+        lng=139.7101,
+        photo=photo if i % 3 == 0 else None,
+        journal_type='photo' if i % 3 == 0 else 'text',
+        created_at=datetime(2024, 1, 1, 12, 0),
+    ) for i in range(count)]
+
+
+def baseline(journals):
+    # 舊寫法：先組出整個 list，再以標準庫 json (排序鍵、跳脫中文) 一次編碼
+    rows = [travel_app._serialize_journal(j) for j in journals]
+    return json.dumps(rows, ensure_ascii=True, sort_keys=True).encode()
+
+
+def streamed(journals):
+    return b''.join(serialization.iter_json_array(travel_app._serialize_journal(j) for j in journals))
+
+
+def streamed_peak(journals):
+    # 串流時實際留在記憶體的只有目前的區塊
+    size = 0
+    for chunk in serialization.iter_json_array(travel_app._serialize_journal(j) for j in journals):
+        size += len(chunk)
+    return size
+
+
+def measure(fn, journals, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(journals)
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    fn(journals)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    size = result if isinstance(result, int) else len(result)
+    return min(timings), size, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    journals = make_journals(args.count)
+    print(f'encoder: {"orjson" if serialization.orjson else "json"}, journals: {args.count}')
+    print(f'{"mode":<10}{"bytes/journal":>15}{"us/journal":>12}{"peak KiB":>12}')
+    with travel_app.app.test_request_context():
+        for name, fn in (('jsonify', baseline), ('stream', streamed_peak)):
+            elapsed, size, peak = measure(fn, journals, args.repeat)
+            print(f'{name:<10}{size / args.count:>15.1f}{elapsed / args.count * 1e6:>12.2f}{peak / 1024:>12.0f}')
+        assert json.loads(baseline(journals)) == json.loads(streamed(journals))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""回應壓縮：依 Accept-Encoding 以 brotli 或 gzip 壓縮文字類回應
+
+有安裝 brotli 套件時優先使用 br，否則使用 gzip。小於門檻的回應、照片等已壓縮過的格式不處理；
+串流回應邊輸出邊壓縮。壓縮後的 ETag 改為弱 ETag，If-None-Match 以弱比較判斷即可繼續得到 304。
+"""
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:  # 未安裝時只提供 gzip
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = frozenset({
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/json', 'application/javascript', 'application/x-ndjson', 'image/svg+xml',
+})
+# 串流壓縮時累積到此大小才交給壓縮器，避免每個小區塊各自輸出
+STREAM_FLUSH_BYTES = 16 * 1024
+
+
+def available_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encodings):
+    """從 request.accept_encodings 選出支援且品質最高的編碼，沒有時回傳 None"""
+    best, best_quality = None, 0
+    for encoding in available_encodings():
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def _compressor(encoding, level):
+    if encoding == 'br':
+        return brotli.Compressor(quality=level['br'])
+    # wbits 加 16 輸出 gzip 標頭與結尾
+    return zlib.compressobj(level['gzip'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def _compress_stream(chunks, encoding, level):
+    compressor = _compressor(encoding, level)
+    compress = compressor.process if encoding == 'br' else compressor.compress
+    buffer = bytearray()
+    try:
+        for chunk in chunks:
+            buffer += chunk
+            if len(buffer) >= STREAM_FLUSH_BYTES:
+                data = compress(bytes(buffer))
+                buffer.clear()
+                if data:
+                    yield data
+        data = compress(bytes(buffer)) + (compressor.finish() if encoding == 'br' else compressor.flush())
+        if data:
+            yield data
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+class ResponseCompressor:
+    """after_request 使用：compress(request, response) 回傳 (可能已壓縮的) response"""
+
+    def __init__(self, min_size=1024, gzip_level=6, brotli_quality=4):
+        self.min_size = min_size
+        self.level = {'gzip': gzip_level, 'br': brotli_quality}
+
+    def compress(self, request, response):
+        if (request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 206, 304)
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES or 'Content-Encoding' in response.headers
+                or response.direct_passthrough):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = _compress_stream(response.response, encoding, self.level)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < self.min_size:
+                return response
+            if encoding == 'br':
+                body = brotli.compress(body, quality=self.level['br'])
+            else:
+                body = gzip.compress(body, compresslevel=self.level['gzip'], mtime=0)
+            response.set_data(body)
+
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
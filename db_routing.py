@@ -0,0 +1,63 @@
+"""讀寫分離：唯讀請求的查詢送往複本 (read replica)，寫入一律送往主資料庫
+
+複本以 Flask-SQLAlchemy 的 bind ('replica_0'、'replica_1'…) 建立，各有獨立的連線池。
+請求開始時由 app 決定這個請求能否讀複本 (use_replica)；RoutingSession 在 flush 或執行
+INSERT/UPDATE/DELETE 時改用主資料庫，之後同一個 session 的讀取也留在主資料庫，避免讀不到剛寫入的資料。
+"""
+import random
+
+import sqlalchemy as sa
+from flask import g
+from flask_sqlalchemy.session import Session
+
+REPLICA_BIND_PREFIX = 'replica_'
+
+
+def replica_binds(urls, options=None):
+    """把複本網址轉成 SQLALCHEMY_BINDS 設定，options 為每個複本共用的引擎參數"""
+    return {f'{REPLICA_BIND_PREFIX}{i}': {'url': url, **(options or {})} for i, url in enumerate(urls)}
+
+
+def replica_engines(db):
+    return {key: engine for key, engine in db.engines.items()
+            if isinstance(key, str) and key.startswith(REPLICA_BIND_PREFIX)}
+
+
+def use_replica(db):
+    """讓目前請求的讀取改走隨機挑選的一個複本 (同一個請求固定使用同一個)"""
+    engines = replica_engines(db)
+    if engines:
+        g.db_replica = random.choice(sorted(engines))
+
+
+def use_primary():
+    """目前請求之後的讀取改回主資料庫 (例如複本缺資料、接著要依讀到的結果寫入時)"""
+    g.pop('db_replica', None)
+
+
+def current_replica():
+    return g.get('db_replica')
+
+
+def _is_write(clause):
+    if isinstance(clause, sa.UpdateBase):
+        return True
+    # text() 沒有語句種類，只有 SELECT / WITH 開頭的視為讀取
+    if isinstance(clause, sa.TextClause):
+        return not clause.text.lstrip().upper().startswith(('SELECT', 'WITH'))
+    return False
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and (self._flushing or _is_write(clause)):
+            self.info['wrote'] = True
+        elif bind is None and not self.info.get('wrote'):
+            replica = current_replica()
+            if replica is not None:
+                return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def close(self):
+        self.info.pop('wrote', None)
+        super().close()
@@ -0,0 +1,213 @@
+"""離線地名查詢：以隨附的地名檔提供地名自動完成與座標反查
+
+地名以前綴樹 (trie) 索引，每個節點預先保存人口最多的幾筆結果，查詢只需走過前綴長度的節點；
+座標轉成單位球上的三維向量後建 k-d 樹，跨越 180 度經線與兩極時距離仍然正確。
+"""
+import math
+import os
+import threading
+import unicodedata
+from collections import namedtuple
+from functools import lru_cache
+
+EARTH_RADIUS_KM = 6371.0
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'gazetteer.tsv')
+
+# 每個 trie 節點保留的候選數，也是自動完成最多回傳的筆數
+MAX_SUGGESTIONS = 10
+
+# 反查時最近地點超過此距離就視為查無結果 (例如海上)
+DEFAULT_MAX_DISTANCE_KM = 300
+
+Place = namedtuple('Place', ['name', 'name_zh', 'country_code', 'country', 'lat', 'lng', 'population'])
+
+
+def normalize(value):
+    """全形轉半形、忽略大小寫與多餘空白"""
+    return ' '.join(unicodedata.normalize('NFKC', str(value or '')).casefold().split())
+
+
+def _to_vector(lat, lng):
+    phi, lam = math.radians(lat), math.radians(lng)
+    return (math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi))
+
+
+def _chord_to_km(squared_chord):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(squared_chord) / 2))
+
+
+class _TrieNode:
+    __slots__ = ('children', 'top', 'terminal')
+
+    def __init__(self):
+        self.children = {}
+        self.top = []       # 此前綴下人口最多的地點索引
+        self.terminal = []  # 名稱剛好等於此前綴的地點索引
+
+
+class PrefixTrie:
+    def __init__(self, rank):
+        self.root = _TrieNode()
+        self.rank = rank  # 地點索引 -> 排序鍵，越小越前面
+
+    def insert(self, key, index):
+        node = self.root
+        self._offer(node, index)
+        for char in key:
+            node = node.children.setdefault(char, _TrieNode())
+            self._offer(node, index)
+        if index not in node.terminal:
+            node.terminal.append(index)
+
+    def _offer(self, node, index):
+        if index in node.top:
+            return
+        node.top.append(index)
+        node.top.sort(key=self.rank)
+        del node.top[MAX_SUGGESTIONS:]
+
+    def find(self, key):
+        node = self.root
+        for char in key:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def longest_match(self, key):
+        """回傳 key 開頭最長的完整地名所對應的地點，例如 'tokyo tower' -> Tokyo"""
+        node, found = self.root, []
+        for char in key:
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.terminal:
+                found = node.terminal
+        return found
+
+
+class KDTree:
+    """三維 k-d 樹，節點為 (地點索引, 切分軸, 左子樹, 右子樹)"""
+
+    def __init__(self, points):
+        self.points = points
+        self.root = self._build(list(range(len(points))), 0)
+
+    def _build(self, indexes, depth):
+        if not indexes:
+            return None
+        axis = depth % 3
+        indexes.sort(key=lambda i: self.points[i][axis])
+        mid = len(indexes) // 2
+        return (indexes[mid], axis,
+                self._build(indexes[:mid], depth + 1),
+                self._build(indexes[mid + 1:], depth + 1))
+
+    def nearest(self, target):
+        """回傳 (地點索引, 弦長平方)"""
+        best = [None, float('inf')]
+
+        def visit(node):
+            if node is None:
+                return
+            index, axis, left, right = node
+            point = self.points[index]
+            distance = sum((a - b) ** 2 for a, b in zip(point, target))
+            if distance < best[1]:
+                best[0], best[1] = index, distance
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            visit(near)
+            if diff * diff < best[1]:
+                visit(far)
+
+        visit(self.root)
+        return best[0], best[1]
+
+
+class Gazetteer:
+    """第一次查詢時才載入地名檔；查詢結果經過 LRU 快取"""
+
+    def __init__(self, path=DEFAULT_PATH, cache_size=4096):
+        self.path = path
+        self.places = []
+        self._trie = None
+        self._tree = None
+        self._lock = threading.Lock()
+        self._cached_search = lru_cache(maxsize=cache_size)(self._search)
+        self._nearest = lru_cache(maxsize=cache_size)(self._nearest_uncached)
+
+    @property
+    def loaded(self):
+        return self._tree is not None
+
+    def load(self):
+        if self.loaded:
+            return
+        with self._lock:
+            if self.loaded:
+                return
+            places, names = [], []
+            with open(self.path, encoding='utf-8') as f:
+                header = None
+                for line in f:
+                    if not line.strip() or line.startswith('#'):
+                        continue
+                    fields = line.rstrip('\n').split('\t')
+                    if header is None:
+                        header = fields
+                        continue
+                    row = dict(zip(header, fields))
+                    places.append(Place(row['name'], row['name_zh'] or None, row['country_code'], row['country'],
+                                        float(row['lat']), float(row['lng']), int(row['population'] or 0)))
+                    aliases = [a for a in row['alternate_names'].split(',') if a]
+                    names.append([row['name'], row['name_zh']] + aliases)
+
+            trie = PrefixTrie(rank=lambda i: (-places[i].population, i))
+            for index, aliases in enumerate(names):
+                for alias in aliases:
+                    key = normalize(alias)
+                    if key:
+                        trie.insert(key, index)
+            self.places = places
+            self._trie = trie
+            self._tree = KDTree([_to_vector(p.lat, p.lng) for p in places])
+
+    def _search(self, query, limit):
+        node = self._trie.find(query)
+        if node is not None:
+            # 完全相符的地名排在前綴相符之前
+            exact = sorted(node.terminal, key=self._trie.rank)
+            return tuple(self.places[i] for i in (exact + [i for i in node.top if i not in exact])[:limit])
+        return tuple(self.places[i] for i in sorted(self._trie.longest_match(query), key=self._trie.rank)[:limit])
+
+    def geocode(self, query, limit=5):
+        """依地名或前綴查詢，回傳依相符程度與人口排序的 Place 清單"""
+        query = normalize(query)
+        if not query:
+            return []
+        self.load()
+        return list(self._cached_search(query, max(1, min(limit, MAX_SUGGESTIONS))))
+
+    def _nearest_uncached(self, lat, lng):
+        index, squared_chord = self._tree.nearest(_to_vector(lat, lng))
+        return self.places[index], _chord_to_km(squared_chord)
+
+    def reverse(self, lat, lng, max_distance_km=DEFAULT_MAX_DISTANCE_KM):
+        """回傳 (最近的 Place, 距離公里)，超出距離時回傳 None"""
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise ValueError('座標超出範圍')
+        self.load()
+        if not self.places:
+            return None
+        # 四捨五入到約 10 公尺，讓相近的座標共用快取
+        place, distance = self._nearest(round(lat, 4), round(lng, 4))
+        if distance > max_distance_km:
+            return None
+        return place, distance
+
+    def country_for(self, lat, lng, max_distance_km=DEFAULT_MAX_DISTANCE_KM):
+        """以最近的地點推測國家；國界附近可能不準，僅作為未填國家時的預設值"""
+        found = self.reverse(lat, lng, max_distance_km)
+        return found[0].country if found else None
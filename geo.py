@@ -0,0 +1,72 @@
+"""地理工具：geohash 編碼與地圖縮放層級對應"""
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+GEOHASH_PRECISION = 9  # 約 5 公尺見方，足以區分同一地點
+
+# (最大縮放層級, geohash 長度)：縮放越大，格子越細
+_ZOOM_PRECISION = (
+    (1, 1),
+    (3, 2),
+    (6, 3),
+    (8, 4),
+    (11, 5),
+    (13, 6),
+    (15, 7),
+    (17, 8),
+)
+
+
+def encode_geohash(lat, lng, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def has_location(lat, lng):
+    """(0, 0) 代表未設定座標，與前端的判斷一致"""
+    return lat is not None and lng is not None and (abs(lat) > 0.001 or abs(lng) > 0.001)
+
+
+def precision_for_zoom(zoom):
+    for max_zoom, precision in _ZOOM_PRECISION:
+        if zoom <= max_zoom:
+            return precision
+    return GEOHASH_PRECISION
+
+
+def parse_bbox(raw):
+    """解析 Leaflet 的 'west,south,east,north'，回傳 (south, north, 經度區間清單)
+
+    經度區間跨越 180 度經線時會拆成兩段；涵蓋整圈時回傳空清單表示不限制經度。
+    """
+    west, south, east, north = (float(v) for v in raw.split(','))
+    if south > north:
+        raise ValueError('bbox 的 south 必須小於 north')
+    south, north = max(south, -90.0), min(north, 90.0)
+    if east - west >= 360:
+        return south, north, []
+    west = (west + 180) % 360 - 180
+    east = (east + 180) % 360 - 180
+    if west <= east:
+        return south, north, [(west, east)]
+    return south, north, [(west, 180.0), (-180.0, east)]
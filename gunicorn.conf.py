@@ -0,0 +1,47 @@
+"""gunicorn 設定
+
+gthread worker 讓每個程序以多個執行緒處理請求：等待資料庫或密碼雜湊的請求
+不會卡住同一個 worker 的其他路由。preload_app 讓各 worker 共用載入後的記憶體 (copy-on-write)。
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Render 免費方案只有 512MB，兩個 worker * 4 執行緒即可；threads 不要超過資料庫連線池的 pool_size (5)
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# 密碼雜湊的排隊上限 (PASSWORD_HASH_MAX_PENDING) 預設跟著這個值，調高執行緒數時不必另外調整
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# 定期重啟 worker，避免長時間執行後記憶體逐漸上升
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = 100
+
+preload_app = True
+
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    # AUTO_MIGRATE 開啟時由 master 在 fork 前升級一次結構，worker 只會看到已是最新的資料庫；
+    # 關閉時不在啟動時連線，交給部署步驟的 flask --app app db upgrade
+    from app import app, db, ensure_database_ready
+    if not app.config['AUTO_MIGRATE']:
+        return
+    with app.app_context():
+        error = ensure_database_ready()
+        db.engine.dispose()
+    if error is not None:
+        server.log.error(f'啟動前自動升級失敗，worker 收到請求時會再試: {error}')
+
+
+def post_fork(server, worker):
+    # master 載入 app 時建立的連線不能跨程序共用，交給各 worker 重新連線
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,168 @@
+"""背景維護工作排程：定期、分批執行清理與重算，不佔用網頁請求
+
+每個工作在 job_runs 表有一列，執行前以條件式 UPDATE 取得租約 (到期且未被鎖定才會成功)，
+多個 gunicorn worker 或獨立的 worker 程序同時排程時，同一時間只會有一個執行；
+程序中途結束時租約到期後即可由其他程序接手。執行結果 (耗時、狀態、摘要) 寫回同一列。
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+
+job_runs = Table(
+    'job_runs', metadata,
+    Column('name', String(100), primary_key=True),
+    Column('locked_by', String(100)),
+    Column('locked_until', DateTime),
+    Column('next_run_at', DateTime),
+    Column('last_started_at', DateTime),
+    Column('last_finished_at', DateTime),
+    Column('last_duration_ms', Integer),
+    Column('last_status', String(20)),
+    Column('last_message', String(500)),
+)
+
+# interval / timeout 為秒數；timeout 是租約長度，超過後其他程序可以重新執行
+Job = namedtuple('Job', ['name', 'interval', 'fn', 'timeout', 'description'])
+
+
+def create_table(conn):
+    job_runs.create(conn, checkfirst=True)
+
+
+class JobScheduler:
+    """在 app context 中執行已註冊的工作；run_pending 只執行到期且取得租約的工作"""
+
+    def __init__(self, app, db, tick=60, on_finish=None):
+        self.app = app
+        self.db = db
+        self.tick = tick
+        self.on_finish = on_finish  # (工作名稱, 狀態, 秒數) -> None
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+        self._stop = threading.Event()
+
+    def job(self, name, every, timeout=600, description=None):
+        """註冊工作的裝飾器；被裝飾的函式回傳一行摘要"""
+        def decorator(fn):
+            self.jobs[name] = Job(name, every, fn, timeout, description or (fn.__doc__ or '').strip())
+            return fn
+        return decorator
+
+    # 排程
+    def ensure_started(self):
+        """在目前程序啟動排程執行緒；gunicorn fork 之後每個 worker 各自啟動一次"""
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self.serve_forever, name='job-scheduler', daemon=True)
+            self._thread.start()
+            self._thread_pid = os.getpid()
+
+    def serve_forever(self):
+        # 加上隨機延遲，避免所有 worker 在同一刻搶租約
+        while not self._stop.wait(self.tick * random.uniform(0.5, 1.5)):
+            try:
+                self.run_pending()
+            except Exception as e:
+                logger.error(f"❌ 工作排程失敗: {e}")
+
+    def stop(self):
+        self._stop.set()
+
+    def run_pending(self):
+        results = []
+        with self.app.app_context():
+            self._ensure_rows()
+            for job in self.jobs.values():
+                owner = self._acquire(job)
+                if owner:
+                    results.append(self._execute(job, owner))
+        return results
+
+    def run(self, name, force=False):
+        """立即執行指定工作；force 會忽略下次執行時間，但仍需取得租約"""
+        job = self.jobs[name]
+        with self.app.app_context():
+            self._ensure_rows()
+            owner = self._acquire(job, force=force)
+            return self._execute(job, owner) if owner else None
+
+    def status(self):
+        with self.app.app_context():
+            self._ensure_rows()
+            with self.db.engine.connect() as conn:
+                return {row.name: row._asdict() for row in conn.execute(select(job_runs))}
+
+    # 租約
+    def _ensure_rows(self):
+        with self.db.engine.connect() as conn:
+            existing = set(conn.execute(select(job_runs.c.name)).scalars())
+        for name in self.jobs.keys() - existing:
+            try:
+                with self.db.engine.begin() as conn:
+                    conn.execute(insert(job_runs).values(name=name))
+            except IntegrityError:
+                pass  # 其他程序已經建立
+
+    def _acquire(self, job, force=False):
+        """取得租約時回傳持有者識別，否則回傳 None"""
+        now = datetime.utcnow()
+        owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        conditions = [job_runs.c.name == job.name,
+                      or_(job_runs.c.locked_until.is_(None), job_runs.c.locked_until < now)]
+        if not force:
+            conditions.append(or_(job_runs.c.next_run_at.is_(None), job_runs.c.next_run_at <= now))
+        with self.db.engine.begin() as conn:
+            acquired = conn.execute(
+                update(job_runs).where(*conditions)
+                .values(locked_by=owner, locked_until=now + timedelta(seconds=job.timeout), last_started_at=now)
+            ).rowcount == 1
+        return owner if acquired else None
+
+    def _execute(self, job, owner):
+        # 每個工作使用獨立的 app context，結束時釋放 session
+        started = time.perf_counter()
+        status, message = 'failed', '執行中斷'
+        logger.info(f"▶️ 開始執行工作 {job.name}")
+        try:
+            with self.app.app_context():
+                try:
+                    message = job.fn() or ''
+                    status = 'ok'
+                except Exception as e:
+                    self.db.session.rollback()
+                    logger.exception(f"❌ 工作 {job.name} 失敗")
+                    message, status = str(e), 'failed'
+        finally:
+            elapsed = time.perf_counter() - started
+            finished = datetime.utcnow()
+            with self.db.engine.begin() as conn:
+                conn.execute(
+                    update(job_runs).where(job_runs.c.name == job.name, job_runs.c.locked_by == owner)
+                    .values(locked_by=None, locked_until=None,
+                            next_run_at=finished + timedelta(seconds=job.interval),
+                            last_finished_at=finished, last_duration_ms=int(elapsed * 1000),
+                            last_status=status, last_message=message[:500])
+                )
+        logger.info(f"⏱️ 工作 {job.name} {status}，耗時 {elapsed:.1f}s：{message}")
+        if self.on_finish:
+            self.on_finish(job.name, status, elapsed)
+        return {'name': job.name, 'status': status, 'seconds': round(elapsed, 3), 'message': message}
@@ -0,0 +1,284 @@
+"""請求與 SQL 指標：計數器、直方圖，輸出為 Prometheus 文字格式
+
+每個程序各自累計；gunicorn 有多個 worker 時，每次抓取只會看到處理該請求的 worker。
+SQL 耗時與次數透過 SQLAlchemy 引擎事件收集，連線池等待時間由 TimedQueuePool 量測。
+"""
+import contextvars
+import functools
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# 慢查詢紀錄中 SQL 的最大長度
+SLOW_QUERY_MAX_CHARS = 1000
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} 需要標籤 {self.labelnames}')
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        lines += [f'{name}{labels} {_format_value(value)}' for name, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in items]
+
+
+class Gauge(Metric):
+    """抓取時才呼叫 fn 取值，適合連線池大小這類由別處維護的狀態"""
+    type = 'gauge'
+
+    def __init__(self, name, help, fn):
+        super().__init__(name, help)
+        self.fn = fn
+
+    def samples(self):
+        return [(self.name, '', self.fn())]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # 標籤 -> [各區間計數..., 總和, 次數]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(entry)) for key, entry in self._values.items()]
+        samples = []
+        for key, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', _format_labels(self.labelnames, key, [('le', bound)]), cumulative))
+            samples.append((f'{self.name}_bucket', _format_labels(self.labelnames, key, [('le', '+Inf')]), entry[-1]))
+            samples.append((f'{self.name}_sum', _format_labels(self.labelnames, key), entry[-2]))
+            samples.append((f'{self.name}_count', _format_labels(self.labelnames, key), entry[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f'指標 {metric.name} 已註冊')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, fn):
+        return self.register(Gauge(name, help, fn))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool，額外回報每次取得連線花費的時間 (含等待空閒連線與建立新連線)"""
+
+    wait_observer = None  # (秒數, 是否逾時) -> None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            timed_out = True
+            raise
+        finally:
+            if self.wait_observer is not None:
+                self.wait_observer(time.perf_counter() - started, timed_out)
+
+    def recreate(self):
+        # engine.dispose() 會以 recreate 建立新的連線池，觀察者要一起帶過去
+        pool = super().recreate()
+        pool.wait_observer = self.wait_observer
+        return pool
+
+
+class QueryStats:
+    """單一請求內的 SQL 次數與耗時"""
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+class SQLInstrumentation:
+    """掛在引擎上收集查詢耗時、慢查詢與連線池狀態"""
+
+    def __init__(self, registry, slow_query_seconds=0.5):
+        self.slow_query_seconds = slow_query_seconds
+        self.engine = None
+        self._last_success = {}  # engine -> 最近一次查詢成功的 time.monotonic()
+        self._request_stats = contextvars.ContextVar('query_stats', default=None)
+
+        self.query_seconds = registry.histogram('db_query_duration_seconds', 'SQL 執行時間')
+        self.slow_queries = registry.counter('db_slow_queries_total', '超過門檻的慢查詢次數')
+        self.query_errors = registry.counter('db_query_errors_total', '執行失敗的 SQL 次數')
+        self.pool_wait = registry.histogram('db_pool_wait_seconds', '從連線池取得連線的等待時間')
+        self.pool_timeouts = registry.counter('db_pool_timeouts_total', '等待連線逾時的次數')
+        self.pool_checkouts = registry.counter('db_pool_checkouts_total', '取出連線的次數')
+        self.pool_overflow_checkouts = registry.counter('db_pool_overflow_checkouts_total',
+                                                        '超出 pool_size、使用溢出連線的取出次數')
+        self.pool_connects = registry.counter('db_pool_connections_created_total', '新建立的資料庫連線數')
+        registry.gauge('db_pool_size', '連線池常駐連線數上限 (pool_size)', lambda: self.pool_status()['size'])
+        registry.gauge('db_pool_max_overflow', '允許的溢出連線數 (max_overflow)',
+                       lambda: self.pool_status()['max_overflow'])
+        registry.gauge('db_pool_checked_out', '目前被取出使用中的連線數', lambda: self.pool_status()['checked_out'])
+        registry.gauge('db_pool_overflow', '目前的溢出連線數', lambda: self.pool_status()['overflow'])
+
+    def attach(self, engine, primary=True):
+        """收集 engine 的查詢與連線池事件；連線池 gauge 只反映 primary 引擎，其他 (複本) 可用 pool_status(engine) 查詢"""
+        if primary:
+            self.engine = engine
+        if isinstance(engine.pool, TimedQueuePool):
+            engine.pool.wait_observer = self._observe_wait
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+        event.listen(engine, 'handle_error', self._on_error)
+        event.listen(engine, 'checkout', functools.partial(self._on_checkout, engine))
+        event.listen(engine, 'connect', self._on_connect)
+
+    # 請求層級統計：before_request 開始、after_request 取出
+    def begin_request(self):
+        self._request_stats.set(QueryStats())
+
+    def end_request(self):
+        stats = self._request_stats.get()
+        self._request_stats.set(None)
+        return stats
+
+    def pool_status(self, engine=None):
+        """只讀取連線池的計數，不會建立連線"""
+        engine = engine or self.engine
+        pool = engine.pool if engine is not None else None
+        if not isinstance(pool, QueuePool):
+            return {'size': 0, 'max_overflow': 0, 'checked_out': 0, 'overflow': 0, 'saturation': 0.0}
+        size, max_overflow = pool.size(), max(pool._max_overflow, 0)
+        checked_out = pool.checkedout()
+        return {
+            'size': size,
+            'max_overflow': max_overflow,
+            'checked_out': checked_out,
+            'overflow': max(pool.overflow(), 0),
+            'saturation': round(checked_out / (size + max_overflow), 3) if size + max_overflow else 0.0,
+        }
+
+    def last_success(self, engine=None):
+        """engine (預設為 primary) 最近一次查詢成功的 time.monotonic()，複本的查詢不算在主資料庫上"""
+        return self._last_success.get(engine or self.engine)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info['query_started'] = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop('query_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        self._last_success[conn.engine] = time.monotonic()
+        self.query_seconds.observe(elapsed)
+        stats = self._request_stats.get()
+        if stats is not None:
+            stats.count += 1
+            stats.seconds += elapsed
+        if elapsed >= self.slow_query_seconds:
+            self.slow_queries.inc()
+            logger.warning(f"🐢 慢查詢 {elapsed * 1000:.0f}ms: {' '.join(statement.split())[:SLOW_QUERY_MAX_CHARS]}")
+
+    def _on_error(self, context):
+        self.query_errors.inc()
+        if context.connection is not None:
+            context.connection.info.pop('query_started', None)
+
+    def _on_checkout(self, engine, dbapi_connection, connection_record, connection_proxy):
+        self.pool_checkouts.inc()
+        pool = engine.pool
+        if isinstance(pool, QueuePool) and pool.checkedout() > pool.size():
+            self.pool_overflow_checkouts.inc()
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        self.pool_connects.inc()
+
+    def _observe_wait(self, seconds, timed_out):
+        self.pool_wait.observe(seconds)
+        if timed_out:
+            self.pool_timeouts.inc()
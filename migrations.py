@@ -0,0 +1,331 @@
+"""資料庫版本化遷移
+
+每個遷移以遞增的版本號註冊，套用紀錄存在 schema_migrations 表。
+大量資料的回填以 id 區間分批、每批獨立交易，避免長時間鎖表與記憶體暴增。
+"""
+import logging
+import time
+from collections import namedtuple
+from datetime import date, datetime
+
+from sqlalchemy import Date, Index, MetaData, Table, bindparam, inspect, text
+
+import jobs
+import search
+from geo import encode_geohash, has_location
+
+logger = logging.getLogger(__name__)
+
+Migration = namedtuple('Migration', ['version', 'description', 'upgrade', 'run_on_fresh'])
+
+MIGRATIONS = []
+
+VERSION_TABLE = 'schema_migrations'
+
+
+def migration(version, description, run_on_fresh=False):
+    """註冊遷移的裝飾器
+
+    run_on_fresh: 建立模型以外的物件 (例如全文檢索表) 時設為 True，
+    全新資料庫在 create_all 之後仍會執行這類遷移。
+    """
+    def decorator(fn):
+        MIGRATIONS.append(Migration(version, description, fn, run_on_fresh))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return fn
+    return decorator
+
+
+class MigrationContext:
+    """提供遷移函式使用的結構查詢與分批回填工具"""
+
+    def __init__(self, db, progress=None, batch_size=1000):
+        self.db = db
+        self.engine = db.engine
+        self.metadata = db.metadata
+        self.dialect = self.engine.dialect.name
+        self.batch_size = batch_size
+        self.progress = progress or logger.info
+
+    def has_table(self, table):
+        return inspect(self.engine).has_table(table)
+
+    def has_column(self, table, column):
+        return any(c['name'] == column for c in inspect(self.engine).get_columns(table))
+
+    def has_index(self, table, name):
+        return any(ix['name'] == name for ix in inspect(self.engine).get_indexes(table))
+
+    def execute(self, sql, params=None):
+        with self.engine.begin() as conn:
+            return conn.execute(text(sql), params or {})
+
+    def column_type(self, table, column):
+        for c in inspect(self.engine).get_columns(table):
+            if c['name'] == column:
+                return c['type']
+        return None
+
+    def set_not_null(self, table, column):
+        """替既有欄位加上 NOT NULL (欄位中不能有 NULL)"""
+        if self.dialect != 'sqlite':
+            self.execute(f'ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL')
+            return
+        # SQLite 無法修改欄位定義：依反射的結構 (含外鍵等約束) 建立新表、複製資料後換名，索引一併重建；
+        # SQLite 的 DDL 可在交易中執行，中途失敗會整個還原
+        with self.engine.begin() as conn:
+            # 反射時外鍵參照的表也會載入同一個 MetaData，新表的外鍵才能對應
+            metadata = MetaData()
+            old = Table(table, metadata, autoload_with=conn)
+            indexes = [(ix.name, [c.name for c in ix.columns], ix.unique) for ix in old.indexes]
+            rebuilt = old.to_metadata(metadata, name=f'{table}__rebuild')
+            # 索引名稱在整個資料庫中唯一，舊表刪除後才能重建
+            rebuilt.indexes.clear()
+            rebuilt.c[column].nullable = False
+            rebuilt.create(conn)
+            columns = ', '.join(f'"{c.name}"' for c in old.columns)
+            conn.execute(text(f'INSERT INTO {rebuilt.name} ({columns}) SELECT {columns} FROM {table}'))
+            conn.execute(text(f'DROP TABLE {table}'))
+            conn.execute(text(f'ALTER TABLE {rebuilt.name} RENAME TO {table}'))
+            renamed = Table(table, MetaData(), autoload_with=conn)
+            for name, cols, unique in indexes:
+                Index(name, *(renamed.c[c] for c in cols), unique=unique).create(conn)
+
+    def create_table(self, name):
+        """依目前模型定義建立資料表 (已存在則略過)"""
+        self.metadata.tables[name].create(self.engine, checkfirst=True)
+
+    def create_index(self, name, table, columns, unique=False):
+        if self.has_index(table, name):
+            return
+        unique_sql = 'UNIQUE ' if unique else ''
+        if self.dialect == 'postgresql':
+            # CONCURRENTLY 不會鎖住寫入，但不能在交易中執行
+            with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                conn.execute(text(f'CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} '
+                                  f'ON {table} ({", ".join(columns)})'))
+        else:
+            self.execute(f'CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({", ".join(columns)})')
+        self.progress(f'  已建立索引 {name}')
+
+    def id_batches(self, table, batch_size=None):
+        """依 id 區間分批，每批產生一個獨立交易的連線並回報進度"""
+        batch_size = batch_size or self.batch_size
+        with self.engine.connect() as conn:
+            low, high = conn.execute(text(f'SELECT MIN(id), MAX(id) FROM {table}')).one()
+        if low is None:
+            return
+        total = high - low + 1
+        started = time.perf_counter()
+        for start in range(low, high + 1, batch_size):
+            end = min(start + batch_size - 1, high)
+            with self.engine.begin() as conn:
+                yield conn, start, end
+            done = end - low + 1
+            self.progress(f'  {table}: {done}/{total} ({done * 100 // total}%)，'
+                          f'耗時 {time.perf_counter() - started:.1f}s')
+
+
+def _ensure_version_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(f'CREATE TABLE IF NOT EXISTS {VERSION_TABLE} ('
+                          'version INTEGER PRIMARY KEY, '
+                          'description VARCHAR(200) NOT NULL, '
+                          'applied_at TIMESTAMP NOT NULL)'))
+
+
+def _record(engine, m):
+    with engine.begin() as conn:
+        conn.execute(text(f'INSERT INTO {VERSION_TABLE} (version, description, applied_at) '
+                          'VALUES (:version, :description, :applied_at)'),
+                     {'version': m.version, 'description': m.description, 'applied_at': datetime.utcnow()})
+
+
+def applied_versions(engine):
+    _ensure_version_table(engine)
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text(f'SELECT version FROM {VERSION_TABLE}'))}
+
+
+def pending_migrations(engine):
+    applied = applied_versions(engine)
+    return [m for m in MIGRATIONS if m.version not in applied]
+
+
+def upgrade(db, progress=None, batch_size=1000):
+    """套用所有尚未執行的遷移，回傳本次套用的版本清單"""
+    ctx = MigrationContext(db, progress=progress, batch_size=batch_size)
+    engine = ctx.engine
+    applied = applied_versions(engine)
+
+    if not applied and not ctx.has_table('journals'):
+        # 全新資料庫：直接依模型建立最新結構並標記所有版本
+        db.create_all()
+        for m in MIGRATIONS:
+            if m.run_on_fresh:
+                m.upgrade(ctx)
+            _record(engine, m)
+        ctx.progress(f'全新資料庫，已建立結構並標記至版本 {MIGRATIONS[-1].version}')
+        return [m.version for m in MIGRATIONS]
+
+    done = []
+    for m in MIGRATIONS:
+        if m.version in applied:
+            continue
+        ctx.progress(f'套用遷移 {m.version:04d}: {m.description}')
+        started = time.perf_counter()
+        m.upgrade(ctx)
+        _record(engine, m)
+        done.append(m.version)
+        ctx.progress(f'✅ 遷移 {m.version:04d} 完成 ({time.perf_counter() - started:.1f}s)')
+    return done
+
+
+# ---------------------------------------------------------------------------
+# 遷移清單
+# ---------------------------------------------------------------------------
+
+@migration(1, '初始結構 (users, journals)')
+def _baseline(ctx):
+    # 舊版以 db.create_all() 建立的資料庫已具備此結構
+    pass
+
+
+@migration(2, '建立用戶統計表')
+def _create_user_stats(ctx):
+    ctx.create_table('user_stats')
+    ctx.create_table('user_country_stats')
+
+
+@migration(3, '補上舊日誌的 journal_type')
+def _backfill_journal_type(ctx):
+    for conn, start, end in ctx.id_batches('journals'):
+        conn.execute(text("UPDATE journals SET journal_type = CASE "
+                          "WHEN photo IS NOT NULL AND photo <> '' THEN 'photo' ELSE 'text' END "
+                          "WHERE journal_type IS NULL AND id BETWEEN :start AND :end"),
+                     {'start': start, 'end': end})
+
+
+_DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%Y.%m.%d', '%Y%m%d')
+
+
+def parse_journal_date(value):
+    """解析舊的字串日期，無法解析時回傳 None"""
+    if isinstance(value, date):
+        return value
+    value = str(value or '').strip()
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value[:10], fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+@migration(4, 'journals.date 由字串改為 DATE')
+def _convert_journal_date(ctx):
+    # 可重複執行：上次中斷在 DROP 或 RENAME 之後時，從中斷處繼續
+    has_date = ctx.has_column('journals', 'date')
+    has_value = ctx.has_column('journals', 'date_value')
+    if has_date and not has_value and isinstance(ctx.column_type('journals', 'date'), Date):
+        ctx.set_not_null('journals', 'date')
+        return
+    if has_date:
+        if not has_value:
+            ctx.execute('ALTER TABLE journals ADD COLUMN date_value DATE')
+        _backfill_journal_date(ctx)
+        # PostgreSQL 的 DROP/RENAME COLUMN 只改系統目錄，不會重寫資料列
+        ctx.execute('ALTER TABLE journals DROP COLUMN date')
+    ctx.execute('ALTER TABLE journals RENAME COLUMN date_value TO date')
+    # 回填後每一列都有日期；PostgreSQL 只需掃描一次確認，SQLite 需要重建資料表
+    ctx.set_not_null('journals', 'date')
+
+
+def _backfill_journal_date(ctx):
+    update = text('UPDATE journals SET date_value = :value WHERE id = :id').bindparams(
+        bindparam('value', type_=Date()))
+    for conn, start, end in ctx.id_batches('journals'):
+        rows = conn.execute(text('SELECT id, date, created_at FROM journals '
+                                 'WHERE date_value IS NULL AND id BETWEEN :start AND :end'),
+                            {'start': start, 'end': end}).all()
+        params = []
+        for journal_id, raw, created_at in rows:
+            value = parse_journal_date(raw)
+            if value is None:
+                if isinstance(created_at, str):
+                    created_at = datetime.fromisoformat(created_at)
+                value = created_at.date() if created_at else date.today()
+                logger.warning(f'日誌 {journal_id} 的日期 {raw!r} 無法解析，改用 {value}')
+            params.append({'id': journal_id, 'value': value})
+        if params:
+            conn.execute(update, params)
+
+
+@migration(5, '建立 journals 查詢用的複合索引')
+def _journal_indexes(ctx):
+    ctx.create_index('ix_journals_user_date', 'journals', ['user_id', 'date', 'created_at', 'id'])
+    ctx.create_index('ix_journals_user_country', 'journals', ['user_id', 'country'])
+
+
+@migration(6, '新增 journals.geohash 供地圖聚合')
+def _add_journal_geohash(ctx):
+    if not ctx.has_column('journals', 'geohash'):
+        ctx.execute('ALTER TABLE journals ADD COLUMN geohash VARCHAR(12)')
+
+    for conn, start, end in ctx.id_batches('journals'):
+        rows = conn.execute(text('SELECT id, lat, lng FROM journals '
+                                 'WHERE geohash IS NULL AND id BETWEEN :start AND :end'),
+                            {'start': start, 'end': end}).all()
+        params = [{'id': journal_id, 'geohash': encode_geohash(lat, lng)}
+                  for journal_id, lat, lng in rows if has_location(lat, lng)]
+        if params:
+            conn.execute(text('UPDATE journals SET geohash = :geohash WHERE id = :id'), params)
+
+    ctx.create_index('ix_journals_user_geohash', 'journals', ['user_id', 'geohash'])
+
+
+@migration(7, '建立日誌全文檢索索引', run_on_fresh=True)
+def _create_search_index(ctx):
+    if not search.supported(ctx.dialect):
+        ctx.progress(f'  {ctx.dialect} 不支援全文檢索，略過')
+        return
+    with ctx.engine.begin() as conn:
+        search.create_table(conn, ctx.dialect)
+    for conn, start, end in ctx.id_batches('journals'):
+        rows = conn.execute(text('SELECT id, user_id, location, country, content FROM journals '
+                                 'WHERE id BETWEEN :start AND :end'),
+                            {'start': start, 'end': end}).all()
+        search.index_journals(conn, ctx.dialect, [search.SearchDocument(*row) for row in rows])
+
+
+@migration(8, '新增 user_stats.data_version 供回應快取')
+def _add_stats_data_version(ctx):
+    if not ctx.has_column('user_stats', 'data_version'):
+        ctx.execute('ALTER TABLE user_stats ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0')
+
+
+@migration(9, '新增 users.created_at 與背景工作的 job_runs 表', run_on_fresh=True)
+def _add_user_created_at_and_job_runs(ctx):
+    with ctx.engine.begin() as conn:
+        jobs.create_table(conn)
+    if ctx.has_column('users', 'created_at'):
+        return
+    ctx.execute('ALTER TABLE users ADD COLUMN created_at TIMESTAMP')
+    # 既有用戶的建立時間無從得知，以升級時間代替，訪客帳號會在保留期限後才被清除
+    upgraded_at = datetime.utcnow()
+    for conn, start, end in ctx.id_batches('users'):
+        conn.execute(text('UPDATE users SET created_at = :now WHERE created_at IS NULL AND id BETWEEN :start AND :end'),
+                     {'now': upgraded_at, 'start': start, 'end': end})
+    ctx.create_index('ix_users_guest_created', 'users', ['is_google', 'created_at'])
+
+
+@migration(10, '新增 journal_tombstones 與 (user_id, updated_at) 索引供增量同步')
+def _add_journal_sync(ctx):
+    ctx.create_table('journal_tombstones')
+    # 舊資料的 updated_at 可能是空的，以建立時間補上，增量同步才不會漏掉
+    for conn, start, end in ctx.id_batches('journals'):
+        conn.execute(text('UPDATE journals SET updated_at = created_at '
+                          'WHERE updated_at IS NULL AND id BETWEEN :start AND :end'),
+                     {'start': start, 'end': end})
+    ctx.create_index('ix_journals_user_updated', 'journals', ['user_id', 'updated_at', 'id'])
+    ctx.create_index('ix_journal_tombstones_user_deleted', 'journal_tombstones', ['user_id', 'deleted_at'])
@@ -0,0 +1,51 @@
+"""密碼雜湊：交給有上限的背景執行緒計算
+
+werkzeug 預設的 scrypt 每次約需 16MB 記憶體與數十毫秒 CPU。hashlib 計算時會釋放 GIL，
+放到執行緒池裡不會卡住同一個 worker 的其他請求；同時限制並行數與排隊數，
+登入尖峰時多出來的請求直接回應忙碌，而不是把記憶體吃光。
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingBusyError(RuntimeError):
+    """排隊中的雜湊工作已達上限"""
+
+
+class PasswordHasher:
+    def __init__(self, max_workers=2, max_pending=16, timeout=30):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    def generate(self, password):
+        return self._run(generate_password_hash, password)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusyError('密碼驗證忙碌中，請稍後再試')
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # 等待逾時時工作仍在執行，名額要等真的做完才歸還
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result(timeout=self.timeout)
+
+    def _get_executor(self):
+        # gunicorn fork 之後父程序的執行緒不會帶過來，每個程序各自建立
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='password-hash')
+                self._executor_pid = os.getpid()
+            return self._executor
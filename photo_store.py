@@ -0,0 +1,179 @@
+"""照片儲存：以內容雜湊 (SHA-256) 為鍵的 blob store"""
+import base64
+import binascii
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+
+PHOTO_URL_PREFIX = '/photos/'
+COPY_CHUNK_SIZE = 64 * 1024
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# 依檔頭判斷圖片格式，避免信任客戶端宣告的 MIME
+_MAGIC_NUMBERS = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+
+class InvalidPhotoError(ValueError):
+    """照片資料無法解析"""
+
+
+def sniff_mimetype(head):
+    """從檔案開頭的位元組判斷圖片 MIME，無法辨識時回傳 None"""
+    for magic, mimetype in _MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return mimetype
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def is_valid_digest(digest):
+    return bool(digest) and bool(_DIGEST_RE.match(digest))
+
+
+def is_data_url(value):
+    return isinstance(value, str) and value[:5].lower() == 'data:'
+
+
+def decode_data_url(value):
+    """將 base64 data URL 解碼成位元組"""
+    header, sep, payload = value.partition(',')
+    if not sep or not header.lower().endswith(';base64'):
+        raise InvalidPhotoError('照片必須是 base64 data URL')
+    try:
+        data = base64.b64decode(payload, validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise InvalidPhotoError(f'照片 base64 格式錯誤: {e}') from e
+    if not sniff_mimetype(data[:16]):
+        raise InvalidPhotoError('不支援的照片格式')
+    return data
+
+
+def photo_url(digest):
+    return f'{PHOTO_URL_PREFIX}{digest}'
+
+
+def digest_from_reference(reference):
+    """從 Journal.photo 的參照取出雜湊，非參照 (例如舊的 data URL) 回傳 None"""
+    if not isinstance(reference, str) or not reference.startswith(PHOTO_URL_PREFIX):
+        return None
+    digest = reference[len(PHOTO_URL_PREFIX):].split('/', 1)[0]
+    return digest if is_valid_digest(digest) else None
+
+
+class PhotoStore:
+    """照片儲存介面，其他後端 (S3、GCS...) 實作這些方法即可"""
+
+    def put(self, data):
+        """儲存位元組並回傳雜湊；相同內容只會存一份"""
+        digest = hashlib.sha256(data).hexdigest()
+        if not self.exists(digest):
+            self._write(digest, data)
+        return digest
+
+    def put_file(self, fileobj, digest):
+        """儲存已算好雜湊的檔案 (例如上傳時邊接收邊計算)，不必整個讀進記憶體"""
+        if not is_valid_digest(digest):
+            raise InvalidPhotoError('照片雜湊格式錯誤')
+        if not self.exists(digest):
+            self._write_file(digest, fileobj)
+        return digest
+
+    def exists(self, digest):
+        raise NotImplementedError
+
+    def open(self, digest):
+        """回傳可讀取的二進位檔案物件，不存在時丟出 FileNotFoundError"""
+        raise NotImplementedError
+
+    def size(self, digest):
+        raise NotImplementedError
+
+    def delete(self, digest):
+        raise NotImplementedError
+
+    def _write(self, digest, data):
+        raise NotImplementedError
+
+    def _write_file(self, digest, fileobj):
+        # 預設整個讀出再寫入，後端可覆寫為串流寫入
+        self._write(digest, fileobj.read())
+
+
+class LocalPhotoStore(PhotoStore):
+    """本機檔案系統後端，以 ab/cd/<hash> 分層存放"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def path_for(self, digest):
+        if not is_valid_digest(digest):
+            raise FileNotFoundError(digest)
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        try:
+            return os.path.isfile(self.path_for(digest))
+        except FileNotFoundError:
+            return False
+
+    def open(self, digest):
+        return open(self.path_for(digest), 'rb')
+
+    def size(self, digest):
+        return os.path.getsize(self.path_for(digest))
+
+    def delete(self, digest):
+        try:
+            os.remove(self.path_for(digest))
+        except FileNotFoundError:
+            pass
+
+    def _write(self, digest, data):
+        self._atomic_write(digest, lambda f: f.write(data))
+
+    def _write_file(self, digest, fileobj):
+        self._atomic_write(digest, lambda f: shutil.copyfileobj(fileobj, f, COPY_CHUNK_SIZE))
+
+    def _atomic_write(self, digest, writer):
+        # 先寫暫存檔再 rename，其他 worker 不會讀到寫一半的檔案
+        path = self.path_for(digest)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                writer(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+
+_BACKENDS = {
+    'local': LocalPhotoStore,
+}
+
+
+def register_backend(name, factory):
+    """註冊自訂的照片儲存後端"""
+    _BACKENDS[name] = factory
+
+
+def create_photo_store(backend, **options):
+    try:
+        factory = _BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f'未知的照片儲存後端: {backend}') from None
+    return factory(**options)
@@ -0,0 +1,100 @@
+"""API 回應快取：儲存序列化後的回應本體
+
+鍵包含用戶的資料版本，寫入時只要遞增版本，舊的項目就不會再被讀到，
+由 LRU 淘汰或過期時間自然清除，不需要逐一失效。
+"""
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """快取介面，值一律是 bytes；其他後端實作 get/set 即可"""
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryResponseCache(ResponseCache):
+    """單一程序內的 LRU 快取，以位元組總量限制大小"""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisResponseCache(ResponseCache):
+    """多個 gunicorn worker 共用的 Redis 快取，舊版本的項目靠 TTL 過期"""
+
+    def __init__(self, url, ttl=3600, prefix='travel-journal:response:'):
+        try:
+            import redis
+        except ImportError:
+            raise ValueError('使用 redis 回應快取需要先安裝 redis 套件') from None
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+
+_BACKENDS = {
+    'memory': MemoryResponseCache,
+    'redis': RedisResponseCache,
+}
+
+
+def register_backend(name, factory):
+    """註冊自訂的回應快取後端"""
+    _BACKENDS[name] = factory
+
+
+def create_response_cache(backend, **options):
+    try:
+        factory = _BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f'未知的回應快取後端: {backend}') from None
+    return factory(**options)
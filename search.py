@@ -0,0 +1,129 @@
+"""日誌全文搜尋
+
+SQLite 使用 FTS5 虛擬表，PostgreSQL 使用 tsvector + GIN 索引。
+中日韓文字沒有空白分詞，寫入與查詢前都先切成單字與雙字 (bigram)，
+兩種資料庫因此都只需要以空白分詞的設定。
+"""
+import re
+from collections import namedtuple
+
+from sqlalchemy import text
+
+SEARCH_TABLE = 'journal_search'
+
+# 建立索引只需要這些欄位，批次寫入時可直接傳入此結構而不必載入 ORM 物件
+SearchDocument = namedtuple('SearchDocument', ['id', 'user_id', 'location', 'country', 'content'])
+
+_CJK_RANGES = (
+    '\u3040-\u30ff'  # 平假名、片假名
+    '\u3400-\u4dbf'  # CJK 擴充 A
+    '\u4e00-\u9fff'  # CJK 統一表意文字
+    '\uac00-\ud7af'  # 韓文音節
+    '\uf900-\ufaff'  # CJK 相容表意文字
+)
+_TOKEN_RE = re.compile(f'([{_CJK_RANGES}]+)|([^\\W{_CJK_RANGES}]+)')
+
+# 欄位權重：地點 > 國家 > 內容
+_FTS5_WEIGHTS = '3.0, 2.0, 1.0'
+
+
+def tokenize(value, for_query=False):
+    """英數字以單字為單位；中日韓文字切成雙字，索引時另外保留單字以支援單字查詢"""
+    tokens = []
+    for cjk, word in _TOKEN_RE.findall((value or '').lower()):
+        if word:
+            tokens.append(word)
+            continue
+        if len(cjk) == 1:
+            tokens.append(cjk)
+            continue
+        if not for_query:
+            tokens.extend(cjk)
+        tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return tokens
+
+
+def _document(value):
+    return ' '.join(tokenize(value))
+
+
+def supported(dialect):
+    return dialect in ('sqlite', 'postgresql')
+
+
+def create_table(conn, dialect):
+    if dialect == 'sqlite':
+        conn.execute(text(f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+                          "location, country, content, user_id UNINDEXED, tokenize='unicode61')"))
+    elif dialect == 'postgresql':
+        conn.execute(text(f'CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ('
+                          'journal_id INTEGER PRIMARY KEY REFERENCES journals(id) ON DELETE CASCADE, '
+                          'user_id INTEGER NOT NULL, '
+                          'document TSVECTOR NOT NULL)'))
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_document '
+                          f'ON {SEARCH_TABLE} USING GIN (document)'))
+
+
+def index_journal(conn, dialect, journal):
+    """新增或更新一篇日誌的索引，需在寫入日誌的同一個交易中呼叫"""
+    index_journals(conn, dialect, [journal])
+
+
+def index_journals(conn, dialect, journals):
+    if not supported(dialect) or not journals:
+        return
+    remove_journals(conn, dialect, [j.id for j in journals])
+    params = [{
+        'id': j.id,
+        'user_id': j.user_id,
+        'location': _document(j.location),
+        'country': _document(j.country),
+        'content': _document(j.content),
+    } for j in journals]
+    if dialect == 'sqlite':
+        conn.execute(text(f'INSERT INTO {SEARCH_TABLE} (rowid, location, country, content, user_id) '
+                          'VALUES (:id, :location, :country, :content, :user_id)'), params)
+    else:
+        conn.execute(text(f'INSERT INTO {SEARCH_TABLE} (journal_id, user_id, document) VALUES ('
+                          ":id, :user_id, "
+                          "setweight(to_tsvector('simple', :location), 'A') || "
+                          "setweight(to_tsvector('simple', :country), 'B') || "
+                          "setweight(to_tsvector('simple', :content), 'C'))"), params)
+
+
+def remove_journal(conn, dialect, journal_id):
+    remove_journals(conn, dialect, [journal_id])
+
+
+def remove_journals(conn, dialect, journal_ids):
+    if not supported(dialect) or not journal_ids:
+        return
+    key = 'rowid' if dialect == 'sqlite' else 'journal_id'
+    conn.execute(text(f'DELETE FROM {SEARCH_TABLE} WHERE {key} = :id'), [{'id': i} for i in journal_ids])
+
+
+def remove_user(conn, dialect, user_id):
+    if supported(dialect):
+        conn.execute(text(f'DELETE FROM {SEARCH_TABLE} WHERE user_id = :user_id'), {'user_id': user_id})
+
+
+def search(conn, dialect, user_id, query, limit=20, offset=0):
+    """回傳依相關度排序的 [(journal_id, score)]，分數越高越相關"""
+    tokens = tokenize(query, for_query=True)
+    if not tokens or not supported(dialect):
+        return []
+    params = {'user_id': user_id, 'limit': limit, 'offset': offset}
+    if dialect == 'sqlite':
+        # bm25 越小越相關，取負值讓兩種資料庫的分數方向一致
+        params['match'] = ' '.join('"{}"'.format(t.replace('"', '""')) for t in tokens)
+        rows = conn.execute(text(f'SELECT rowid, -bm25({SEARCH_TABLE}, {_FTS5_WEIGHTS}) AS score '
+                                 f'FROM {SEARCH_TABLE} '
+                                 f'WHERE {SEARCH_TABLE} MATCH :match AND user_id = :user_id '
+                                 'ORDER BY score DESC LIMIT :limit OFFSET :offset'), params)
+    else:
+        params['query'] = ' '.join(tokens)
+        rows = conn.execute(text(f"SELECT journal_id, ts_rank(document, q) AS score "
+                                 f"FROM {SEARCH_TABLE}, plainto_tsquery('simple', :query) AS q "
+                                 'WHERE user_id = :user_id AND document @@ q '
+                                 'ORDER BY score DESC LIMIT :limit OFFSET :offset'), params)
+    return [(row[0], float(row[1])) for row in rows]
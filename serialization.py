@@ -0,0 +1,62 @@
+"""JSON 序列化：有安裝 orjson 時使用，否則退回標準函式庫
+
+FastJSONProvider 讓 jsonify 也走同一個編碼器；iter_json_array 可邊查詢邊輸出陣列，
+不必先在記憶體組出整份回應。
+"""
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # 未安裝時使用標準庫
+    orjson = None
+
+# 日期等型別交給 Flask 的 default 處理，輸出與標準庫版本一致
+_ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS) if orjson else 0
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def dumps(obj, default=DefaultJSONProvider.default):
+    """將物件編碼成 UTF-8 的 JSON 位元組 (不跳脫中文)"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS)
+        except TypeError:
+            pass  # 例如非字串的 dict 鍵，改用標準庫
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def iter_json_array(items, chunk_size=STREAM_CHUNK_SIZE):
+    """逐筆編碼可迭代的物件，以約 chunk_size 大小的區塊輸出 JSON 陣列"""
+    buffer = bytearray(b'[')
+    first = True
+    for item in items:
+        if not first:
+            buffer += b','
+        buffer += dumps(item)
+        first = False
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b']'
+    yield bytes(buffer)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify 使用的 JSON provider：不排序鍵、不跳脫中文，回應直接輸出位元組"""
+
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj, default=self.default).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(obj)
+        return self._app.response_class(dumps(obj, default=self.default), mimetype=self.mimetype)
@@ -0,0 +1,51 @@
+"""測試共用設定：匯入 app 之前先指向暫存的 SQLite 資料庫與照片目錄
+
+執行方式：python -m unittest discover tests
+"""
+import logging
+import os
+import sqlite3
+import tempfile
+
+TMP_DIR = tempfile.mkdtemp(prefix='travel-journal-tests-')
+DATABASE_PATH = os.path.join(TMP_DIR, 'test.db')
+
+os.environ.update({
+    'DATABASE_URL': f'sqlite:///{DATABASE_PATH}',
+    'PHOTO_STORAGE_DIR': os.path.join(TMP_DIR, 'photos'),
+    'PHOTO_DERIVATIVE_DIR': os.path.join(TMP_DIR, 'photo-derivatives'),
+    'JOB_SCHEDULER': 'off',
+    'AUTO_MIGRATE': '1',
+})
+
+import app as app_module  # noqa: E402
+
+# 測試會刻意觸發錯誤路徑，不輸出預期中的錯誤紀錄
+logging.disable(logging.ERROR)
+
+
+def reset_database(legacy_sql=None):
+    """刪除資料庫檔案並清空程序內的快取；legacy_sql 為建立舊版結構的 SQL，未提供時建立最新結構"""
+    with app_module.app.app_context():
+        app_module.db.session.remove()
+        app_module.db.engine.dispose()
+    if os.path.exists(DATABASE_PATH):
+        os.remove(DATABASE_PATH)
+    app_module.user_cache.clear()
+    app_module.response_cache.clear()
+    app_module.travel_stats_cache = app_module.TravelStatsCache()
+    app_module._readiness.update(pid=None, ready=False, error=None, checked_at=0.0)
+
+    if legacy_sql:
+        conn = sqlite3.connect(DATABASE_PATH)
+        conn.executescript(legacy_sql)
+        conn.close()
+    else:
+        with app_module.app.app_context():
+            app_module.migrations.upgrade(app_module.db, progress=lambda message: None)
+
+
+def login(client, email='user@example.com'):
+    response = client.post('/register', json={'name': 'tester', 'email': email, 'password': 'secret123'})
+    assert response.status_code in (200, 201), response.get_data(as_text=True)
+    return client
@@ -0,0 +1,59 @@
+import base64
+import unittest
+from unittest import mock
+
+from tests import app_module, login, reset_database
+
+PNG_HEADER = b'\x89PNG\r\n\x1a\n'
+
+
+def photo_data_url(seed):
+    """只需通過檔頭檢查的假照片，seed 不同內容 (雜湊) 就不同"""
+    data = PNG_HEADER + seed.encode() * 32
+    return 'data:image/png;base64,' + base64.b64encode(data).decode()
+
+
+def journal(**fields):
+    return dict({'op': 'create', 'date': '2024-05-01', 'location': 'Taipei', 'country': 'Taiwan',
+                 'content': 'night market'}, **fields)
+
+
+class JournalBatchTest(unittest.TestCase):
+    def setUp(self):
+        reset_database()
+        self.client = login(app_module.app.test_client())
+
+    def batch(self, operations):
+        response = self.client.post('/api/journals/batch', json={'operations': operations})
+        return response.get_json()
+
+    def test_repeated_updates_of_one_journal_in_a_chunk(self):
+        journal_id = self.batch([journal()])['results'][0]['id']
+
+        result = self.batch([{'op': 'update', 'id': journal_id, 'content': 'one'},
+                             {'op': 'update', 'id': journal_id, 'country': 'B'}])
+
+        self.assertTrue(result['success'], result)
+        self.assertEqual(result['summary']['updated'], 2)
+        detail = self.client.get(f'/api/journals/{journal_id}').get_json()
+        self.assertEqual((detail['content'], detail['country']), ('one', 'B'))
+        hits = self.client.get('/api/journals/search?q=one').get_json()['results']
+        self.assertEqual([hit['id'] for hit in hits], [journal_id])
+
+    def test_failed_chunk_releases_only_its_new_photos(self):
+        kept = self.batch([journal(photo=photo_data_url('kept'))])['results'][0]
+        with app_module.app.app_context():
+            kept_reference = app_module.db.session.get(app_module.Journal, kept['id']).photo
+        kept_digest = app_module.digest_from_reference(kept_reference)
+
+        with mock.patch.object(app_module.search, 'index_journals', side_effect=RuntimeError('boom')):
+            result = self.batch([journal(photo=photo_data_url('new')), journal(photo=photo_data_url('kept'))])
+
+        self.assertEqual(result['summary']['failed'], 2)
+        new_digest = app_module.hashlib.sha256(PNG_HEADER + b'new' * 32).hexdigest()
+        self.assertFalse(app_module.photo_store.exists(new_digest))
+        self.assertTrue(app_module.photo_store.exists(kept_digest))
+
+
+if __name__ == '__main__':
+    unittest.main()
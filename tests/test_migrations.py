@@ -0,0 +1,65 @@
+import sqlite3
+import unittest
+
+from tests import DATABASE_PATH, app_module, reset_database
+
+# 遷移機制加入前以 db.create_all() 建立的結構 (journals.date 仍是字串)
+LEGACY_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER NOT NULL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    email VARCHAR(120) NOT NULL UNIQUE,
+    password VARCHAR(200) NOT NULL,
+    is_google BOOLEAN
+);
+CREATE TABLE journals (
+    id INTEGER NOT NULL PRIMARY KEY,
+    date VARCHAR(20) NOT NULL,
+    location VARCHAR(200) NOT NULL,
+    country VARCHAR(100) NOT NULL,
+    content TEXT NOT NULL,
+    lat FLOAT,
+    lng FLOAT,
+    photo TEXT,
+    journal_type VARCHAR(20),
+    user_id INTEGER NOT NULL,
+    created_at DATETIME,
+    updated_at DATETIME,
+    FOREIGN KEY(user_id) REFERENCES users (id)
+);
+INSERT INTO users (id, name, email, password, is_google) VALUES (1, 'a', 'a@example.com', 'x', 0);
+INSERT INTO journals (id, date, location, country, content, lat, lng, photo, journal_type, user_id, created_at)
+VALUES (1, '2023/05/01', 'Taipei', 'Taiwan', 'hello', 25.03, 121.56, NULL, NULL, 1, '2023-05-01 10:00:00'),
+       (2, 'unknown', 'Tokyo', 'Japan', 'hi', 35.68, 139.69, NULL, NULL, 1, '2023-06-01 10:00:00');
+"""
+
+
+class ConvertJournalDateTest(unittest.TestCase):
+    def setUp(self):
+        reset_database(LEGACY_SCHEMA)
+        result = app_module.app.test_cli_runner().invoke(args=['db', 'upgrade'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.conn = sqlite3.connect(DATABASE_PATH)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_date_is_converted_and_not_null(self):
+        columns = {row[1]: row for row in self.conn.execute('PRAGMA table_info(journals)')}
+        self.assertNotIn('date_value', columns)
+        self.assertEqual(columns['date'][2], 'DATE')
+        self.assertEqual(columns['date'][3], 1)
+        self.assertEqual(self.conn.execute('SELECT id, date FROM journals ORDER BY id').fetchall(),
+                         [(1, '2023-05-01'), (2, '2023-06-01')])
+
+    def test_foreign_key_survives_rebuild(self):
+        foreign_keys = [(row[2], row[3], row[4]) for row in self.conn.execute('PRAGMA foreign_key_list(journals)')]
+        self.assertEqual(foreign_keys, [('users', 'user_id', 'id')])
+
+    def test_indexes_are_recreated(self):
+        indexes = {row[1] for row in self.conn.execute('PRAGMA index_list(journals)')}
+        self.assertIn('ix_journals_user_date', indexes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+from datetime import date, datetime, timedelta
+
+from tests import app_module, login, reset_database
+from tests.test_batch import PNG_HEADER, journal, photo_data_url
+
+m = app_module
+
+
+def stored_digest(seed):
+    return m.hashlib.sha256(PNG_HEADER + seed.encode() * 32).hexdigest()
+
+
+class PhotoReleaseTest(unittest.TestCase):
+    def setUp(self):
+        reset_database()
+
+    def test_deleting_a_journal_releases_its_unshared_photo(self):
+        client = login(m.app.test_client())
+        created = client.post('/api/journals/batch', json={'operations': [
+            journal(photo=photo_data_url('only')), journal(photo=photo_data_url('shared')),
+            journal(photo=photo_data_url('shared'))]}).get_json()['results']
+
+        for result in created[:2]:
+            self.assertEqual(client.delete(f"/api/journals/{result['id']}").status_code, 200)
+
+        self.assertFalse(m.photo_store.exists(stored_digest('only')))
+        self.assertTrue(m.photo_store.exists(stored_digest('shared')))
+
+    def test_reaping_guests_releases_their_photos(self):
+        old = datetime.utcnow() - timedelta(days=m.app.config['GUEST_TTL_DAYS'] + 1)
+        with m.app.app_context():
+            references = {seed: m._store_photo(photo_data_url(seed)) for seed in ('guest', 'shared')}
+            guest = m.User(name='guest', email='guest@example.com', password='x', is_google=True, created_at=old)
+            member = m.User(name='member', email='member@example.com', password='x')
+            m.db.session.add_all([guest, member])
+            m.db.session.flush()
+            for user, seed in ((guest, 'guest'), (guest, 'shared'), (member, 'shared')):
+                m.db.session.add(m.Journal(date=date(2024, 5, 1), location='Taipei', country='Taiwan',
+                                           content='x', photo=references[seed], user_id=user.id,
+                                           created_at=old, updated_at=old))
+            m.db.session.commit()
+            guest_id = guest.id
+
+            summary = m.reap_stale_guests()
+
+            self.assertIn('刪除 1 張照片', summary)
+            self.assertIsNone(m.db.session.get(m.User, guest_id))
+        self.assertFalse(m.photo_store.exists(stored_digest('guest')))
+        self.assertTrue(m.photo_store.exists(stored_digest('shared')))
+
+
+if __name__ == '__main__':
+    unittest.main()
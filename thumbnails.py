@@ -0,0 +1,127 @@
+"""照片衍生圖：在背景產生固定尺寸的縮圖並快取在磁碟上"""
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow 未安裝時直接使用原圖
+    Image = None
+
+from photo_store import is_valid_digest
+
+logger = logging.getLogger(__name__)
+
+# 尺寸名稱 -> 最長邊像素：書櫃卡片、地圖彈窗、全尺寸檢視
+DERIVATIVE_SIZES = {
+    'card': 640,
+    'popup': 400,
+    'full': 1600,
+}
+
+
+class ThumbnailGenerator:
+    """從 photo store 讀原圖，產生各尺寸衍生圖；找不到時會即時重建"""
+
+    def __init__(self, store, cache_dir, max_workers=2, max_pending=64, quality=80):
+        self.store = store
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.quality = quality
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._executor = None
+        self._executor_pid = None
+        if Image is not None and features.check('webp'):
+            self.format, self.extension, self.mimetype = 'WEBP', 'webp', 'image/webp'
+            self._save_options = {'quality': quality, 'method': 4}
+        else:
+            self.format, self.extension, self.mimetype = 'JPEG', 'jpg', 'image/jpeg'
+            self._save_options = {'quality': quality, 'optimize': True, 'progressive': True}
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def path_for(self, digest, size):
+        return os.path.join(self.cache_dir, size, digest[:2], f'{digest}.{self.extension}')
+
+    def get(self, digest, size):
+        """回傳衍生圖路徑，快取不存在時在目前執行緒重建"""
+        if size not in DERIVATIVE_SIZES or not is_valid_digest(digest):
+            raise FileNotFoundError(f'{digest}/{size}')
+        path = self.path_for(digest, size)
+        if not os.path.isfile(path):
+            self.build(digest)
+        return path
+
+    def build(self, digest):
+        """一次解碼原圖，由大到小產生所有尺寸"""
+        with self.store.open(digest) as f:
+            image = Image.open(f)
+            image.load()
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA') or (image.mode == 'RGBA' and self.format == 'JPEG'):
+            image = image.convert('RGB')
+
+        for size, edge in sorted(DERIVATIVE_SIZES.items(), key=lambda item: -item[1]):
+            image.thumbnail((edge, edge), Image.LANCZOS)
+            self._save(image, self.path_for(digest, size))
+
+    def delete(self, digest):
+        """刪除原圖已不存在時留下的衍生圖"""
+        if not is_valid_digest(digest):
+            return
+        for size in DERIVATIVE_SIZES:
+            try:
+                os.remove(self.path_for(digest, size))
+            except FileNotFoundError:
+                pass
+
+    def schedule(self, digest):
+        """交給背景執行緒產生；佇列已滿或已在處理時略過，之後讀取時會補建"""
+        if not self.available or not is_valid_digest(digest):
+            return False
+        with self._lock:
+            if digest in self._pending or len(self._pending) >= self.max_pending:
+                return False
+            self._pending.add(digest)
+            executor = self._get_executor()
+        executor.submit(self._run, digest)
+        return True
+
+    def _run(self, digest):
+        try:
+            if not all(os.path.isfile(self.path_for(digest, size)) for size in DERIVATIVE_SIZES):
+                self.build(digest)
+        except Exception as e:
+            logger.error(f"縮圖產生失敗 {digest}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(digest)
+
+    def _get_executor(self):
+        # gunicorn fork 之後父程序的執行緒不會帶過來，每個程序各自建立
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='thumbnail')
+            self._executor_pid = os.getpid()
+            self._pending.clear()
+        return self._executor
+
+    def _save(self, image, path):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, self.format, **self._save_options)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
@@ -0,0 +1,162 @@
+"""旅行統計：依時間排序的日誌座標計算總移動距離、最長的幾段路程與離家最遠的地點
+
+每位用戶的座標與日期存成 NumPy 陣列 (TravelPoints)，距離以向量化的 haversine 一次算完。
+陣列依用戶快取在程序內 (TravelStatsCache)；新日誌接在最後時以 extended 只補上新的幾段，
+插入到中間、修改座標或刪除時才需要整份重新載入。
+"""
+import threading
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:  # 未安裝時無法提供旅行統計
+    np = None
+
+EARTH_RADIUS_KM = 6371.0088
+TOP_LEGS = 5
+
+
+def available():
+    return np is not None
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """兩組座標 (度) 之間的大圓距離，參數可為純量或等長陣列"""
+    lat1, lng1, lat2, lng2 = (np.radians(v) for v in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class TravelPoints:
+    """一位用戶依 (date, created_at, id) 排序的座標點與相鄰兩點的距離
+
+    version 是建立時的資料版本，synced_at 是載入時間；max_id 為看過的最大日誌 id (含沒有座標的)，
+    last_key 為最後一個點的排序鍵，新日誌的排序鍵大於它才能直接接在後面。
+    """
+    __slots__ = ('ids', 'lat', 'lng', 'days', 'legs', 'version', 'synced_at', 'max_id', 'last_key')
+
+    def __init__(self, version, synced_at):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.lat = np.empty(0, dtype=np.float64)
+        self.lng = np.empty(0, dtype=np.float64)
+        self.days = np.empty(0, dtype='datetime64[D]')
+        self.legs = np.empty(0, dtype=np.float64)
+        self.version = version
+        self.synced_at = synced_at
+        self.max_id = 0
+        self.last_key = None
+
+    @classmethod
+    def from_rows(cls, rows, version, synced_at, max_id=0):
+        """rows 為已排序的 (id, lat, lng, date, created_at)，只包含有座標的日誌"""
+        empty = cls(version, synced_at)
+        empty.max_id = max_id
+        return empty.extended(rows, version, synced_at)
+
+    def extended(self, rows, version, synced_at):
+        """回傳接上排在最後面的新座標點後的新物件，只計算新增的距離 (原物件不變，可安全地在多執行緒間共用)"""
+        points = TravelPoints(version, synced_at)
+        points.max_id = self.max_id
+        points.last_key = self.last_key
+        if not rows:
+            for name in ('ids', 'lat', 'lng', 'days', 'legs'):
+                setattr(points, name, getattr(self, name))
+            return points
+
+        ids, lat, lng, days, _ = zip(*rows)
+        lat = np.array(lat, dtype=np.float64)
+        lng = np.array(lng, dtype=np.float64)
+        points.ids = np.concatenate((self.ids, np.array(ids, dtype=np.int64)))
+        points.lat = np.concatenate((self.lat, lat))
+        points.lng = np.concatenate((self.lng, lng))
+        points.days = np.concatenate((self.days, np.array(days, dtype='datetime64[D]')))
+        # 新的幾段從原本的最後一點 (若有) 開始
+        first = max(len(self.lat) - 1, 0)
+        starts = slice(first, len(points.lat) - 1)
+        ends = slice(first + 1, len(points.lat))
+        new_legs = haversine_km(points.lat[starts], points.lng[starts], points.lat[ends], points.lng[ends])
+        points.legs = np.concatenate((self.legs, new_legs))
+        points.max_id = max(self.max_id, int(points.ids.max()))
+        last = rows[-1]
+        points.last_key = (last[3], last[4], last[0])
+        return points
+
+    def position(self, journal_id):
+        """回傳日誌在陣列中的位置，不在其中 (沒有座標) 時回傳 None"""
+        found = np.flatnonzero(self.ids == journal_id)
+        return int(found[0]) if found.size else None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _point(self, index):
+        return {'id': int(self.ids[index]), 'date': str(self.days[index]),
+                'lat': float(self.lat[index]), 'lng': float(self.lng[index])}
+
+    def summary(self, home=None):
+        """home 為 (lat, lng)，未指定時以第一篇有座標的日誌作為出發地"""
+        result = {
+            'points': len(self),
+            'legs': len(self.legs),
+            'total_distance_km': round(float(self.legs.sum()), 1),
+            'longest_legs': [],
+            'home': None,
+            'furthest_from_home': None,
+            'by_year': [],
+        }
+        if not len(self):
+            return result
+
+        if len(self.legs):
+            count = min(TOP_LEGS, len(self.legs))
+            top = np.argpartition(self.legs, -count)[-count:]
+            top = top[np.argsort(self.legs[top])[::-1]]
+            # 第 i 段是第 i 點到第 i + 1 點
+            result['longest_legs'] = [{'from': self._point(i), 'to': self._point(i + 1),
+                                       'distance_km': round(float(self.legs[i]), 1)} for i in top]
+
+            years = self.days[1:].astype('datetime64[Y]').astype(np.int64) + 1970
+            first_year = int(years.min())
+            offsets = years - first_year
+            distances = np.bincount(offsets, weights=self.legs)
+            counts = np.bincount(offsets)
+            result['by_year'] = [{'year': first_year + int(i), 'distance_km': round(float(distances[i]), 1),
+                                  'legs': int(counts[i])} for i in np.flatnonzero(counts)]
+
+        if home is None:
+            home_lat, home_lng = float(self.lat[0]), float(self.lng[0])
+            result['home'] = {'lat': home_lat, 'lng': home_lng, 'journal_id': int(self.ids[0])}
+        else:
+            home_lat, home_lng = home
+            result['home'] = {'lat': home_lat, 'lng': home_lng, 'journal_id': None}
+        from_home = haversine_km(home_lat, home_lng, self.lat, self.lng)
+        furthest = int(from_home.argmax())
+        result['furthest_from_home'] = dict(self._point(furthest), distance_km=round(float(from_home[furthest]), 1))
+        return result
+
+
+class TravelStatsCache:
+    """用戶 id -> TravelPoints 的 LRU；每個 worker 程序各自一份，以資料版本判斷是否需要更新"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            points = self._entries.get(user_id)
+            if points is not None:
+                self._entries.move_to_end(user_id)
+            return points
+
+    def set(self, user_id, points):
+        with self._lock:
+            self._entries[user_id] = points
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
@@ -0,0 +1,86 @@
+"""照片上傳：multipart 檔案邊接收邊寫入暫存檔並計算雜湊
+
+Werkzeug 解析 multipart 時會向 request 要一個可寫入的檔案物件來存放每個上傳檔。
+PhotoUploadRequest 對照片上傳路由改給 HashingSpooledFile：小檔留在記憶體、大檔落到磁碟，
+寫入的同時更新 SHA-256、累計大小並檢查檔頭，超過上限或不是圖片時立刻中止，不必等整個請求收完。
+"""
+import hashlib
+import tempfile
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+from photo_store import sniff_mimetype
+
+# 判斷圖片格式需要的檔頭長度
+_SNIFF_BYTES = 16
+
+
+def _format_size(num_bytes):
+    """錯誤訊息用的大小：依數值改用 MB / KB / B 表示，最多一位小數"""
+    for unit, size in (('MB', 1024 * 1024), ('KB', 1024)):
+        if num_bytes >= size:
+            return f'{num_bytes / size:.1f}'.removesuffix('.0') + unit
+    return f'{num_bytes}B'
+
+
+def _too_large(max_bytes):
+    return RequestEntityTooLarge(f'照片不可超過 {_format_size(max_bytes)}')
+
+
+class HashingSpooledFile:
+    """SpooledTemporaryFile 加上邊寫邊算的雜湊、大小與格式檢查"""
+
+    def __init__(self, max_bytes, spool_size=512 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.mimetype = None
+        self._head = b''
+        self._hash = hashlib.sha256()
+        self._file = tempfile.SpooledTemporaryFile(max_size=spool_size)
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise _too_large(self.max_bytes)
+        if len(self._head) < _SNIFF_BYTES:
+            self._head += data[:_SNIFF_BYTES - len(self._head)]
+            if len(self._head) >= _SNIFF_BYTES:
+                self._check_head()
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def _check_head(self):
+        self.mimetype = sniff_mimetype(self._head)
+        if self.mimetype is None:
+            raise UnsupportedMediaType('不支援的照片格式')
+
+    def seek(self, offset, whence=0):
+        # 解析完成時 werkzeug 會 seek(0)，檔案比檔頭還短的情況在這裡檢查
+        if self.mimetype is None:
+            self._check_head()
+        return self._file.seek(offset, whence)
+
+    @property
+    def digest(self):
+        return self._hash.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class PhotoUploadRequest(Request):
+    """photo_upload_endpoints 中的路由以 HashingSpooledFile 接收上傳檔"""
+
+    photo_upload_endpoints = frozenset()
+    max_photo_bytes = 10 * 1024 * 1024
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint in self.photo_upload_endpoints:
+            if content_length and content_length > self.max_photo_bytes:
+                raise _too_large(self.max_photo_bytes)
+            return HashingSpooledFile(self.max_photo_bytes)
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
@@ -0,0 +1,51 @@
+"""登入用戶快取：每個程序保留最近使用的用戶資料，避免每個請求都查 users 表
+
+快取的是不可變的 CachedUser 而不是 ORM 物件，可安全地跨請求、跨執行緒共用。
+用戶資料變更時由 app 呼叫 invalidate；其他 worker 的副本最晚在 TTL 後過期。
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+CachedUser = namedtuple('CachedUser', ['id', 'name', 'email', 'is_google'])
+
+
+class UserCache:
+    """TTL + LRU：超過 ttl 秒的項目視為不存在，超過 max_entries 時淘汰最久未使用的"""
+
+    def __init__(self, max_entries=1024, ttl=60, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= self.clock():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return user
+
+    def set(self, user):
+        with self._lock:
+            self._entries[user.id] = (user, self.clock() + self.ttl)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)